@@ -0,0 +1,58 @@
+import argparse
+import sys
+import time
+import random
+import pysam
+
+from marker_alignments.pysam2 import compute_alignment_identity, splitMD
+
+def compute_alignment_identity_with_split_md(sam_record):
+    MD_tag = sam_record.get_tag('MD')
+    total_bases = sam_record.infer_query_length()
+    matches = 0.0
+    ops, counts = splitMD(MD_tag)
+    for op,ct in zip(ops, counts):
+        if op == "M":
+            matches += ct
+        if op == "D":
+            total_bases += ct
+    return round(1.0 * matches/total_bases, 6)
+
+def synthetic_reads(num_distinct_reads):
+    rng = random.Random(0)
+    header = pysam.AlignmentHeader.from_dict({"SQ": [{"SN": "marker", "LN": 10000}]})
+    result = []
+    for ix in range(0, num_distinct_reads):
+        read = pysam.AlignedSegment(header)
+        read.query_name = "query_{}".format(ix)
+        read.query_sequence = "A" * 100
+        read.reference_id = 0
+        read.reference_start = 0
+        read.cigarstring = "50M1D50M"
+        parts = [str(rng.randint(0, 30))]
+        for x in range(0, rng.randint(0, 6)):
+            parts.append(rng.choice("ACGT"))
+            parts.append(str(rng.randint(0, 30)))
+        read.set_tag("MD", "".join(parts) + "^A" + str(rng.randint(0, 50)))
+        result.append(read)
+    return result
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+      description="benchmark computing alignment identity from MD tags",
+      formatter_class = argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--num-reads", type=int, action="store", dest="num_reads", help = "Number of reads", default=1000000)
+
+    options=parser.parse_args(argv)
+
+    reads = synthetic_reads(1000)
+    for name, f in [("splitMD", compute_alignment_identity_with_split_md), ("compute_alignment_identity", compute_alignment_identity)]:
+        start = time.perf_counter()
+        for ix in range(0, options.num_reads):
+            f(reads[ix % 1000])
+        t = time.perf_counter() - start
+        print("{}: {:.2f}s, {:.0f} reads/s".format(name, t, options.num_reads / t))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import sys
+import time
+
+from marker_alignments.store import AlignmentStore
+
+def synthetic_rows(num_rows):
+    for ix in range(0, num_rows):
+        yield ("taxon_{}".format(ix % 100), "marker_{}".format(ix % 1000), "query_{}".format(ix // 3), 0.95, 0.01)
+
+def time_one_row_at_a_time(num_rows, sqlite_db_path):
+    alignment_store = AlignmentStore(db_path=sqlite_db_path)
+    start = time.perf_counter()
+    alignment_store.start_bulk_write()
+    for row in synthetic_rows(num_rows):
+        alignment_store.add_alignment(*row)
+    alignment_store.end_bulk_write()
+    return time.perf_counter() - start
+
+def time_batched(num_rows, sqlite_db_path, batch_size):
+    alignment_store = AlignmentStore(db_path=sqlite_db_path, batch_size=batch_size)
+    start = time.perf_counter()
+    alignment_store.start_bulk_write()
+    alignment_store.add_alignments(synthetic_rows(num_rows))
+    alignment_store.end_bulk_write()
+    return time.perf_counter() - start
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+      description="benchmark inserting alignments into the store",
+      formatter_class = argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--num-rows", type=int, action="store", dest="num_rows", help = "Number of synthetic alignments", default=1000000)
+    parser.add_argument("--batch-size", type=int, action="store", dest="batch_size", help = "Batch size for add_alignments", default=10000)
+    parser.add_argument("--sqlite-db-path", type=str, action="store", dest="sqlite_db_path", help = "Store the database under this path instead of in memory", default=None)
+
+    options=parser.parse_args(argv)
+
+    t = time_one_row_at_a_time(options.num_rows, options.sqlite_db_path)
+    print("add_alignment: {:.2f}s, {:.0f} rows/s".format(t, options.num_rows / t))
+    t = time_batched(options.num_rows, options.sqlite_db_path, options.batch_size)
+    print("add_alignments, batch size {}: {:.2f}s, {:.0f} rows/s".format(options.batch_size, t, options.num_rows / t))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import sys
+import os
+import time
+import tempfile
+
+from marker_alignments.main import main as marker_alignments_main
+
+def all_filters_args(options):
+    return [
+      "--input", options.input_alignment_file,
+      "--refdb-format", options.refdb_format,
+      "--output-type", "marker_all",
+      "--num-reads", "1000000",
+      "--min-taxon-num-markers", "2",
+      "--min-taxon-num-reads", "2",
+      "--min-taxon-num-alignments", "2",
+      "--min-taxon-fraction-primary-matches", "0.5",
+      "--min-taxon-better-marker-cluster-averages-ratio", "1.01",
+      "--threshold-avg-match-identity-to-call-known-taxon", "0.97",
+      "--threshold-num-taxa-to-call-unknown-taxon", "1",
+    ]
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+      description="benchmark the whole marker_alignments run, with all filters on",
+      formatter_class = argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--input", type=str, action="store", dest="input_alignment_file", help = "Input SAM/BAM", required=True)
+    parser.add_argument("--refdb-format", type=str, action="store", dest="refdb_format", help = "Refdb format for the patterns", default="generic")
+    parser.add_argument("--backends", type=str, action="store", dest="backends", help = "Comma separated backends to run", default="sqlite,numpy")
+    parser.add_argument("--repeats", type=int, action="store", dest="repeats", help = "Number of runs per backend, the fastest is reported", default=1)
+
+    options=parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for backend in options.backends.split(","):
+            args = all_filters_args(options) + ["--output", os.path.join(tmp_dir, backend + ".tsv"), "--backend", backend]
+            times = []
+            for ix in range(0, options.repeats):
+                start = time.perf_counter()
+                marker_alignments_main(args)
+                times.append(time.perf_counter() - start)
+            print("{}: {:.2f}s".format(backend, min(times)))
+
+if __name__ == '__main__':
+    main()
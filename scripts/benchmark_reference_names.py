@@ -0,0 +1,51 @@
+import argparse
+import sys
+import re
+import time
+import random
+
+from marker_alignments.main import taxon_and_marker, taxa_and_markers_for_references
+from marker_alignments.refdb_pattern import taxon_and_marker_patterns
+
+def synthetic_reference_names(num_references):
+    result = []
+    for ix in range(0, num_references):
+        if ix % 2:
+            result.append("protist-Genus_species_{}-{}at2759-S1".format(ix // 20, ix))
+        else:
+            result.append("{}__X__Y|k__Bacteria.g__Genus.s__Genus_species_{}|UniRef90_{}|UniRef50_{}|993".format(ix, ix // 20, ix, ix))
+    return result
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+      description="benchmark resolving reference names of reads to taxa and markers",
+      formatter_class = argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--num-reads", type=int, action="store", dest="num_reads", help = "Number of reads", default=1000000)
+    parser.add_argument("--num-references", type=int, action="store", dest="num_references", help = "Number of references", default=10000)
+    parser.add_argument("--refdb-format", type=str, action="store", dest="refdb_format", help = "Refdb format for the patterns", default="generic")
+
+    options=parser.parse_args(argv)
+
+    (tp, mp) = taxon_and_marker_patterns(options.refdb_format)
+    pattern_taxon = re.compile(tp)
+    pattern_marker = re.compile(mp)
+    reference_names = synthetic_reference_names(options.num_references)
+    rng = random.Random(0)
+    reference_ids = [rng.randrange(options.num_references) for ix in range(0, options.num_reads)]
+
+    start = time.perf_counter()
+    for reference_id in reference_ids:
+        taxon_and_marker(reference_names[reference_id], pattern_taxon, pattern_marker, {})
+    t = time.perf_counter() - start
+    print("taxon_and_marker per read: {:.2f}s, {:.0f} reads/s".format(t, options.num_reads / t))
+
+    start = time.perf_counter()
+    taxa_and_markers = taxa_and_markers_for_references(reference_names, pattern_taxon, pattern_marker, {})
+    for reference_id in reference_ids:
+        taxa_and_markers[reference_id]
+    t = time.perf_counter() - start
+    print("lookup by reference_id: {:.2f}s, {:.0f} reads/s".format(t, options.num_reads / t))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import argparse
+import sys
+import os
+import re
+import time
+import tempfile
+import pysam
+
+from marker_alignments.main import read_alignments
+from marker_alignments.refdb_pattern import taxon_and_marker_patterns
+from marker_alignments.store import sqlite_profile_options
+
+def time_run(options, sqlite_db_path, sqlite_profile):
+    (tp, mp) = taxon_and_marker_patterns(options.refdb_format)
+    start = time.perf_counter()
+    alignment_store = read_alignments(
+      alignment_file = pysam.AlignmentFile(options.input_alignment_file),
+      sqlite_db_path = sqlite_db_path,
+      sqlite_profile = sqlite_profile,
+      pattern_taxon = re.compile(tp),
+      pattern_marker = re.compile(mp),
+      marker_to_taxon = {},
+      min_mapq = 0,
+      min_query_length = 0,
+      min_match_identity = 0,
+    )
+    load_time = time.perf_counter() - start
+    alignment_store.cluster_markers_by_matches()
+    alignment_store.modify_table_filter_taxa_on_multiple_matches(min_fraction_primary_matches = 0.5)
+    return load_time, time.perf_counter() - start
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+      description="benchmark loading a BAM into an in-memory database, and into an on-disk database with each sqlite profile",
+      formatter_class = argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--input", type=str, action="store", dest="input_alignment_file", help = "Input SAM/BAM", required=True)
+    parser.add_argument("--refdb-format", type=str, action="store", dest="refdb_format", help = "Refdb format for the patterns", default="generic")
+    parser.add_argument("--tmp-dir", type=str, action="store", dest="tmp_dir", help = "Directory for the on-disk databases", default=None)
+
+    options=parser.parse_args(argv)
+
+    load_time, total_time = time_run(options, None, "default")
+    print("in memory: load {:.2f}s, load + clustering + filter {:.2f}s".format(load_time, total_time))
+    for sqlite_profile in sqlite_profile_options:
+        with tempfile.TemporaryDirectory(dir = options.tmp_dir) as tmp_dir:
+            load_time, total_time = time_run(options, os.path.join(tmp_dir, "alignments.db"), sqlite_profile)
+        print("on disk, {}: load {:.2f}s, load + clustering + filter {:.2f}s".format(sqlite_profile, load_time, total_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+import argparse
+import sys
+import os
+import json
+import time
+import shlex
+import random
+import platform
+import tempfile
+import itertools
+import subprocess
+import pysam
+
+# synthetic samples of each size and shape are timed stage by stage, and the results written as JSON
+# so runs of different versions on the same options can be compared with --compare
+# marker_alignments runs through its command line in a subprocess of --python, with only the options and
+# output types every version has, so the installed version doesn't need to match this script
+# stages are timed with --run-report in versions that have it, and each whole run is timed in every version
+
+refdb_format_options = ["eukprot", "chocophlan"]
+
+# taxa come in genera of this many, and multi-mapping reads mostly also match another taxon of the genus
+taxa_per_genus = 5
+read_length = 100
+
+def reference_name(refdb_format, taxon_ix, marker_ix):
+    if refdb_format == "eukprot":
+        # the same BUSCO markers in each taxon
+        return "protist-Genus{}_species_{}-{}at2759-S1".format(taxon_ix // taxa_per_genus, taxon_ix, 1000 + marker_ix)
+    if refdb_format == "chocophlan":
+        return "{}__A0A{}__g{}|k__Bacteria.g__Genus{}.s__Genus{}_species_{}|UniRef90_T{}M{}|UniRef50_T{}M{}|993".format(
+          taxon_ix * 1000 + marker_ix, taxon_ix, marker_ix, taxon_ix // taxa_per_genus, taxon_ix // taxa_per_genus, taxon_ix, taxon_ix, marker_ix, taxon_ix, marker_ix)
+    raise ValueError("Unknown refdb format: " + refdb_format + ". Please choose one of the following: " + ", ".join(refdb_format_options))
+
+def md_tag(rng, num_mismatches):
+    positions = sorted(rng.sample(range(0, read_length), num_mismatches))
+    parts = []
+    previous = 0
+    for position in positions:
+        parts.append(str(position - previous))
+        parts.append(rng.choice("CGT"))
+        previous = position + 1
+    parts.append(str(read_length - previous))
+    return "".join(parts)
+
+def write_synthetic_bam(path, refdb_format, num_reads, num_taxa, markers_per_taxon, multi_mapping_rate, seed):
+    """
+    Write a sorted and indexed BAM of reads aligned to markers of taxa
+
+    Taxa are more or less abundant, by a power law
+    With probability multi_mapping_rate, a read also has secondary alignments to the same marker in other taxa, mostly of the same genus
+
+    :returns: the number of alignments written
+    """
+    rng = random.Random(seed)
+    references = [reference_name(refdb_format, taxon_ix, marker_ix) for taxon_ix in range(0, num_taxa) for marker_ix in range(0, markers_per_taxon)]
+    header = {"HD": {"VN": "1.0", "SO": "unsorted"}, "SQ": [{"SN": reference, "LN": rng.randint(1000, 3000)} for reference in references]}
+    taxon_weights = list(itertools.accumulate(1.0 / (taxon_ix + 1) for taxon_ix in range(0, num_taxa)))
+    num_alignments = 0
+    unsorted_path = path + ".unsorted.bam"
+    with pysam.AlignmentFile(unsorted_path, "wb", header = header) as f:
+        for query_ix in range(0, num_reads):
+            taxon_ix = rng.choices(range(0, num_taxa), cum_weights = taxon_weights)[0]
+            marker_ix = rng.randrange(markers_per_taxon)
+            hits = [(taxon_ix, rng.choice([0, 0, 1, 2, 3]))]
+            if rng.random() < multi_mapping_rate:
+                genus_start = taxon_ix - taxon_ix % taxa_per_genus
+                for other_taxon_ix in set(rng.randrange(genus_start, min(genus_start + taxa_per_genus, num_taxa)) if rng.random() < 0.7 else rng.randrange(num_taxa) for ix in range(0, rng.randint(1, 4))):
+                    if other_taxon_ix != taxon_ix:
+                        hits.append((other_taxon_ix, rng.randint(1, 8)))
+            for hit_ix, (hit_taxon_ix, num_mismatches) in enumerate(hits):
+                alignment = pysam.AlignedSegment()
+                alignment.query_name = "read_{}".format(query_ix)
+                alignment.query_sequence = "A" * read_length
+                alignment.flag = 0 if hit_ix == 0 else 256
+                alignment.reference_id = hit_taxon_ix * markers_per_taxon + marker_ix
+                alignment.reference_start = rng.randrange(800)
+                alignment.mapping_quality = 42 if len(hits) == 1 else rng.choice([0, 1])
+                alignment.cigartuples = [(0, read_length)]
+                alignment.set_tag("MD", md_tag(rng, num_mismatches))
+                f.write(alignment)
+                num_alignments += 1
+    pysam.sort("-o", path, unsorted_path)
+    pysam.index(path)
+    os.remove(unsorted_path)
+    return num_alignments
+
+# output types of the first release
+output_types = ["marker_coverage", "marker_read_count", "marker_cpm", "marker_all", "taxon_coverage", "taxon_read_and_marker_count", "taxon_cpm", "taxon_all", "pairs_of_taxa_shared_queries", "taxa_in_marker_clusters"]
+
+# filters and thresholds of the first release, each run on its own, by the name of its stage in --run-report
+filter_args = {
+  "filter_taxa_on_cluster_averages": ["--min-taxon-better-marker-cluster-averages-ratio", "1.01"],
+  "filter_taxa_on_multiple_matches": ["--min-taxon-fraction-primary-matches", "0.5"],
+  "filter_taxa_on_num_markers_reads_and_alignments": ["--min-taxon-num-markers", "2", "--min-taxon-num-reads", "2", "--min-taxon-num-alignments", "2"],
+  "transform_taxa_on_thresholds_and_clusters": ["--threshold-avg-match-identity-to-call-known-taxon", "0.97", "--threshold-num-taxa-to-call-unknown-taxon", "1"],
+}
+
+# stages of every run of the same sample, timed in each of them
+shared_stages = ["read_alignments", "cluster_markers_by_matches", "cluster_taxa_by_matches"]
+
+cli = ["-c", "from marker_alignments.main import main; main()"]
+
+def has_run_report(python):
+    result = subprocess.run([python, *cli, "--help"], check = True, stdout = subprocess.PIPE, universal_newlines = True)
+    return "--run-report" in result.stdout
+
+def children_cpu_seconds():
+    times = os.times()
+    return times.children_user + times.children_system
+
+def run_cli(python, args, run_report_path):
+    """
+    :param run_report_path: pass --run-report with this path, or None for a version without it
+    :returns: a dict of stage -> wall and CPU seconds: the whole run, including the start of python, as whole_run,
+      and stages of the run report
+    """
+    start_wall = time.perf_counter()
+    start_cpu = children_cpu_seconds()
+    subprocess.run([python, *cli, *args, *(["--run-report", run_report_path] if run_report_path else [])], check = True, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    stages = {"whole_run": {"wall_seconds": time.perf_counter() - start_wall, "cpu_seconds": children_cpu_seconds() - start_cpu}}
+    if run_report_path:
+        with open(run_report_path) as f:
+            for record in json.load(f)["stages"]:
+                stages[record["stage"]] = {"wall_seconds": record["wall_seconds"], "cpu_seconds": record["cpu_seconds"]}
+    return stages
+
+def add_stage(stages, stage, times):
+    if stage in stages:
+        stages[stage] = dict((key, min(stages[stage][key], times[key])) for key in times)
+    else:
+        stages[stage] = times
+
+# a run for each output with no filters, and a run for each filter with taxon_all
+# with --run-report, shared stages are the fastest of all runs, so stages are named as in main.run
+# without it, only whole runs are timed, as whole_run_output_<type> and whole_run_<filter>
+def run_stages(python, bam_path, refdb_format, extra_args, tmp_dir, with_run_report):
+    stages = {}
+    output_path = os.path.join(tmp_dir, "output.tsv")
+    run_report_path = os.path.join(tmp_dir, "run_report.json") if with_run_report else None
+    common_args = ["--input", bam_path, "--refdb-format", refdb_format, "--output", output_path, "--num-reads", "1000000", *extra_args]
+    runs = [("output_" + output_type, "write_outputs", ["--output-type", output_type]) for output_type in output_types]
+    runs += [(filter_stage, filter_stage, ["--output-type", "taxon_all", *args]) for filter_stage, args in filter_args.items()]
+    for name, stage, args in runs:
+        run_times = run_cli(python, [*common_args, *args], run_report_path)
+        add_stage(stages, "whole_run_" + name, run_times["whole_run"])
+        if with_run_report:
+            add_stage(stages, name, run_times[stage])
+            for shared_stage in shared_stages:
+                add_stage(stages, shared_stage, run_times[shared_stage])
+    return stages
+
+def marker_alignments_version(python):
+    result = subprocess.run([python, "-c", "from importlib.metadata import version; print(version('marker_alignments'))"], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, universal_newlines = True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def int_list(value):
+    return [int(x) for x in value.split(",")]
+
+def float_list(value):
+    return [float(x) for x in value.split(",")]
+
+def str_list(value):
+    return value.split(",")
+
+run_keys = ["refdb_format", "num_reads", "markers_per_taxon", "multi_mapping_rate", "extra_args"]
+
+def ratio(seconds, previous_seconds):
+    return "{:.2f}".format(seconds / previous_seconds) if previous_seconds else "NA"
+
+# whole runs compare across all versions, and stages where both versions have --run-report
+def compare(previous, current):
+    previous_runs = dict((tuple(run[key] for key in run_keys), run) for run in previous["runs"])
+    lines = []
+    for run in current["runs"]:
+        previous_run = previous_runs.get(tuple(run[key] for key in run_keys))
+        if not previous_run:
+            continue
+        for stage, times in run["stages"].items():
+            if stage in previous_run["stages"]:
+                previous_times = previous_run["stages"][stage]
+                lines.append("\t".join([*[str(run[key]) for key in run_keys], stage,
+                  "{:.4f}".format(previous_times["wall_seconds"]), "{:.4f}".format(times["wall_seconds"]), ratio(times["wall_seconds"], previous_times["wall_seconds"]),
+                  "{:.4f}".format(previous_times["cpu_seconds"]), "{:.4f}".format(times["cpu_seconds"]), ratio(times["cpu_seconds"], previous_times["cpu_seconds"]),
+                ]))
+    return "\t".join([*run_keys, "stage", "previous_wall_seconds", "wall_seconds", "wall_ratio", "previous_cpu_seconds", "cpu_seconds", "cpu_ratio"]) + "\n" + "".join(line + "\n" for line in lines)
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+      description="benchmark runs of marker_alignments on synthetic samples, and write the times as JSON",
+      epilog="Each combination of the comma separated values is a sample. Times are wall and CPU seconds of the fastest of --repeats runs, of each stage for versions with --run-report, and of each whole run. Install another version of marker_alignments in another environment, and pass its --python, to compare versions",
+      formatter_class = argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--num-reads", type=int_list, action="store", dest="num_reads", help = "Comma separated numbers of reads", default=[10000, 100000])
+    parser.add_argument("--num-taxa", type=int, action="store", dest="num_taxa", help = "Number of taxa in the reference", default=100)
+    parser.add_argument("--markers-per-taxon", type=int_list, action="store", dest="markers_per_taxon", help = "Comma separated numbers of markers per taxon", default=[20])
+    parser.add_argument("--multi-mapping-rate", type=float_list, action="store", dest="multi_mapping_rate", help = "Comma separated fractions of reads with secondary alignments", default=[0.3])
+    parser.add_argument("--refdb-formats", type=str_list, action="store", dest="refdb_formats", help = "Comma separated reference naming styles: " + ", ".join(refdb_format_options), default=refdb_format_options)
+    parser.add_argument("--extra-args", type=str, action="append", dest="extra_args", help = "Arguments for each run, like '--backend numpy', for versions that have them. Repeat to time each", default=None)
+    parser.add_argument("--python", type=str, action="store", dest="python", help = "Python of the environment with the version of marker_alignments to run", default=sys.executable)
+    parser.add_argument("--repeats", type=int, action="store", dest="repeats", help = "Number of runs per sample and --extra-args", default=1)
+    parser.add_argument("--seed", type=int, action="store", dest="seed", help = "Seed for the synthetic samples", default=0)
+    parser.add_argument("--output", type=str, action="store", dest="output_path", help = "Where to write the JSON, - for standard output", default="-")
+    parser.add_argument("--compare", type=str, action="store", dest="compare_path", help = "JSON of an earlier run with the same options, to print the ratio of times of each stage to standard error", default=None)
+
+    options=parser.parse_args(argv)
+    extra_args_options = options.extra_args or [""]
+    with_run_report = has_run_report(options.python)
+
+    for refdb_format in options.refdb_formats:
+        # fails early on an unknown format
+        reference_name(refdb_format, 0, 0)
+
+    result = {
+      "marker_alignments_version": marker_alignments_version(options.python),
+      "stages_from_run_report": with_run_report,
+      "python_version": platform.python_version(),
+      "platform": platform.platform(),
+      "options": dict((key, value) for key, value in vars(options).items() if key not in ["output_path", "compare_path"]),
+      "runs": [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for refdb_format, num_reads, markers_per_taxon, multi_mapping_rate in itertools.product(options.refdb_formats, options.num_reads, options.markers_per_taxon, options.multi_mapping_rate):
+            bam_path = os.path.join(tmp_dir, "sample.bam")
+            num_alignments = write_synthetic_bam(bam_path, refdb_format, num_reads, options.num_taxa, markers_per_taxon, multi_mapping_rate, options.seed)
+            for extra_args in extra_args_options:
+                stages = {}
+                for ix in range(0, options.repeats):
+                    for stage, times in run_stages(options.python, bam_path, refdb_format, shlex.split(extra_args), tmp_dir, with_run_report).items():
+                        add_stage(stages, stage, times)
+                whole_runs_seconds = sum(times["wall_seconds"] for stage, times in stages.items() if stage.startswith("whole_run_"))
+                sys.stderr.write("{} {} reads, {} markers per taxon, multi-mapping rate {}, {}: {:.2f}s\n".format(refdb_format, num_reads, markers_per_taxon, multi_mapping_rate, extra_args or "no extra arguments", whole_runs_seconds))
+                result["runs"].append({
+                  "refdb_format": refdb_format,
+                  "num_reads": num_reads,
+                  "markers_per_taxon": markers_per_taxon,
+                  "multi_mapping_rate": multi_mapping_rate,
+                  "extra_args": extra_args,
+                  "num_alignments": num_alignments,
+                  "stages": stages,
+                })
+            os.remove(bam_path)
+            os.remove(bam_path + ".bai")
+
+    if options.output_path == "-":
+        json.dump(result, sys.stdout, indent = 2)
+        sys.stdout.write("\n")
+    else:
+        with open(options.output_path, 'w') as f:
+            json.dump(result, f, indent = 2)
+
+    if options.compare_path:
+        with open(options.compare_path) as f:
+            sys.stderr.write(compare(json.load(f), result))
+
+if __name__ == '__main__':
+    main()
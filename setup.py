@@ -16,7 +16,7 @@ setuptools.setup(name='marker_alignments',
     entry_points={"console_scripts": [
         "marker_alignments = marker_alignments.main:main",
     ]},
-    install_requires=["pysam", "scipy", "numpy", "sklearn"],
+    install_requires=["pysam", "scipy", "numpy"],
     package_dir={"": "src"},
     packages=setuptools.find_packages(where="src"),
     python_requires=">=3.6",
@@ -0,0 +1,173 @@
+import argparse
+import sys
+import time
+import traceback
+from multiprocessing import Pool
+
+from marker_alignments.main import parse_arguments as parse_sample_arguments, check_options, run, read_marker_to_taxon
+from marker_alignments.matrix import new_matrix_writer, sample_values, matrix_format_options, matrix_output_type_options
+
+# a sample is read from input, or starts from a store saved by an earlier run
+# sqlite_db_path saves each sample's store, for a later batch with from_sqlite_db
+manifest_columns = ["sample", "input", "from_sqlite_db", "num_reads", "outputs", "stats_output", "run_report", "sqlite_trace", "sqlite_db_path"]
+required_manifest_columns = ["sample"]
+
+# options that differ between samples come from the manifest
+per_sample_options = ["--input", "--from-sqlite-db", "--output", "--output-type", "--num-reads", "--stats-output", "--run-report", "--sqlite-trace", "--sqlite-db-path"]
+
+report_header = ["sample", "status", "seconds", "error"]
+
+def read_manifest(path):
+    """
+    Read a tab separated manifest, with a header line, and one sample per line
+
+    :returns: a list of dicts, keyed by column names
+    """
+    with open(path) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        unknown_columns = [column for column in header if column not in manifest_columns]
+        if unknown_columns:
+            raise ValueError("Unknown manifest columns: " + ", ".join(unknown_columns) + ". Please use the following: " + ", ".join(manifest_columns))
+        missing_columns = [column for column in required_manifest_columns if column not in header]
+        if missing_columns:
+            raise ValueError("Missing manifest columns: " + ", ".join(missing_columns))
+        if "input" not in header and "from_sqlite_db" not in header:
+            raise ValueError("The manifest needs an input or a from_sqlite_db column")
+        rows = []
+        for line_number, line in enumerate(f, start = 2):
+            if not line.strip():
+                continue
+            values = line.rstrip("\n").split("\t")
+            if len(values) != len(header):
+                raise ValueError("Line {} of {} has {} fields, expected {}".format(line_number, path, len(values), len(header)))
+            row = dict(zip(header, values))
+            if bool(row.get("input")) == bool(row.get("from_sqlite_db")):
+                raise ValueError("Line {} of {} needs one of input and from_sqlite_db".format(line_number, path))
+            rows.append(row)
+
+    samples = [row["sample"] for row in rows]
+    if len(set(samples)) < len(samples):
+        raise ValueError("Each sample needs its own line in the manifest")
+    return rows
+
+def sample_argv(row, shared_argv):
+    argv = shared_argv + (["--input", row["input"]] if row.get("input") else ["--from-sqlite-db", row["from_sqlite_db"]])
+    if row.get("outputs"):
+        argv += ["--output-type", *row["outputs"].split()]
+    if row.get("num_reads"):
+        argv += ["--num-reads", row["num_reads"]]
+    if row.get("stats_output"):
+        argv += ["--stats-output", row["stats_output"]]
+    if row.get("run_report"):
+        argv += ["--run-report", row["run_report"]]
+    if row.get("sqlite_trace"):
+        argv += ["--sqlite-trace", row["sqlite_trace"]]
+    if row.get("sqlite_db_path"):
+        argv += ["--sqlite-db-path", row["sqlite_db_path"]]
+    return argv
+
+# each worker process gets the reference lookups once
+# matrix is the output type and column of the merged matrix, or None
+worker_args = {}
+
+def init_worker(marker_to_taxon, matrix):
+    worker_args['marker_to_taxon'] = marker_to_taxon
+    worker_args['matrix'] = matrix
+
+# only the matrix column comes back from a worker, not the whole store
+def run_sample(sample_and_options):
+    sample, options = sample_and_options
+    start = time.perf_counter()
+    try:
+        alignment_store = run(options, marker_to_taxon = worker_args['marker_to_taxon'])
+        values = sample_values(alignment_store, *worker_args['matrix'], options.num_reads) if worker_args['matrix'] else None
+        return sample, "ok", time.perf_counter() - start, "", values
+    except Exception as e:
+        sys.stderr.write("Sample " + sample + " failed:\n" + traceback.format_exc())
+        return sample, "failed", time.perf_counter() - start, type(e).__name__ + ": " + str(e).replace("\t", " ").replace("\n", " "), None
+
+def run_samples(samples_and_options, marker_to_taxon, matrix, processes):
+    if processes == 1:
+        init_worker(marker_to_taxon, matrix)
+        for sample_and_options in samples_and_options:
+            yield run_sample(sample_and_options)
+        return
+    with Pool(processes, initializer = init_worker, initargs = (marker_to_taxon, matrix)) as pool:
+        for result in pool.imap(run_sample, samples_and_options):
+            yield result
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+      prog="marker_alignments batch",
+      description="marker_alignments batch - run marker_alignments for each sample in a manifest, in one process pool. Options not listed below are passed to each sample's run",
+      epilog="The manifest is a tab separated file with a header line, and columns: sample, input or from_sqlite_db, and optionally outputs (space separated output_type:path), num_reads, stats_output, run_report, sqlite_trace and sqlite_db_path",
+      formatter_class = argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--manifest", type=str, action="store", dest="manifest_path", help = "Manifest of samples", required=True)
+    parser.add_argument("--processes", type=int, action="store", dest="processes", help = "Number of samples to run at the same time", default=1)
+    parser.add_argument("--report", type=str, action="store", dest="report_path", help = "Where to write the status and time of each sample, '-' for standard output", default="-")
+    parser.add_argument("--matrix", type=str, action="store", dest="matrix_path", help = "Write a sample x feature matrix of all samples under this path", default=None)
+    parser.add_argument("--matrix-format", type=str, action="store", dest="matrix_format", help = "Format of --matrix: tsv (dense, with a line per sample, and a header line of taxa and one of markers for a matrix of markers), triplets (a sample, feature, value line for each nonzero value, written as samples finish), npz (sparse, readable with scipy.sparse.load_npz, with samples, features, feature_taxa and feature_markers arrays). tsv and npz keep samples in temporary files until the last sample, and then hold the whole matrix in memory to write it", default="tsv")
+    parser.add_argument("--matrix-output-type", type=str, action="store", dest="matrix_output_type", help = "Output to make the matrix from, with taxa or markers as features: " + ", ".join(matrix_output_type_options), default="taxon_cpm")
+    parser.add_argument("--matrix-value", type=str, action="store", dest="matrix_value", help = "Column of --matrix-output-type for the matrix values. Default: the first column after taxon and marker", default=None)
+    options, shared_argv = parser.parse_known_args(argv)
+    for arg in shared_argv:
+        if arg.split("=")[0] in per_sample_options:
+            parser.error(arg.split("=")[0] + " is given per sample, in the manifest")
+    return options, shared_argv
+
+def main(argv=sys.argv[1:]):
+    options, shared_argv = parse_arguments(argv)
+
+    if options.processes < 1:
+        raise ValueError("--processes needs to be at least 1")
+
+    if options.matrix_format not in matrix_format_options:
+        raise ValueError("Unknown matrix format: " + options.matrix_format + ". Please choose one of the following: " + ", ".join(matrix_format_options))
+
+    # every sample's options are checked before any sample runs
+    samples_and_options = []
+    # a sample needs no outputs of its own if it goes into the matrix, or its database is saved
+    for row in read_manifest(options.manifest_path):
+        sample_options = parse_sample_arguments(sample_argv(row, shared_argv), outputs_required = not (options.matrix_path or row.get("sqlite_db_path")))
+        check_options(sample_options)
+        if options.matrix_path and options.matrix_output_type in ["marker_all","marker_cpm", "taxon_all", "taxon_cpm"] and not sample_options.num_reads:
+            raise ValueError("num_reads required in the manifest for a matrix of " + options.matrix_output_type + ", for sample " + row["sample"])
+        if options.processes > 1 and sample_options.threads > 1:
+            raise ValueError("--threads can't be used with --processes, as worker processes can't start their own")
+        samples_and_options.append((row["sample"], sample_options))
+
+    if not samples_and_options:
+        return 0
+
+    marker_to_taxon_path = samples_and_options[0][1].refdb_marker_to_taxon_path
+    marker_to_taxon = read_marker_to_taxon(marker_to_taxon_path) if marker_to_taxon_path else {}
+
+    matrix_writer = None
+    matrix = None
+    if options.matrix_path:
+        matrix_writer, matrix_value = new_matrix_writer(options.matrix_format, options.matrix_path, options.matrix_output_type, options.matrix_value)
+        matrix = (options.matrix_output_type, matrix_value)
+
+    num_failed = 0
+    report = sys.stdout if options.report_path == "-" else open(options.report_path, 'w')
+    try:
+        report.write("\t".join(report_header) + "\n")
+        for sample, status, seconds, error, values in run_samples(samples_and_options, marker_to_taxon, matrix, options.processes):
+            report.write("{}\t{}\t{:.2f}\t{}\n".format(sample, status, seconds, error))
+            report.flush()
+            if status != "ok":
+                num_failed += 1
+            # failed samples are left out of the matrix
+            elif matrix_writer:
+                matrix_writer.add_sample(sample, values)
+    finally:
+        if report is not sys.stdout:
+            report.close()
+        if matrix_writer:
+            matrix_writer.close()
+
+    if num_failed:
+        sys.stderr.write("{} of {} samples failed\n".format(num_failed, len(samples_and_options)))
+        return 1
+    return 0
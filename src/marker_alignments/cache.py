@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+
+# alignments after read filters are saved under a cache directory, so that runs which only differ in taxon filters
+# don't read the alignment file again
+# an entry is a file with the store's alignments, and a .json file with the key parameters and read counts
+# entries are keyed on the alignment file's path, size and modification time, and on all parameters of reading it
+cache_format_version = 1
+
+store_file_extensions = {
+  "sqlite": ".sqlite",
+  "numpy": ".npz",
+}
+
+def cache_key(alignment_file_path, backend, **read_parameters):
+    stat = os.stat(alignment_file_path)
+    key = {
+      "cache_format_version": cache_format_version,
+      "alignment_file": os.path.realpath(alignment_file_path),
+      "alignment_file_size": stat.st_size,
+      "alignment_file_mtime_ns": stat.st_mtime_ns,
+      "backend": backend,
+    }
+    key.update(read_parameters)
+    return key
+
+def file_checksum(path):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+def entry_name(key):
+    return hashlib.sha256(json.dumps(key, sort_keys = True).encode()).hexdigest()
+
+def entry_paths(cache_dir, key):
+    name = entry_name(key)
+    return os.path.join(cache_dir, name + store_file_extensions[key["backend"]]), os.path.join(cache_dir, name + ".json")
+
+def find(cache_dir, key):
+    """
+    Find the cache entry for the key
+
+    :returns: path of the file to load alignments from, and read counts saved with them
+              or None if there is no entry
+    """
+    store_path, info_path = entry_paths(cache_dir, key)
+    if not (os.path.exists(store_path) and os.path.exists(info_path)):
+        return None
+    with open(info_path) as f:
+        info = json.load(f)
+    if info["key"] != key:
+        return None
+    # eviction removes the least recently used entries first
+    os.utime(store_path)
+    os.utime(info_path)
+    return store_path, dict(info["read_counts"])
+
+def save(cache_dir, key, alignment_store, read_counts, max_size):
+    os.makedirs(cache_dir, exist_ok = True)
+    store_path, info_path = entry_paths(cache_dir, key)
+    # written under temporary names first, so that a failed or concurrent run doesn't leave half an entry
+    tmp_store_path = store_path + ".tmp" + str(os.getpid())
+    tmp_info_path = info_path + ".tmp" + str(os.getpid())
+    alignment_store.save_alignments(tmp_store_path)
+    with open(tmp_info_path, 'w') as f:
+        # read counts as a list, to keep the order of read filters
+        json.dump({"key": key, "read_counts": list(read_counts.items())}, f, sort_keys = True)
+    os.replace(tmp_store_path, store_path)
+    os.replace(tmp_info_path, info_path)
+    evict(cache_dir, max_size, keep = entry_name(key))
+
+def evict(cache_dir, max_size, keep = None):
+    """
+    Remove least recently used entries until the cache directory takes at most max_size bytes
+    The entry named keep stays, even if it is larger than max_size on its own
+    """
+    entries = {}
+    for file_name in os.listdir(cache_dir):
+        name, extension = os.path.splitext(file_name)
+        if extension not in list(store_file_extensions.values()) + [".json"]:
+            continue
+        stat = os.stat(os.path.join(cache_dir, file_name))
+        size, last_used = entries.get(name, (0, 0))
+        entries[name] = (size + stat.st_size, max(last_used, stat.st_mtime))
+
+    total_size = sum(size for size, last_used in entries.values())
+    for name in sorted(entries, key = lambda name: entries[name][1]):
+        if total_size <= max_size:
+            break
+        if name == keep:
+            continue
+        for extension in list(store_file_extensions.values()) + [".json"]:
+            path = os.path.join(cache_dir, name + extension)
+            if os.path.exists(path):
+                os.remove(path)
+        total_size -= entries[name][0]
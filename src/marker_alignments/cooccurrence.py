@@ -0,0 +1,56 @@
+import itertools
+
+# the rows come sorted by query, so one query is read at a time
+# memory goes with the number of distinct pairs, not with the number of rows a self join would produce
+
+def count_cooccurrences(rows):
+    """
+    Count in how many queries each pair of keys occurs together
+
+    :param rows: (query, key) tuples sorted by query
+    :returns: dictionary from (key, key) to a number of queries, for each pair
+              including a key with itself, with the smaller key first
+    """
+    counts = {}
+    for query, query_rows in itertools.groupby(rows, key=lambda r: r[0]):
+        keys = sorted(set(key for query, key in query_rows))
+        for ix in range(0, len(keys)):
+            for jx in range(ix, len(keys)):
+                pair = (keys[ix], keys[jx])
+                counts[pair] = counts.get(pair, 0) + 1
+    return counts
+
+def symmetric_triples(counts):
+    for (a, b), count in counts.items():
+        yield (a, b, count)
+        if a != b:
+            yield (b, a, count)
+
+def compare_top_identities(rows, tolerance = 1e-6):
+    """
+    For each pair of different keys, count queries they share,
+    and queries where the first key has a higher or equal top identity
+
+    :param rows: (query, key, identity) tuples sorted by query
+    :param tolerance: identities closer than this are equal
+    :returns: dictionary from (key, key) to a list:
+              [num_queries_higher_identity, num_queries_at_least_equal_identity, num_queries_shared]
+    """
+    counts = {}
+    for query, query_rows in itertools.groupby(rows, key=lambda r: r[0]):
+        top_identities = {}
+        for query, key, identity in query_rows:
+            if key not in top_identities or identity > top_identities[key]:
+                top_identities[key] = identity
+        for a, identity_a in top_identities.items():
+            for b, identity_b in top_identities.items():
+                if a == b:
+                    continue
+                pair = (a, b)
+                if pair not in counts:
+                    counts[pair] = [0, 0, 0]
+                c = counts[pair]
+                c[0] += identity_a - identity_b > tolerance
+                c[1] += identity_a - identity_b > -tolerance
+                c[2] += 1
+    return counts
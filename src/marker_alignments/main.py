@@ -1,15 +1,24 @@
 import argparse
 import sys
+import os
 import pysam
 import re
 import math
+import collections
+from multiprocessing import Pool
 
-from marker_alignments.store import AlignmentStore
-from marker_alignments.write import write, output_type_options
-from marker_alignments.mcl import clusters 
+from marker_alignments.store import AlignmentStore, sqlite_profile_options
+from marker_alignments.numpy_store import NumpyAlignmentStore
+from marker_alignments.streaming_store import StreamingMarkerStore, streaming_output_type_options
+from marker_alignments.write import write_outputs, write_read_counts, output_type_options
 from marker_alignments.refdb_pattern import taxon_and_marker_patterns
+from marker_alignments import cache
+from marker_alignments.run_report import RunReport, NoRunReport
+from marker_alignments.sql_trace import SqlTrace
 
-from marker_alignments.pysam2 import compute_contribution_to_marker_coverage, compute_alignment_identity
+from marker_alignments.pysam2 import MarkerCoverageCalculator, compute_alignment_identity
+
+backend_options = ["sqlite", "numpy"]
 
 def next_g(search):
     return next(g for g in search.groups() if g is not None)
@@ -37,37 +46,154 @@ def taxon_and_marker(reference_name, pattern_taxon, pattern_marker, marker_to_ta
         marker = reference_name
     return (taxon, marker)
 
-def read_alignments(alignment_file, sqlite_db_path, pattern_taxon, pattern_marker, marker_to_taxon, min_mapq, min_query_length, min_match_identity):
+def read_alignments(alignment_file, sqlite_db_path, pattern_taxon, pattern_marker, marker_to_taxon, min_mapq, min_query_length, min_match_identity, batch_size = 10000, threads = 1, read_counts = None, sqlite_profile = "default", backend = "sqlite", keep_filter_snapshots = False, streaming = False, sql_trace = None):
+
+    taxa_and_markers = taxa_and_markers_for_references(alignment_file.references, pattern_taxon, pattern_marker, marker_to_taxon)
+    if read_counts is None:
+        read_counts = {}
+    for stage in read_filter_stages + ["kept"]:
+        read_counts[stage] = 0
 
-    alignment_store = AlignmentStore(db_path=sqlite_db_path)
+    if streaming:
+        # a file sorted by coordinate has alignments of a query apart, so it can't be streamed
+        if alignment_file.header.to_dict().get("HD", {}).get("SO") == "coordinate":
+            raise ValueError("--streaming needs the alignments of each query together, but the input is sorted by coordinate. Sort it by query name with samtools sort -n")
+        alignment_store = StreamingMarkerStore()
+    else:
+        alignment_store = new_alignment_store(sqlite_db_path, batch_size = batch_size, sqlite_profile = sqlite_profile, backend = backend, keep_filter_snapshots = keep_filter_snapshots, sql_trace = sql_trace)
     alignment_store.start_bulk_write()
+    read_filters = (min_mapq, min_query_length, min_match_identity)
+    if threads > 1 and alignment_file.has_index() and not streaming:
+        for rows, chunk_read_counts in rows_in_parallel(alignment_file, threads, taxa_and_markers, *read_filters):
+            alignment_store.add_alignments(rows)
+            for stage in chunk_read_counts:
+                read_counts[stage] += chunk_read_counts[stage]
+    else:
+        alignment_store.add_alignments(alignment_rows(alignment_file, taxa_and_markers, *read_filters, read_counts = read_counts, in_file_order = streaming))
+    alignment_store.end_bulk_write()
+    alignment_store.create_indexes()
+    return alignment_store
+
+def new_alignment_store(sqlite_db_path, batch_size = 10000, sqlite_profile = "default", backend = "sqlite", keep_filter_snapshots = False, sql_trace = None):
+    if backend == "numpy":
+        return NumpyAlignmentStore(batch_size=batch_size)
+    return AlignmentStore(db_path=sqlite_db_path, sqlite_profile=sqlite_profile, batch_size=batch_size, keep_filter_snapshots=keep_filter_snapshots, sql_trace=sql_trace)
+
+# reads to the same reference repeat many times, so resolve each reference name once
+# the result is indexed by reference_id
+def taxa_and_markers_for_references(reference_names, pattern_taxon, pattern_marker, marker_to_taxon):
+    result = []
+    for reference_name in reference_names:
+        (taxon, marker) = taxon_and_marker(reference_name, pattern_taxon, pattern_marker, marker_to_taxon)
+        if not taxon:
+            raise ValueError("Could not find taxon in reference name: " + reference_name)
+        if not marker:
+            raise ValueError("Could not find marker in reference name: " + reference_name)
+        result.append((taxon, marker))
+    return result
+
+# read filters, cheapest first, so that a read dropped early doesn't pay for parsing its MD tag
+read_filter_stages = ["unmapped", "mapq", "query_length", "match_identity"]
 
-    for read in alignment_file.fetch():
-        identity = compute_alignment_identity(read)
+# in_file_order reads the file as it is, and needs no index
+# regions are (contig, start, stop) - stop None is the end of the contig
+# a read is in the region where it starts, as fetch also gives reads that start in the region before
+def reads_in_regions(alignment_file, regions):
+    for contig, start, stop in regions:
+        for read in alignment_file.fetch(contig, start, stop):
+            if read.reference_start >= start:
+                yield read
+
+def alignment_rows(alignment_file, taxa_and_markers, min_mapq, min_query_length, min_match_identity, regions = None, read_counts = None, in_file_order = False):
+    if read_counts is None:
+        read_counts = dict((stage, 0) for stage in read_filter_stages + ["kept"])
+    coverage_calculator = MarkerCoverageCalculator(alignment_file)
+    if regions:
+        reads = reads_in_regions(alignment_file, regions)
+    else:
+        reads = alignment_file.fetch(until_eof = in_file_order)
+    num_kept = 0
+    for read in reads:
+        if read.is_unmapped:
+            read_counts["unmapped"] += 1
+            continue
         if read.mapq < min_mapq:
+            read_counts["mapq"] += 1
             continue
-        if read.infer_query_length() < min_query_length:
+        query_length = read.infer_query_length()
+        if query_length < min_query_length:
+            read_counts["query_length"] += 1
             continue
+        identity = compute_alignment_identity(read, query_length)
         if identity < min_match_identity:
+            read_counts["match_identity"] += 1
             continue
-        if not read.reference_name:
+        if read.reference_id < 0:
             raise ValueError("Read missing reference name: " + str(read))
-        (taxon, marker) = taxon_and_marker(read.reference_name, pattern_taxon, pattern_marker, marker_to_taxon)
-        if not taxon:
-            raise ValueError("Could not find taxon in reference name: " + read.reference_name)
-        if not marker:
-            raise ValueError("Could not find marker in reference name: " + read.reference_name)
-
-        alignment_store.add_alignment(
-          taxon = taxon,
-          marker = marker,
-          query = read.query_name,
-          identity = identity,
-          coverage = compute_contribution_to_marker_coverage(alignment_file, read),
-        )
+        (taxon, marker) = taxa_and_markers[read.reference_id]
 
-    alignment_store.end_bulk_write()
-    return alignment_store
+        num_kept += 1
+        yield (taxon, marker, read.query_name, identity, coverage_calculator.contribution_to_marker_coverage(read.reference_id, query_length))
+    read_counts["kept"] += num_kept
+
+# For an indexed file, fetch() goes through the references in order, and each reference by position
+# so reading contiguous batches of regions and concatenating the results in order
+# produces the same rows in the same order as a serial read
+# a batch has at most max_reads_per_batch reads, if reads are spread evenly along each reference,
+# so each worker sends back a bounded list of rows
+max_reads_per_batch = 100000
+
+def region_batches(alignment_file, num_batches):
+    """
+    :returns: a list of batches, each a list of (contig, start, stop) regions
+    """
+    contigs = [(s.contig, s.total) for s in alignment_file.get_index_statistics() if s.total > 0]
+    reads_per_batch = max(1, min(max_reads_per_batch, math.ceil(sum(total for contig, total in contigs) / num_batches)))
+    batches = []
+    batch = []
+    num_reads_in_batch = 0
+    for contig, total in contigs:
+        # long or busy references are split into regions of the same length
+        num_regions = math.ceil(total / reads_per_batch)
+        region_length = math.ceil(alignment_file.get_reference_length(contig) / num_regions)
+        for region_ix in range(0, num_regions):
+            stop = (region_ix + 1) * region_length if region_ix < num_regions - 1 else None
+            batch.append((contig, region_ix * region_length, stop))
+            num_reads_in_batch += total / num_regions
+            if num_reads_in_batch >= reads_per_batch:
+                batches.append(batch)
+                batch = []
+                num_reads_in_batch = 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+# each worker process opens the file once, and gets the reference lookups once
+worker_args = {}
+
+def init_worker(alignment_file_path, *args):
+    worker_args['alignment_file'] = pysam.AlignmentFile(alignment_file_path)
+    worker_args['args'] = args
+
+def rows_for_regions(regions):
+    read_counts = dict((stage, 0) for stage in read_filter_stages + ["kept"])
+    rows = list(alignment_rows(worker_args['alignment_file'], *worker_args['args'], regions = regions, read_counts = read_counts))
+    return rows, read_counts
+
+def rows_in_parallel(alignment_file, threads, *args):
+    # more batches than workers, so that a batch with many reads doesn't hold everyone up
+    batches = region_batches(alignment_file, threads * 4)
+    with Pool(threads, initializer = init_worker, initargs = (alignment_file.filename.decode(), *args)) as pool:
+        # at most this many batches are read ahead of the one being added to the store, unlike with imap
+        # so finished batches don't pile up while the store is slower than the workers
+        max_pending = threads * 2
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(pool.apply_async(rows_for_regions, (batch,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
 
 def read_marker_to_taxon(path):
     result = {}
@@ -77,20 +203,32 @@ def read_marker_to_taxon(path):
             result[marker] = taxon
     return result
 
-def parse_arguments(argv=sys.argv[1:]):
+# a run without outputs is possible from the batch mode, which can collect results from each sample's store
+def parse_arguments(argv=sys.argv[1:], outputs_required = True):
     parser = argparse.ArgumentParser(
       description="summarize_marker_alignments - process and summarise alignments of metagenomic sequencing reads to reference databases of marker genes",
       formatter_class = argparse.RawDescriptionHelpFormatter,
     )
-    parser.add_argument("--input", type=str, action="store", dest="input_alignment_file", help = "Input SAM/BAM", required=True)
+    parser.add_argument("--input", type=str, action="store", dest="input_alignment_file", help = "Input SAM/BAM")
+    parser.add_argument("--from-sqlite-db", type=str, action="store", dest="from_sqlite_db_path", help = "Instead of --input, start from a database saved with --sqlite-db-path or --cache-dir by an earlier run without taxon filters. Skips reading alignments and, if the database has them, clustering markers - for trying different filters and outputs", default=None)
     parser.add_argument("--sqlite-db-path", type=str, action="store", dest="sqlite_db_path", help = "Store a sqlite database under this path instead of in memory", default=None)
+    parser.add_argument("--backend", type=str, action="store", dest="backend", help = "Where to keep and query the alignments: " + ", ".join(backend_options) + ". 'numpy' keeps them in memory as arrays and is often faster, but can't be saved with --sqlite-db-path", default="sqlite")
+    parser.add_argument("--sqlite-profile", type=str, action="store", dest="sqlite_profile", help = "Settings for the sqlite database: " + ", ".join(sqlite_profile_options) + ". 'wal' and 'unsafe' are faster with --sqlite-db-path, and 'unsafe' can leave a corrupt database if the run fails", default="default")
+    parser.add_argument("--keep-filter-snapshots", action="store_true", dest="keep_filter_snapshots", help = "Keep a copy of the alignments from before each filter in the sqlite database, as alignment_pre_filter_on_<filter> tables - for debugging, as it takes a lot of space")
+    parser.add_argument("--cache-dir", type=str, action="store", dest="cache_dir", help = "Save alignments after read filters in this directory, and reuse them in later runs with the same input and read filters", default=None)
+    parser.add_argument("--cache-max-size-mb", type=int, action="store", dest="cache_max_size_mb", help = "Remove least recently used entries from --cache-dir above this size", default=10240)
+    parser.add_argument("--streaming", action="store_true", dest="streaming", help = "Add each query's alignments to per-marker sums as the input is read, instead of keeping alignments. Needs the alignments of each query together, as an aligner writes them or after samtools sort -n. Only for marker and taxon outputs, without taxon filters, and memory depends on the number of markers rather than alignments")
     parser.add_argument("--refdb-format", type=str, action="store", dest="refdb_format", help = "Reference database used for alignment, required for parsing reference names. Supported values: eukprot, chocophlan, generic, no-split (no split into marker and taxon)", default="generic")
     parser.add_argument("--refdb-regex-taxon", type=str, action="store", dest="refdb_regex_taxon", help = "Regex to read taxon name from reference name")
     parser.add_argument("--refdb-regex-marker", type=str, action="store", dest="refdb_regex_marker", help = "Regex to read marker name from reference name")
     parser.add_argument("--refdb-marker-to-taxon-path", type=str, action="store", dest="refdb_marker_to_taxon_path", help = "Lookup file, two columns - marker name, taxon name")
     parser.add_argument("--num-reads", type=int, action="store", dest="num_reads", help = "Total number of reads (required for CPM output)")
-    parser.add_argument("--output-type", type=str, action="store", dest="output_type", help = "output type: "+", ".join(output_type_options), default = "marker_coverage")
-    parser.add_argument("--output", type=str, action="store", dest="output_path", help = "output path", required=True)
+    parser.add_argument("--output-type", type=str, action="append", nargs="+", dest="output_type", help = "output type: "+", ".join(output_type_options) + ". Default: marker_coverage. To write several outputs from one run, give each as type:path, e.g. --output-type marker_all:markers.tsv taxon_all:taxa.tsv")
+    parser.add_argument("--output", type=str, action="store", dest="output_path", help = "output path, - for standard output. Paths ending with .gz or .zst are compressed. Required unless each --output-type is given as type:path")
+    parser.add_argument("--stats-output", type=str, action="store", dest="stats_output_path", help = "Write how many alignments each read filter dropped to this path", default=None)
+    parser.add_argument("--run-report", type=str, action="store", dest="run_report_path", help = "Write the wall time, CPU time, alignments in and out, and peak memory of each stage to this path as JSON, and a summary line to standard error", default=None)
+    parser.add_argument("--sqlite-trace", type=str, action="store", dest="sqlite_trace_path", help = "Write each SQL statement with its number of runs, time, and query plan, naming statements with full scans and temporary B-trees, to this path as JSON. Slows down the run", default=None)
+    parser.add_argument("--threads", type=int, action="store", dest="threads", help = "Number of processes for reading an indexed BAM and for clustering", default=1)
     parser.add_argument("--min-read-mapq", type=int, action="store", dest="min_read_mapq", help = "when reading the input, skip alignments with MAPQ < min-read-mapq", default=0)
     parser.add_argument("--min-read-query-length", type=int, action="store", dest="min_read_query_length", help = "when reading the input, skip alignments shorter than min-read-query-length", default=0)
     parser.add_argument("--min-read-match-identity", type=float, action="store", dest="min_read_match_identity", help = "when reading the input, skip alignments where the proportion of matching bases in the alignment is less than min-read-match-identity", default=0)
@@ -105,16 +243,87 @@ def parse_arguments(argv=sys.argv[1:]):
     parser.add_argument("--threshold-num-markers-to-call-unknown-taxon", type=int, action="store", dest="threshold_num_markers_to_call_unknown_taxon", help = "To positively identify an unknown taxon (fits all criteria except match identity) expect this many markers from a taxon cluster")
     parser.add_argument("--threshold-num-taxa-to-call-unknown-taxon", type=int, action="store", dest="threshold_num_taxa_to_call_unknown_taxon", help = "To positively identify an unknown taxon (fits all criteria except match identity) expect this many taxa from a taxon cluster")
     result = parser.parse_args(argv)
+
+    if bool(result.input_alignment_file) == bool(result.from_sqlite_db_path):
+        parser.error("exactly one of the following arguments is required: --input, --from-sqlite-db")
+
+    # a list of (output type, output path)
+    result.outputs = []
+    if not (outputs_required or result.output_type or result.output_path):
+        return result
+    for output_type in [t for ts in (result.output_type or [["marker_coverage"]]) for t in ts]:
+        output_type, has_path, output_path = output_type.partition(":")
+        if not has_path:
+            output_path = result.output_path
+        if not output_path:
+            parser.error("the following arguments are required: --output, unless each --output-type is given as type:path")
+        result.outputs.append((output_type, output_path))
     return result
 
 def main(argv=sys.argv[1:]):
+    if argv[:1] == ["batch"]:
+        # imported here, because the batch module runs samples with this module's functions
+        from marker_alignments.batch import main as batch_main
+        return batch_main(argv[1:])
+
     options=parse_arguments(argv)
+    check_options(options)
+    run(options)
+
+def taxon_filters_requested(options):
+    return any([
+      options.min_taxon_better_cluster_averages_ratio, options.min_taxon_fraction_primary_matches,
+      options.min_taxon_num_markers, options.min_taxon_num_reads, options.min_taxon_num_alignments,
+      options.threshold_identity_to_call_taxon, options.threshold_num_reads_to_call_unknown_taxon,
+      options.threshold_num_markers_to_call_unknown_taxon, options.threshold_num_taxa_to_call_unknown_taxon,
+    ])
 
+# raises ValueError for options that can't work together, and sets refdb regexes from --refdb-format
+def check_options(options):
     if options.min_read_mapq and (options.min_taxon_fraction_primary_matches or options.min_taxon_better_cluster_averages_ratio) :
         raise ValueError("It us unwise to combine --min-read-mapq and filters that rely on secondary matches!")
 
-    if options.output_type not in output_type_options:
-        raise ValueError("Unknown output type: " + options.output_type + ". Please choose one of the following: " + ", ".join(output_type_options))
+    if options.backend not in backend_options:
+        raise ValueError("Unknown backend: " + options.backend + ". Please choose one of the following: " + ", ".join(backend_options))
+
+    if options.backend != "sqlite" and options.sqlite_db_path:
+        raise ValueError("--sqlite-db-path needs the sqlite backend")
+
+    if options.backend != "sqlite" and options.keep_filter_snapshots:
+        raise ValueError("--keep-filter-snapshots needs the sqlite backend")
+
+    if (options.backend != "sqlite" or options.streaming) and options.sqlite_trace_path:
+        raise ValueError("--sqlite-trace needs the sqlite backend, without --streaming")
+
+    if options.from_sqlite_db_path:
+        if options.backend != "sqlite":
+            raise ValueError("--from-sqlite-db needs the sqlite backend")
+        if options.stats_output_path:
+            raise ValueError("--stats-output needs --input, as read filter statistics are not saved in the database")
+        if options.cache_dir:
+            raise ValueError("--cache-dir needs --input")
+        if options.sqlite_db_path and os.path.realpath(options.sqlite_db_path) == os.path.realpath(options.from_sqlite_db_path):
+            raise ValueError("--from-sqlite-db is copied and left as it was, so --sqlite-db-path needs to be a different path")
+
+    if options.streaming:
+        if options.from_sqlite_db_path or options.sqlite_db_path or options.cache_dir or options.keep_filter_snapshots:
+            raise ValueError("--streaming keeps no alignments, so it can't be used with --from-sqlite-db, --sqlite-db-path, --cache-dir, or --keep-filter-snapshots")
+        if taxon_filters_requested(options):
+            raise ValueError("--streaming keeps no alignments, so it can't be used with taxon filters and thresholds")
+        for output_type, output_path in options.outputs:
+            if output_type not in streaming_output_type_options:
+                raise ValueError("Output type not available with --streaming: " + output_type + ". Please choose one of the following: " + ", ".join(streaming_output_type_options))
+
+    if options.sqlite_profile not in sqlite_profile_options:
+        raise ValueError("Unknown sqlite profile: " + options.sqlite_profile + ". Please choose one of the following: " + ", ".join(sqlite_profile_options))
+
+    for output_type, output_path in options.outputs:
+        if output_type not in output_type_options:
+            raise ValueError("Unknown output type: " + output_type + ". Please choose one of the following: " + ", ".join(output_type_options))
+
+    output_paths = [output_path for output_type, output_path in options.outputs]
+    if len(set(output_paths)) < len(output_paths):
+        raise ValueError("Each output needs its own path: " + ", ".join(output_paths))
 
     if options.refdb_format:
         (tp, mp) = taxon_and_marker_patterns(options.refdb_format)
@@ -126,40 +335,120 @@ def main(argv=sys.argv[1:]):
     if not (options.refdb_regex_taxon and options.refdb_regex_marker):
         raise ValueError("Please provide either refdb format, or taxon + marker regexes")
 
-    if options.output_type in ["marker_all","marker_cpm", "taxon_all", "taxon_cpm"] and not options.num_reads:
-        raise ValueError("--num-reads required for calculating " + options.output_type)
+    for output_type, output_path in options.outputs:
+        if output_type in ["marker_all","marker_cpm", "taxon_all", "taxon_cpm"] and not options.num_reads:
+            raise ValueError("--num-reads required for calculating " + output_type)
+
+# marker_to_taxon can be given when it was read already, like in a batch of samples
+def run(options, marker_to_taxon = None):
+    sql_trace = SqlTrace() if options.sqlite_trace_path else None
+    # the trace is also written when a run fails or is interrupted, as for a run that takes too long
+    try:
+        return run_with_sql_trace(options, marker_to_taxon, sql_trace)
+    finally:
+        if sql_trace:
+            sql_trace.write(options.sqlite_trace_path)
 
-    alignment_store = read_alignments(
-      alignment_file = pysam.AlignmentFile(options.input_alignment_file),
+def run_with_sql_trace(options, marker_to_taxon, sql_trace):
+    store_options = dict(
       sqlite_db_path = options.sqlite_db_path,
-      marker_to_taxon = read_marker_to_taxon(options.refdb_marker_to_taxon_path) if options.refdb_marker_to_taxon_path else {},
-      pattern_taxon = re.compile(options.refdb_regex_taxon),
-      pattern_marker = re.compile(options.refdb_regex_marker),
-      min_mapq = options.min_read_mapq,
-      min_query_length = options.min_read_query_length,
-      min_match_identity = options.min_read_match_identity,
+      sqlite_profile = options.sqlite_profile,
+      backend = options.backend,
+      keep_filter_snapshots = options.keep_filter_snapshots,
+      sql_trace = sql_trace,
     )
 
-    alignment_store.cluster_markers_by_matches()
+    run_report = RunReport() if options.run_report_path else NoRunReport()
+
+    cache_entry = None
+    if options.cache_dir:
+        key = cache.cache_key(options.input_alignment_file, options.backend,
+          refdb_regex_taxon = options.refdb_regex_taxon,
+          refdb_regex_marker = options.refdb_regex_marker,
+          refdb_marker_to_taxon_checksum = cache.file_checksum(options.refdb_marker_to_taxon_path) if options.refdb_marker_to_taxon_path else None,
+          min_read_mapq = options.min_read_mapq,
+          min_read_query_length = options.min_read_query_length,
+          min_read_match_identity = options.min_read_match_identity,
+        )
+        cache_entry = cache.find(options.cache_dir, key)
+
+    if options.from_sqlite_db_path:
+        alignment_store = new_alignment_store(**store_options)
+        with run_report.stage("load_alignments", alignment_store):
+            alignment_store.load_alignments(options.from_sqlite_db_path)
+        applied_filters = alignment_store.applied_filters()
+        if applied_filters:
+            raise ValueError("The alignments in " + options.from_sqlite_db_path + " were already filtered on: " + ", ".join(applied_filters) + ". Please start from a database saved by a run without taxon filters")
+    elif cache_entry:
+        cached_store_path, read_counts = cache_entry
+        alignment_store = new_alignment_store(**store_options)
+        with run_report.stage("load_alignments", alignment_store):
+            alignment_store.load_alignments(cached_store_path)
+    else:
+        if marker_to_taxon is None:
+            marker_to_taxon = read_marker_to_taxon(options.refdb_marker_to_taxon_path) if options.refdb_marker_to_taxon_path else {}
+        read_counts = {}
+        with run_report.stage("read_alignments") as stage:
+            alignment_store = read_alignments(
+              alignment_file = pysam.AlignmentFile(options.input_alignment_file),
+              marker_to_taxon = marker_to_taxon,
+              pattern_taxon = re.compile(options.refdb_regex_taxon),
+              pattern_marker = re.compile(options.refdb_regex_marker),
+              min_mapq = options.min_read_mapq,
+              min_query_length = options.min_read_query_length,
+              min_match_identity = options.min_read_match_identity,
+              threads = options.threads,
+              read_counts = read_counts,
+              streaming = options.streaming,
+              **store_options
+            )
+            stage["rows_in"] = sum(read_counts.values())
+            stage["rows_out"] = read_counts["kept"]
+        if options.cache_dir:
+            with run_report.stage("save_cache"):
+                cache.save(options.cache_dir, key, alignment_store, read_counts, max_size = options.cache_max_size_mb * 1024 * 1024)
+
+    if options.stats_output_path:
+        write_read_counts(read_counts, options.stats_output_path)
+
+    # the streaming store only has per marker sums, for outputs that need nothing else
+    if options.streaming:
+        with run_report.stage("write_outputs") as stage:
+            stage["rows_out"] = write_outputs(alignment_store, options.outputs, options.num_reads)
+        run_report.write(options.run_report_path)
+        return alignment_store
+
+    # a saved store has marker clusters if it was saved after clustering
+    if not (options.from_sqlite_db_path and alignment_store.has_marker_clusters()):
+        with run_report.stage("cluster_markers_by_matches", alignment_store):
+            alignment_store.cluster_markers_by_matches(processes = options.threads)
 
     if options.min_taxon_better_cluster_averages_ratio:
-        alignment_store.modify_table_filter_taxa_on_cluster_averages(min_better_cluster_averages_ratio = options.min_taxon_better_cluster_averages_ratio)
+        with run_report.stage("filter_taxa_on_cluster_averages", alignment_store):
+            alignment_store.modify_table_filter_taxa_on_cluster_averages(min_better_cluster_averages_ratio = options.min_taxon_better_cluster_averages_ratio)
 
     if options.min_taxon_fraction_primary_matches:
-        alignment_store.modify_table_filter_taxa_on_multiple_matches(min_fraction_primary_matches = options.min_taxon_fraction_primary_matches)
+        with run_report.stage("filter_taxa_on_multiple_matches", alignment_store):
+            alignment_store.modify_table_filter_taxa_on_multiple_matches(min_fraction_primary_matches = options.min_taxon_fraction_primary_matches)
 
     if options.min_taxon_num_markers or options.min_taxon_num_reads or options.min_taxon_num_alignments:
-        alignment_store.modify_table_filter_taxa_on_num_markers_reads_and_alignments(min_num_markers = options.min_taxon_num_markers or 0, min_num_reads = options.min_taxon_num_reads or 0, min_num_alignments = options.min_taxon_num_alignments or 0)
+        with run_report.stage("filter_taxa_on_num_markers_reads_and_alignments", alignment_store):
+            alignment_store.modify_table_filter_taxa_on_num_markers_reads_and_alignments(min_num_markers = options.min_taxon_num_markers or 0, min_num_reads = options.min_taxon_num_reads or 0, min_num_alignments = options.min_taxon_num_alignments or 0)
 
 
-    alignment_store.cluster_taxa_by_matches()
+    with run_report.stage("cluster_taxa_by_matches", alignment_store):
+        alignment_store.cluster_taxa_by_matches(processes = options.threads)
 
     if options.threshold_identity_to_call_taxon or options.threshold_num_reads_to_call_unknown_taxon or options.threshold_num_markers_to_call_unknown_taxon or options.threshold_num_taxa_to_call_unknown_taxon:
-        alignment_store.modify_table_transform_taxa_on_thresholds_and_clusters(
-                threshold_identity = options.threshold_identity_to_call_taxon or 0,
-                min_num_taxa_below_identity = options.threshold_num_taxa_to_call_unknown_taxon or 0,
-                min_num_markers_below_identity = options.threshold_num_markers_to_call_unknown_taxon or 0,
-                min_num_reads_below_identity = options.threshold_num_reads_to_call_unknown_taxon or 0
-        )
+        with run_report.stage("transform_taxa_on_thresholds_and_clusters", alignment_store):
+            alignment_store.modify_table_transform_taxa_on_thresholds_and_clusters(
+                    threshold_identity = options.threshold_identity_to_call_taxon or 0,
+                    min_num_taxa_below_identity = options.threshold_num_taxa_to_call_unknown_taxon or 0,
+                    min_num_markers_below_identity = options.threshold_num_markers_to_call_unknown_taxon or 0,
+                    min_num_reads_below_identity = options.threshold_num_reads_to_call_unknown_taxon or 0
+            )
 
-    write(alignment_store, options.output_type, options.output_path, options.num_reads)
+    with run_report.stage("write_outputs") as stage:
+        stage["rows_out"] = write_outputs(alignment_store, options.outputs, options.num_reads)
+    run_report.write(options.run_report_path)
+    return alignment_store
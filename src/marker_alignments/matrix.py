@@ -0,0 +1,163 @@
+import itertools
+import tempfile
+import numpy as np
+
+from marker_alignments.store import AlignmentStore
+from marker_alignments.write import get_output, open_output, field_formats, printf_format
+
+# a sample x feature matrix of one column of an output, for many samples
+# features are taxa, or markers of taxa, so only outputs with a line per taxon or per marker can be used
+matrix_output_type_options = ["marker_coverage", "marker_read_count", "marker_cpm", "marker_all", "taxon_coverage", "taxon_read_and_marker_count", "taxon_cpm", "taxon_all"]
+matrix_format_options = ["tsv", "triplets", "npz"]
+feature_columns = ["taxon", "marker"]
+
+# npz also names a marker feature by its taxon and marker joined, for display - taxa can have the separator
+# in their names, like with --refdb-marker-to-taxon-path, so its feature_taxa and feature_markers tell features apart
+feature_separator = "|"
+
+def output_header(output_type):
+    # headers come from the queries, so an empty store has them too
+    header, lines = get_output(AlignmentStore(), output_type, 1)
+    return list(header)
+
+def sample_values(alignment_store, output_type, value_column, num_reads):
+    """
+    One column of an output
+
+    :returns: a list of (feature, value), where feature is a tuple of taxon, or of taxon and marker
+    """
+    header, lines = get_output(alignment_store, output_type, num_reads)
+    header = list(header)
+    num_feature_columns = len([column for column in header if column in feature_columns])
+    value_ix = header.index(value_column)
+    return [(tuple(line[:num_feature_columns]), line[value_ix]) for line in lines]
+
+# samples are added in the order they should appear in, and each sample's values are written out or
+# compacted when it's added, so memory doesn't grow with the number of samples times the number of features
+class TripletsMatrixWriter:
+    def __init__(self, path, feature_header, value_column):
+        self.__f = open_output(path)
+        self.__f.write("\t".join(["sample", *feature_header, value_column]) + "\n")
+        self.__formatter = "%s\t" * (1 + len(feature_header)) + printf_format(field_formats[value_column]) + "\n"
+
+    # zeros are left out, like in a sparse matrix
+    def add_sample(self, sample, values):
+        self.__f.write("".join(self.__formatter % (sample, *feature, value) for feature, value in values if value))
+
+    def close(self):
+        self.__f.close()
+
+# columns are known only after the last sample, so the samples wait in a temporary file
+# a matrix of markers has a header line of taxa and a header line of markers, instead of a header line of samples
+class DenseTsvMatrixWriter:
+    def __init__(self, path, feature_header, value_column):
+        self.__path = path
+        self.__feature_header = feature_header
+        self.__value_format = printf_format(field_formats[value_column])
+        self.__samples = []
+        self.__features = set()
+        self.__spool = tempfile.TemporaryFile('w+')
+
+    def add_sample(self, sample, values):
+        self.__samples.append(sample)
+        for feature, value in values:
+            self.__features.add(feature)
+            # str of a float reads back as the same float
+            self.__spool.write("\t".join([str(len(self.__samples) - 1), *feature, str(float(value))]) + "\n")
+
+    def close(self):
+        features = sorted(self.__features)
+        feature_ixs = dict((feature, ix) for ix, feature in enumerate(features))
+        zero = self.__value_format % 0
+        self.__spool.seek(0)
+        lines_by_sample = itertools.groupby((line.rstrip("\n").split("\t") for line in self.__spool), key = lambda fields: int(fields[0]))
+        next_sample = next(lines_by_sample, None)
+        with open_output(self.__path) as f:
+            if len(self.__feature_header) == 1:
+                f.write("\t".join(["sample", *[feature[0] for feature in features]]) + "\n")
+            else:
+                for ix, column in enumerate(self.__feature_header):
+                    f.write("\t".join([column, *[feature[ix] for feature in features]]) + "\n")
+            for sample_ix, sample in enumerate(self.__samples):
+                row = [zero] * len(features)
+                if next_sample and next_sample[0] == sample_ix:
+                    for fields in next_sample[1]:
+                        row[feature_ixs[tuple(fields[1:-1])]] = self.__value_format % float(fields[-1])
+                    next_sample = next(lines_by_sample, None)
+                f.write("\t".join([sample, *row]) + "\n")
+        self.__spool.close()
+
+# the compressed sparse row arrays of scipy.sparse.save_npz, with the names of samples and features
+# so scipy.sparse.load_npz reads the matrix
+# features also come as feature_taxa, and feature_markers for a matrix of markers
+# like for tsv, the samples wait in temporary files, and only the finished matrix is held in memory
+class NpzMatrixWriter:
+    def __init__(self, path, feature_header, value_column):
+        self.__path = path
+        self.__feature_header = feature_header
+        self.__samples = []
+        self.__feature_ixs = {}
+        self.__indices_spool = tempfile.TemporaryFile()
+        self.__data_spool = tempfile.TemporaryFile()
+        self.__indptr = [0]
+
+    def add_sample(self, sample, values):
+        self.__samples.append(sample)
+        indices = np.array([self.__feature_ixs.setdefault(feature, len(self.__feature_ixs)) for feature, value in values], dtype = np.int64)
+        self.__indices_spool.write(indices.tobytes())
+        self.__data_spool.write(np.array([value for feature, value in values], dtype = np.float64).tobytes())
+        self.__indptr.append(self.__indptr[-1] + len(indices))
+
+    def __read_spool(self, spool, dtype):
+        spool.seek(0)
+        result = np.frombuffer(spool.read(), dtype = dtype)
+        spool.close()
+        return result
+
+    def close(self):
+        features = sorted(self.__feature_ixs)
+        # features were numbered as they came, and are renumbered in name order
+        renumbered = np.empty(len(features), dtype = np.int64)
+        for ix, feature in enumerate(features):
+            renumbered[self.__feature_ixs[feature]] = ix
+        indptr = np.array(self.__indptr, dtype = np.int64)
+        indices = renumbered[self.__read_spool(self.__indices_spool, np.int64)]
+        data = self.__read_spool(self.__data_spool, np.float64)
+        rows = np.repeat(np.arange(len(self.__samples)), np.diff(indptr))
+        order = np.lexsort((indices, rows))
+        feature_names = {"feature_taxa": np.array([feature[0] for feature in features], dtype = str)}
+        if "marker" in self.__feature_header:
+            feature_names["feature_markers"] = np.array([feature[1] for feature in features], dtype = str)
+        with open(self.__path, 'wb') as f:
+            np.savez_compressed(f,
+              format = np.array("csr"),
+              shape = np.array([len(self.__samples), len(features)]),
+              indptr = indptr,
+              indices = indices[order],
+              data = data[order],
+              samples = np.array(self.__samples, dtype = str),
+              features = np.array([feature_separator.join(feature) for feature in features], dtype = str),
+              **feature_names
+            )
+
+matrix_writers = {
+  "tsv": DenseTsvMatrixWriter,
+  "triplets": TripletsMatrixWriter,
+  "npz": NpzMatrixWriter,
+}
+
+def new_matrix_writer(matrix_format, path, output_type, value_column = None):
+    """
+    :param value_column: a column of the output, by default the first one after taxon and marker
+    """
+    if matrix_format not in matrix_writers:
+        raise ValueError("Unknown matrix format: " + matrix_format + ". Please choose one of the following: " + ", ".join(matrix_format_options))
+    if output_type not in matrix_output_type_options:
+        raise ValueError("Unknown matrix output type: " + output_type + ". Please choose one of the following: " + ", ".join(matrix_output_type_options))
+    header = output_header(output_type)
+    feature_header = [column for column in header if column in feature_columns]
+    value_columns = [column for column in header if column not in feature_columns]
+    value_column = value_column or value_columns[0]
+    if value_column not in value_columns:
+        raise ValueError("Unknown column for " + output_type + ": " + value_column + ". Please choose one of the following: " + ", ".join(value_columns))
+    return matrix_writers[matrix_format](path, feature_header, value_column), value_column
@@ -1,6 +1,7 @@
 import numpy as np
-from scipy.sparse import isspmatrix, dok_matrix, csc_matrix
-import sklearn.preprocessing
+from scipy.sparse import isspmatrix, csc_matrix, identity, diags
+from scipy.sparse.csgraph import connected_components
+from multiprocessing import Pool
 
 # bundle GuyAllard's markov_clustering
 # all credit to them except for the startup warning I don't want
@@ -15,14 +16,51 @@ def sparse_allclose(a, b, rtol=1e-5, atol=1e-8):
     return c.max() <= atol
 
 
+def column_sums_in_order(matrix):
+    """
+    Sum the absolute values in each column of a csc matrix, adding entries one by one in their order
+
+    numpy and scipy sum with pairwise summation, which can differ in the last bit
+    Columns are sorted by their number of entries, so that the k-th step adds
+    the k-th entry of each column that has more than k
+
+    :param matrix: A csc matrix
+    :returns: An array with the sum of each column
+    """
+    num_entries = np.diff(matrix.indptr)
+    order = np.argsort(-num_entries, kind="stable")
+    negative_sorted_num_entries = -num_entries[order]
+    starts = matrix.indptr[:-1][order]
+    absolute_values = np.abs(matrix.data)
+    sums = np.zeros(len(order), dtype=np.float64)
+    for k in range(0, num_entries.max() if len(order) else 0):
+        num_columns = np.searchsorted(negative_sorted_num_entries, -k, side="left")
+        sums[:num_columns] += absolute_values[starts[:num_columns] + k]
+    result = np.empty(len(order), dtype=np.float64)
+    result[order] = sums
+    return result
+
 def normalize(matrix):
     """
     Normalize the columns of the given matrix
     
+    The same as sklearn.preprocessing.normalize(matrix, norm="l1", axis=0), bit for bit:
+    columns that sum to zero stay as they are
+
     :param matrix: The matrix to be normalized
     :returns: The normalized matrix
     """
-    return sklearn.preprocessing.normalize(matrix, norm="l1", axis=0)
+    if isspmatrix(matrix):
+        matrix = csc_matrix(matrix, dtype=np.float64, copy=True)
+        column_sums = column_sums_in_order(matrix)
+        column_sums[column_sums == 0] = 1
+        matrix.data /= np.repeat(column_sums, np.diff(matrix.indptr))
+        return matrix
+
+    matrix = np.asarray(matrix, dtype=np.float64)
+    column_sums = np.abs(matrix).sum(axis=0)
+    column_sums[column_sums == 0] = 1
+    return matrix / column_sums
 
 
 def inflate(matrix, power):
@@ -50,7 +88,10 @@ def expand(matrix, power):
     :returns: The expanded matrix
     """
     if isspmatrix(matrix):
-        return matrix ** power
+        result = matrix
+        for i in range(power - 1):
+            result = result @ matrix
+        return result
 
     return np.linalg.matrix_power(matrix, power)
 
@@ -68,16 +109,16 @@ def add_self_loops(matrix, loop_value):
     assert shape[0] == shape[1], "Error, matrix is not square"
 
     if isspmatrix(matrix):
-        new_matrix = matrix.todok()
-    else:
-        new_matrix = matrix.copy()
+        # swap the diagonal in one go - assigning entries one by one
+        # changes the sparsity structure on every write
+        new_matrix = matrix.tocsc() - diags(matrix.diagonal(), format="csc", dtype=np.float64) + loop_value * identity(shape[0], format="csc")
+        new_matrix.eliminate_zeros()
+        return new_matrix
 
+    new_matrix = matrix.copy()
     for i in range(shape[0]):
         new_matrix[i, i] = loop_value
 
-    if isspmatrix(matrix):
-        return new_matrix.tocsc()
-
     return new_matrix
 
 
@@ -90,16 +131,29 @@ def prune(matrix, threshold):
     :param threshold: The value below which edges will be removed
     :returns: The pruned matrix
     """
-    if isspmatrix(matrix):
-        pruned = dok_matrix(matrix.shape)
-        pruned[matrix >= threshold] = matrix[matrix >= threshold]
-        pruned = pruned.tocsc()
-    else:
-        pruned = matrix.copy()
-        pruned[pruned < threshold] = 0
-
-    # keep max value in each column. same behaviour for dense/sparse
     num_cols = matrix.shape[1]
+    if isspmatrix(matrix):
+        # work on the stored values of each column directly
+        matrix = matrix.tocsc()
+        matrix.sum_duplicates()
+        col_sizes = np.diff(matrix.indptr)
+        col_of_value = np.repeat(np.arange(num_cols), col_sizes)
+        col_max = np.zeros(num_cols)
+        nonempty = col_sizes > 0
+        col_max[nonempty] = np.maximum.reduceat(matrix.data, matrix.indptr[:-1][nonempty])
+        # like argmax, keep the first max value in each column
+        max_positions = np.flatnonzero(matrix.data == col_max[col_of_value])
+        _, first = np.unique(col_of_value[max_positions], return_index=True)
+        keep = matrix.data >= threshold
+        keep[max_positions[first]] = True
+        pruned = csc_matrix((matrix.data * keep, matrix.indices, matrix.indptr), shape=matrix.shape)
+        pruned.eliminate_zeros()
+        return pruned
+
+    pruned = matrix.copy()
+    pruned[pruned < threshold] = 0
+
+    # keep max value in each column
     row_indices = matrix.argmax(axis=0).reshape((num_cols,))
     col_indices = np.arange(num_cols)
     pruned[row_indices, col_indices] = matrix[row_indices, col_indices]
@@ -147,10 +201,11 @@ def get_clusters(matrix):
     :returns: A list of tuples where each tuple represents a cluster and
               contains the indices of the nodes belonging to the cluster
     """
-    if not isspmatrix(matrix):
-        # cast to sparse so that we don't need to handle different 
-        # matrix types
-        matrix = csc_matrix(matrix)
+    # cast to sparse rows so that we don't need to handle different
+    # matrix types, and can read each row off the index arrays
+    matrix = csc_matrix(matrix).tocsr()
+    matrix.eliminate_zeros()
+    matrix.sort_indices()
 
     # get the attractors - non-zero elements of the matrix diagonal
     attractors = matrix.diagonal().nonzero()[0]
@@ -160,7 +215,7 @@ def get_clusters(matrix):
 
     # the nodes in the same row as each attractor form a cluster
     for attractor in attractors:
-        cluster = tuple(matrix.getrow(attractor).nonzero()[1].tolist())
+        cluster = tuple(matrix.indices[matrix.indptr[attractor]:matrix.indptr[attractor + 1]].tolist())
         clusters.add(cluster)
 
     return sorted(list(clusters))
@@ -229,7 +284,78 @@ def run_mcl(matrix, expansion=2, inflation=2, loop_value=1,
 
     return matrix
 
-def clusters(triples):
+def clusters_in_component(matrix):
+    return get_clusters(run_mcl(matrix))
+
+def component_clusters(matrix, processes = 1, batch_size = 20000):
+    """
+    Run MCL separately on connected components of the graph.
+    There are no edges between the components, so each block of the matrix
+    iterates independently of the others - the clusters come out the same
+    as from one run on the whole matrix.
+
+    Singletons are their own clusters, and pairs with the same edge weights
+    share one result. Other components are packed into block diagonal
+    batches of up to batch_size nodes, and a larger component runs alone.
+
+    :param matrix: The sparse similarity matrix to cluster
+    :param processes: Number of worker processes to run the batches in
+    :param batch_size: Number of nodes up to which small components are batched together
+    :returns: A sorted list of tuples of node indices, like get_clusters
+    """
+    matrix = csc_matrix(matrix)
+    matrix.eliminate_zeros()
+    num_components, component_of_node = connected_components(matrix, directed=True, connection="weak")
+
+    # permute nodes so that each component is a contiguous block on the diagonal
+    # a stable sort keeps the nodes of each component in their original order
+    order = np.argsort(component_of_node, kind="stable")
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(component_of_node, minlength=num_components))])
+    permuted = matrix.tocsr()[order][:, order].tocsr()
+
+    result = set()
+    pair_clusters = {}
+    batches = []
+    batch = []
+    batch_num_nodes = 0
+    for c in range(num_components):
+        start, end = bounds[c], bounds[c + 1]
+        if end - start == 1:
+            # a self loop and nothing else: the node is its own attractor
+            result.add((int(order[start]),))
+        elif end - start == 2:
+            # only the two edges between the nodes affect the outcome
+            block = permuted[start:end, start:end].toarray()
+            key = (block[0, 1], block[1, 0])
+            if key not in pair_clusters:
+                pair_clusters[key] = clusters_in_component(csc_matrix(block))
+            for cluster in pair_clusters[key]:
+                result.add(tuple(int(order[start + ix]) for ix in cluster))
+        else:
+            if batch and batch_num_nodes + end - start > batch_size:
+                batches.append(np.concatenate(batch))
+                batch = []
+                batch_num_nodes = 0
+            batch.append(np.arange(start, end))
+            batch_num_nodes += end - start
+    if batch:
+        batches.append(np.concatenate(batch))
+
+    matrices = [permuted[positions][:, positions].tocsc() for positions in batches]
+    if processes > 1 and len(matrices) > 1:
+        with Pool(processes) as pool:
+            batch_clusters = pool.map(clusters_in_component, matrices)
+    else:
+        batch_clusters = [clusters_in_component(m) for m in matrices]
+
+    for positions, cs in zip(batches, batch_clusters):
+        nodes = order[positions]
+        for cluster in cs:
+            result.add(tuple(int(nodes[ix]) for ix in cluster))
+
+    return sorted(list(result))
+
+def clusters(triples, processes = 1):
     if not triples:
         return []
     labels = sorted(set(l1 for l1,l2, value in triples).union(set(l2 for l1,l2, value in triples)))
@@ -240,12 +366,17 @@ def clusters(triples):
         d[labels[ix]] = ix
         D[ix] = labels[ix]
 
-    matrix = np.zeros([len(labels), len(labels)])
+    # sparse from the start: memory goes with the number of edges, not nodes squared
+    # a repeated pair keeps its last value, like an assignment would
+    edges = {}
     for l1, l2, value in triples:
-        matrix[d[l1], d[l2]] = value
+        edges[(d[l1], d[l2])] = value
+    rows = np.fromiter((i for i, j in edges), dtype=np.int64, count=len(edges))
+    cols = np.fromiter((j for i, j in edges), dtype=np.int64, count=len(edges))
+    values = np.fromiter(edges.values(), dtype=np.float64, count=len(edges))
+    matrix = csc_matrix((values, (rows, cols)), shape=(len(labels), len(labels)))
 
-    result = run_mcl(matrix)
-    clusters = get_clusters(result)
+    clusters = component_clusters(matrix, processes = processes)
 
     labelled_clusters = sorted([[D[ix] for ix in c] for c in clusters], reverse = True, key = len)
     return labelled_clusters
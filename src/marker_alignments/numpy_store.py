@@ -0,0 +1,445 @@
+import numpy as np
+from array import array
+
+from marker_alignments.cooccurrence import compare_top_identities
+
+# same operations as AlignmentStore, on columns in memory instead of in sqlite
+# taxa, markers and queries are integer codes into lists of names, like the ids in AlignmentStore
+# each group by sorts the rows, and the aggregates go over groups with bincount and ufunc.at
+# floating point sums can come out in a different order than in sqlite, so outputs can differ in the last digits
+
+def group_by(*columns):
+    """
+    Group rows on the values of the columns
+
+    :param columns: integer arrays, all of the same length
+    :returns: the group number of each row, and a row in each group
+              groups are numbered in the order of the column values
+    """
+    key = np.zeros(len(columns[0]), dtype=np.int64)
+    for column in columns:
+        if len(column) == 0:
+            return key, key
+        # the key is renumbered after each column so that it can't overflow
+        values, codes = np.unique(column, return_inverse=True)
+        key = key * len(values) + codes.reshape(-1)
+        values, key = np.unique(key, return_inverse=True)
+        key = key.reshape(-1)
+    representative = np.zeros(key.max() + 1, dtype=np.int64)
+    representative[key] = np.arange(len(key))
+    return key, representative
+
+def group_sum(groups, values, num_groups):
+    return np.bincount(groups, weights=values, minlength=num_groups)
+
+def group_count(groups, num_groups):
+    return np.bincount(groups, minlength=num_groups)
+
+def group_max(groups, values, num_groups):
+    result = np.full(num_groups, -np.inf)
+    np.maximum.at(result, groups, values)
+    return result
+
+def group_count_distinct(groups, values, num_groups):
+    pairs, representative = group_by(groups, values)
+    return group_count(groups[representative], num_groups)
+
+class NumpyAlignmentStore:
+
+    # batch_size is only there to match AlignmentStore - new rows wait in buffers until the columns are next read
+    def __init__(self, batch_size = 10000):
+        self.__taxon_names = []
+        self.__taxon_ids = {}
+        self.__marker_names = []
+        self.__marker_ids = {}
+        self.__query_names = np.array([], dtype=str)
+        self.__taxon = np.array([], dtype=np.int64)
+        self.__marker = np.array([], dtype=np.int64)
+        self.__query = np.array([], dtype=np.int64)
+        self.__identity = np.array([], dtype=np.float64)
+        self.__coverage = np.array([], dtype=np.float64)
+        self.__clear_buffer()
+        self.__has_new_alignments = False
+        self.__query_stats = None
+        self.__marker_stats = None
+        # (taxon, marker) -> cluster id, and taxon -> cluster id
+        self.__marker_cluster = {}
+        self.__taxon_cluster = {}
+
+    def __taxon_id(self, taxon):
+        taxon_id = self.__taxon_ids.get(taxon)
+        if taxon_id is None:
+            taxon_id = len(self.__taxon_names)
+            self.__taxon_ids[taxon] = taxon_id
+            self.__taxon_names.append(taxon)
+        return taxon_id
+
+    def __marker_id(self, marker):
+        marker_id = self.__marker_ids.get(marker)
+        if marker_id is None:
+            marker_id = len(self.__marker_names)
+            self.__marker_ids[marker] = marker_id
+            self.__marker_names.append(marker)
+        return marker_id
+
+    def add_alignment(self, taxon, marker, query, identity, coverage):
+        self.add_alignments([(taxon, marker, query, identity, coverage)])
+
+    def add_alignments(self, batch):
+        for taxon, marker, query, identity, coverage in batch:
+            self.__taxa.append(self.__taxon_id(taxon))
+            self.__markers.append(self.__marker_id(marker))
+            self.__queries.append(query)
+            self.__identities.append(identity)
+            self.__coverages.append(coverage)
+            self.__has_new_alignments = True
+
+    def __clear_buffer(self):
+        self.__taxa = array('l')
+        self.__markers = array('l')
+        self.__queries = []
+        self.__identities = array('d')
+        self.__coverages = array('d')
+
+    def start_bulk_write(self):
+        pass
+
+    def end_bulk_write(self):
+        pass
+
+    # nothing to index - each group by sorts the columns it needs
+    def create_indexes(self):
+        pass
+
+    # like in AlignmentStore, query codes follow the order of query names
+    def __columns(self):
+        if self.__has_new_alignments:
+            self.__has_new_alignments = False
+            query_names = np.concatenate([self.__query_names[self.__query], np.array(self.__queries, dtype=str)])
+            self.__query_names, self.__query = np.unique(query_names, return_inverse=True)
+            self.__query = self.__query.reshape(-1)
+            self.__taxon = np.concatenate([self.__taxon, np.array(self.__taxa, dtype=np.int64)])
+            self.__marker = np.concatenate([self.__marker, np.array(self.__markers, dtype=np.int64)])
+            self.__identity = np.concatenate([self.__identity, np.array(self.__identities, dtype=np.float64)])
+            self.__coverage = np.concatenate([self.__coverage, np.array(self.__coverages, dtype=np.float64)])
+            self.__clear_buffer()
+            self.__alignments_changed()
+        return self.__taxon, self.__marker, self.__query, self.__identity, self.__coverage
+
+    def save_alignments(self, path):
+        taxon, marker, query, identity, coverage = self.__columns()
+        # a file object, so that numpy doesn't add .npz to the path
+        with open(path, 'wb') as f:
+            np.savez(f, taxon = taxon, marker = marker, query = query, identity = identity, coverage = coverage,
+              taxon_names = np.array(self.__taxon_names, dtype=str), marker_names = np.array(self.__marker_names, dtype=str), query_names = self.__query_names)
+
+    def load_alignments(self, path):
+        with np.load(path) as columns:
+            self.__taxon = columns["taxon"]
+            self.__marker = columns["marker"]
+            self.__query = columns["query"]
+            self.__identity = columns["identity"]
+            self.__coverage = columns["coverage"]
+            self.__taxon_names = columns["taxon_names"].tolist()
+            self.__marker_names = columns["marker_names"].tolist()
+            self.__query_names = columns["query_names"]
+        self.__taxon_ids = dict((taxon, taxon_id) for taxon_id, taxon in enumerate(self.__taxon_names))
+        self.__marker_ids = dict((marker, marker_id) for marker_id, marker in enumerate(self.__marker_names))
+        self.__clear_buffer()
+        self.__has_new_alignments = False
+        self.__alignments_changed()
+
+    def num_alignments(self):
+        return len(self.__columns()[0])
+
+    def alignments(self):
+        taxon, marker, query, identity, coverage = self.__columns()
+        return [(self.__taxon_names[t], self.__marker_names[m], str(self.__query_names[q]), i, c)
+          for t, m, q, i, c in zip(taxon.tolist(), marker.tolist(), query.tolist(), identity.tolist(), coverage.tolist())]
+
+    def __keep_taxa(self, taxa):
+        taxon, marker, query, identity, coverage = self.__columns()
+        keep = np.isin(taxon, taxa)
+        self.__taxon = taxon[keep]
+        self.__marker = marker[keep]
+        self.__query = query[keep]
+        self.__identity = identity[keep]
+        self.__coverage = coverage[keep]
+        self.__alignments_changed()
+
+    def __alignments_changed(self):
+        self.__query_stats = None
+        self.__marker_stats = None
+
+    # computed once, and again after alignments change - like the query_stats table in AlignmentStore
+    def __get_query_stats(self):
+        taxon, marker, query, identity, coverage = self.__columns()
+        if self.__query_stats is None:
+            num_queries = len(self.__query_names)
+            top_identity = group_max(query, identity, num_queries)
+            num_taxa = group_count_distinct(query, taxon, num_queries)
+            total_weight_for_query = group_sum(query, identity * identity, num_queries)
+            self.__query_stats = (top_identity, num_taxa, total_weight_for_query)
+        return self.__query_stats
+
+    def modify_table_filter_taxa_on_multiple_matches(self, min_fraction_primary_matches):
+        taxon, marker, query, identity, coverage = self.__columns()
+        top_identity, num_taxa, total_weight_for_query = self.__get_query_stats()
+        groups, rows = group_by(query, taxon)
+        num_groups = len(rows)
+        q = query[rows]
+        t = taxon[rows]
+        group_top_identity = group_max(groups, identity, num_groups)
+        is_unique = num_taxa[q] == 1
+        is_best = (num_taxa[q] > 1) & (top_identity[q] - group_top_identity < 1e-6)
+
+        num_taxa_codes = len(self.__taxon_names)
+        num_matches = group_count(t, num_taxa_codes)
+        num_primary_matches = group_sum(t, is_unique | is_best, num_taxa_codes)
+        keep = (num_matches > 0) & (num_primary_matches >= min_fraction_primary_matches * num_matches)
+        self.__keep_taxa(np.flatnonzero(keep))
+
+    # markers with only inferior alignments don't count
+    def modify_table_filter_taxa_on_num_markers_reads_and_alignments(self, min_num_markers, min_num_reads, min_num_alignments):
+        taxon, marker, query, identity, coverage = self.__columns()
+        top_identity, num_taxa, total_weight_for_query = self.__get_query_stats()
+        groups, rows = group_by(query, taxon, marker)
+        group_top_identity = group_max(groups, identity, len(rows))
+        top_rows = rows[top_identity[query[rows]] - group_top_identity < 1e-6]
+
+        num_taxa_codes = len(self.__taxon_names)
+        has_top_alignments = group_count(taxon[top_rows], num_taxa_codes) > 0
+        num_markers = group_count_distinct(taxon[top_rows], marker[top_rows], num_taxa_codes)
+        num_reads = group_count_distinct(taxon[top_rows], query[top_rows], num_taxa_codes)
+        num_alignments = group_count(taxon, num_taxa_codes)
+        keep = has_top_alignments & (num_markers >= min_num_markers) & (num_reads >= min_num_reads) & (num_alignments >= min_num_alignments)
+        self.__keep_taxa(np.flatnonzero(keep))
+
+    def modify_table_filter_taxa_on_avg_identity(self, min_avg_identity):
+        taxon, marker, query, identity, coverage = self.__columns()
+        groups, rows = group_by(query, taxon)
+        group_top_identity = group_max(groups, identity, len(rows))
+        num_taxa_codes = len(self.__taxon_names)
+        num_groups_in_taxon = group_count(taxon[rows], num_taxa_codes)
+        sum_top_identity = group_sum(taxon[rows], group_top_identity, num_taxa_codes)
+        keep = num_groups_in_taxon > 0
+        keep[keep] = sum_top_identity[keep] / num_groups_in_taxon[keep] >= min_avg_identity
+        self.__keep_taxa(np.flatnonzero(keep))
+
+    # cluster of each alignment's marker, -1 if the marker is not in a cluster
+    def __marker_cluster_of_alignments(self):
+        taxon, marker, query, identity, coverage = self.__columns()
+        return np.array([self.__marker_cluster.get(tm, -1) for tm in zip(taxon.tolist(), marker.tolist())], dtype=np.int64)
+
+    # per cluster, taxon and marker: cluster, taxon, average identity of the marker
+    # and per cluster: average identity of all its alignments, max average identity of its markers, number of taxa
+    def __marker_cluster_stats(self):
+        taxon, marker, query, identity, coverage = self.__columns()
+        cluster = self.__marker_cluster_of_alignments()
+        in_cluster = cluster >= 0
+        cluster, taxon, marker, query, identity = cluster[in_cluster], taxon[in_cluster], marker[in_cluster], query[in_cluster], identity[in_cluster]
+
+        groups, rows = group_by(cluster, taxon, marker)
+        num_groups = len(rows)
+        marker_num_matches = group_count_distinct(groups, query, num_groups)
+        marker_avg_identity = group_sum(groups, identity, num_groups) / group_count(groups, num_groups)
+
+        num_clusters = cluster.max() + 1 if len(cluster) else 0
+        cluster_avg_identity = group_sum(cluster, identity, num_clusters) / np.maximum(group_count(cluster, num_clusters), 1)
+        cluster_max_marker_avg_identity = group_max(cluster[rows], marker_avg_identity, num_clusters)
+        cluster_num_taxa = group_count_distinct(cluster, taxon, num_clusters)
+        return cluster[rows], taxon[rows], marker_avg_identity, cluster_avg_identity, cluster_max_marker_avg_identity, cluster_num_taxa
+
+    def modify_table_filter_taxa_on_cluster_averages(self, min_better_cluster_averages_ratio):
+        cluster, taxon, marker_avg_identity, cluster_avg_identity, cluster_max_marker_avg_identity, cluster_num_taxa = self.__marker_cluster_stats()
+        num_taxa_codes = len(self.__taxon_names)
+        higher_identity = cluster_avg_identity[cluster] - marker_avg_identity < 1e-6
+        num_markers = group_count(taxon, num_taxa_codes)
+        num_higher = group_sum(taxon, higher_identity, num_taxa_codes)
+        num_lower = num_markers - num_higher
+        keep = (num_markers > 0) & (num_higher >= min_better_cluster_averages_ratio * num_lower)
+        self.__keep_taxa(np.flatnonzero(keep))
+
+    def modify_table_transform_taxa_on_thresholds_and_clusters(self, threshold_identity, min_num_taxa_below_identity, min_num_markers_below_identity, min_num_reads_below_identity):
+        try_return_unknown_taxa = min_num_taxa_below_identity or min_num_markers_below_identity or min_num_reads_below_identity
+        taxon, marker, query, identity, coverage = self.__columns()
+        num_taxa_codes = len(self.__taxon_names)
+        taxon_num_alignments = group_count(taxon, num_taxa_codes)
+        taxon_avg_identity = group_sum(taxon, identity, num_taxa_codes) / np.maximum(taxon_num_alignments, 1)
+        taxon_num_markers = group_count_distinct(taxon, marker, num_taxa_codes)
+        taxon_num_reads = group_count_distinct(taxon, query, num_taxa_codes)
+
+        taxa_in_cluster = {}
+        for t, cluster_id in self.__taxon_cluster.items():
+            if taxon_num_alignments[t] > 0:
+                taxa_in_cluster.setdefault(cluster_id, []).append(t)
+
+        mapping = {}
+        for cluster_id, taxa in taxa_in_cluster.items():
+            is_above_threshold = [taxon_avg_identity[t] >= threshold_identity for t in taxa]
+            for t, above in zip(taxa, is_above_threshold):
+                if above:
+                    mapping[t] = t
+            if try_return_unknown_taxa and not any(is_above_threshold) \
+              and len(taxa) >= min_num_taxa_below_identity \
+              and sum(taxon_num_markers[t] for t in taxa) >= min_num_markers_below_identity \
+              and sum(taxon_num_reads[t] for t in taxa) >= min_num_reads_below_identity:
+                mapped_taxon = self.__taxon_id("?" + ",".join(sorted(self.__taxon_names[t] for t in taxa)))
+                for t in taxa:
+                    mapping[t] = mapped_taxon
+
+        mapped_taxa = np.full(len(self.__taxon_names), -1, dtype=np.int64)
+        for t, mapped_taxon in mapping.items():
+            mapped_taxa[t] = mapped_taxon
+        self.__keep_taxa(np.array(list(mapping.keys()), dtype=np.int64))
+        self.__taxon = mapped_taxa[self.__taxon]
+        self.__alignments_changed()
+
+    def cluster_markers_by_matches(self, processes = 1):
+        taxon, marker, query, identity, coverage = self.__columns()
+        groups, rows = group_by(taxon, marker)
+        labels = [self.__taxon_names[t] + "\t" + self.__marker_names[m] for t, m in zip(taxon[rows].tolist(), marker[rows].tolist())]
+        triples = [(labels[a], labels[b], v) for a, b, v in self.__cooccurrences(query, groups, len(rows))]
+
+        # imported here, so runs that don't cluster start without scipy
+        from marker_alignments.mcl import clusters
+        clusters_of_labels = clusters(triples, processes = processes)
+        self.__marker_cluster = {}
+        for ix in range(0, len(clusters_of_labels)):
+            for x in clusters_of_labels[ix]:
+                t, m = x.split("\t")
+                self.__marker_cluster[(self.__taxon_ids[t], self.__marker_ids[m])] = ix + 1
+
+    def cluster_taxa_by_matches(self, processes = 1):
+        taxon, marker, query, identity, coverage = self.__columns()
+        triples = self.__cooccurrences(query, taxon, len(self.__taxon_names))
+        num_queries = dict((a, v) for a, b, v in triples if a == b)
+        # shared queries as a fraction of the first taxon's queries
+        triples = [(self.__taxon_names[a], self.__taxon_names[b], float(v) / num_queries[a]) for a, b, v in triples]
+
+        from marker_alignments.mcl import clusters
+        clusters_of_labels = clusters(triples, processes = processes)
+        self.__taxon_cluster = {}
+        for ix in range(0, len(clusters_of_labels)):
+            for t in clusters_of_labels[ix]:
+                self.__taxon_cluster[self.__taxon_ids[t]] = ix + 1
+
+    # the number of queries shared by each pair of keys, as a product of sparse query x key matrices
+    def __cooccurrences(self, query, keys, num_keys):
+        from scipy.sparse import csr_matrix
+        incidence = csr_matrix((np.ones(len(query), dtype=np.int64), (query, keys)), shape=(len(self.__query_names), num_keys))
+        incidence.data[:] = 1
+        counts = (incidence.T @ incidence).tocoo()
+        return list(zip(counts.row.tolist(), counts.col.tolist(), counts.data.tolist()))
+
+    # when splitting read stats by query, do it proportionally to the second power of match identity
+    # if there are multiple matches in a query + taxon + marker, return identity as max and coverage as weighted average
+    # shared by the marker and taxon outputs
+    def __get_marker_stats(self):
+        self.__columns()
+        if self.__marker_stats is None:
+            self.__marker_stats = self.__compute_marker_stats()
+        return self.__marker_stats
+
+    def __compute_marker_stats(self):
+        taxon, marker, query, identity, coverage = self.__columns()
+        top_identity, num_taxa, total_weight_for_query = self.__get_query_stats()
+        groups, rows = group_by(taxon, marker, query)
+        num_groups = len(rows)
+        query_coverage = group_sum(groups, coverage * identity * identity, num_groups) / total_weight_for_query[query[rows]]
+        query_weight_fraction = group_sum(groups, identity * identity, num_groups) / total_weight_for_query[query[rows]]
+        query_alignment_count = group_count(groups, num_groups)
+        query_identity = group_max(groups, identity, num_groups)
+
+        marker_groups, marker_rows = group_by(taxon[rows], marker[rows])
+        num_markers = len(marker_rows)
+        return {
+          "taxon": taxon[rows][marker_rows],
+          "marker": marker[rows][marker_rows],
+          "marker_coverage": group_sum(marker_groups, query_coverage, num_markers),
+          "marker_read_count": group_sum(marker_groups, query_weight_fraction, num_markers),
+          "marker_avg_identity": group_sum(marker_groups, query_identity, num_markers) / group_count(marker_groups, num_markers),
+          "marker_alignment_count": group_sum(marker_groups, query_alignment_count, num_markers).astype(np.int64),
+        }
+
+    def __marker_lines(self, columns, num_reads):
+        stats = dict(self.__get_marker_stats())
+        stats["marker_cpm"] = stats["marker_coverage"] / num_reads * 1000000 if num_reads else np.full(len(stats["taxon"]), None)
+        values = [stats[column].tolist() for column in columns]
+        lines = [(self.__taxon_names[t], self.__marker_names[m], *vs) for t, m, *vs in zip(stats["taxon"].tolist(), stats["marker"].tolist(), *values)]
+        return sorted(lines, key = lambda l: (l[0], l[1]))
+
+    def __taxon_lines(self, columns, num_reads):
+        stats = self.__get_marker_stats()
+        taxa, taxon_of_marker = np.unique(stats["taxon"], return_inverse=True)
+        taxon_of_marker = taxon_of_marker.reshape(-1)
+        num_taxa = len(taxa)
+        taxon_num_markers = group_count(taxon_of_marker, num_taxa)
+        coverage = group_sum(taxon_of_marker, stats["marker_coverage"], num_taxa) / taxon_num_markers
+        taxon_stats = {
+          "coverage": coverage,
+          "cpm": coverage / num_reads * 1000000 if num_reads else np.full(num_taxa, None),
+          "taxon_num_reads": group_sum(taxon_of_marker, stats["marker_read_count"], num_taxa),
+          "taxon_num_alignments": group_sum(taxon_of_marker, stats["marker_alignment_count"], num_taxa).astype(np.int64),
+          "taxon_num_markers": taxon_num_markers,
+          "taxon_max_reads_in_marker": group_max(taxon_of_marker, stats["marker_read_count"], num_taxa),
+        }
+        values = [taxon_stats[column].tolist() for column in columns]
+        lines = [(self.__taxon_names[t], *vs) for t, *vs in zip(taxa.tolist(), *values)]
+        return sorted(lines, key = lambda l: l[0])
+
+    def __taxa_in_marker_clusters_lines(self):
+        cluster, taxon, marker_avg_identity, cluster_avg_identity, cluster_max_marker_avg_identity, cluster_num_taxa = self.__marker_cluster_stats()
+        taxa, taxon_of_marker = np.unique(taxon, return_inverse=True)
+        taxon_of_marker = taxon_of_marker.reshape(-1)
+        num_taxa = len(taxa)
+        higher_identity = cluster_avg_identity[cluster] - marker_avg_identity < 1e-6
+        top_identity = cluster_max_marker_avg_identity[cluster] - marker_avg_identity < 1e-6
+        is_unique = cluster_num_taxa[cluster] == 1
+        columns = [
+          group_count(taxon_of_marker, num_taxa),
+          group_sum(taxon_of_marker, higher_identity, num_taxa).astype(np.int64),
+          group_sum(taxon_of_marker, top_identity, num_taxa).astype(np.int64),
+          group_sum(taxon_of_marker, is_unique, num_taxa).astype(np.int64),
+        ]
+        lines = sorted([(self.__taxon_names[t], *vs) for t, *vs in zip(taxa.tolist(), *[c.tolist() for c in columns])], key = lambda l: l[0])
+        return sorted(lines, key = lambda l: (-l[1], -l[4], -l[3]))
+
+    def report_pairs_of_taxa_shared_queries(self):
+        taxon, marker, query, identity, coverage = self.__columns()
+        groups, rows = group_by(query, taxon)
+        group_top_identity = group_max(groups, identity, len(rows))
+        counts = compare_top_identities(zip(query[rows].tolist(), taxon[rows].tolist(), group_top_identity.tolist()))
+        lines = sorted((self.__taxon_names[at], self.__taxon_names[bt], *c) for (at, bt), c in counts.items())
+        header = ("taxon", "related_taxon", "num_queries_where_taxon_higher_identity", "num_queries_where_taxon_at_least_equal_identity", "num_queries_shared")
+        return (header, lines)
+
+    def report_output(self, output_type, num_reads):
+        if output_type == "pairs_of_taxa_shared_queries":
+            return self.report_pairs_of_taxa_shared_queries()
+        if output_type == "taxa_in_marker_clusters":
+            header = ("taxon", "taxon_num_marker_clusters", "taxon_num_marker_clusters_at_least_cluster_average", "taxon_num_marker_clusters_best_in_cluster", "taxon_num_marker_clusters_unique_in_cluster")
+            return (header, self.__taxa_in_marker_clusters_lines())
+        if output_type in marker_output_columns:
+            columns = marker_output_columns[output_type]
+            return (("taxon", "marker", *columns), self.__marker_lines(columns, num_reads))
+        if output_type in taxon_output_columns:
+            columns = taxon_output_columns[output_type]
+            return (("taxon", *columns), self.__taxon_lines(columns, num_reads))
+        raise ValueError("Unknown output type: " + output_type)
+
+# same columns as in write.sqls
+marker_read_count_columns = ["marker_alignment_count", "marker_read_count", "marker_avg_identity"]
+marker_output_columns = {
+  "marker_coverage": ["marker_coverage"],
+  "marker_read_count": marker_read_count_columns,
+  "marker_cpm": ["marker_cpm"],
+  "marker_all": ["marker_coverage", "marker_cpm", *marker_read_count_columns],
+}
+taxon_read_and_marker_count_columns = ["taxon_num_reads", "taxon_num_alignments", "taxon_num_markers", "taxon_max_reads_in_marker"]
+taxon_output_columns = {
+  "taxon_coverage": ["coverage"],
+  "taxon_read_and_marker_count": taxon_read_and_marker_count_columns,
+  "taxon_cpm": ["cpm"],
+  "taxon_all": ["coverage", "cpm", *taxon_read_and_marker_count_columns],
+}
@@ -1,5 +1,6 @@
 import pysam
 import itertools
+from array import array
 
 # longer genes have more reads aligning to them
 # so instead of counting reads, estimate a number of copies of each marker
@@ -10,8 +11,18 @@ def compute_contribution_to_marker_coverage(alignment_file, sam_record):
 
     return round(1.0 * sam_record.infer_query_length() / marker_length, 6)
 
+# same as above, but with marker lengths read from the header once per file
+# and the query length that the caller has already computed
+# (a typed array of Python floats: indexing a numpy array returns numpy scalars, which are slow to round)
+class MarkerCoverageCalculator:
+    def __init__(self, alignment_file):
+        self.marker_lengths = array('d', alignment_file.lengths)
+
+    def contribution_to_marker_coverage(self, reference_id, query_length):
+        return round(query_length / self.marker_lengths[reference_id], 6)
+
 # adapted from https://github.com/mortazavilab/TALON/blob/master/src/talon/transcript_utils.py
-def compute_alignment_identity(sam_record):
+def compute_alignment_identity(sam_record, query_length = None):
     """ This function computes what fraction of the read matches the reference
         genome."""
 
@@ -21,17 +32,37 @@ def compute_alignment_identity(sam_record):
     except KeyError:
         raise ValueError("SAM transcript %s lacks an MD tag" % read_ID)
 
-    total_bases = sam_record.infer_query_length()
-    matches = 0.0
-    ops, counts = splitMD(MD_tag)
-    for op,ct in zip(ops, counts):
-        if op == "M":
-            matches += ct
-        if op == "D":
-            total_bases += ct
+    total_bases = query_length if query_length is not None else sam_record.infer_query_length()
+    matches, deleted_bases = count_matches_and_deleted_bases(MD_tag)
+    total_bases += deleted_bases
 
     return round(1.0 * matches/total_bases, 6)
 
+def count_matches_and_deleted_bases(MD):
+    """ Scans the MD tag once, and returns the number of matching bases
+        and the number of bases deleted from the reference.
+        Same counts as the M and D operations from splitMD. """
+
+    matches = 0
+    deleted_bases = 0
+    number = 0
+    # like in splitMD, only a run of non-digits that starts with ^ is a deletion
+    at_run_start = True
+    in_deletion = False
+    for c in MD:
+        if "0" <= c <= "9":
+            number = number * 10 + ord(c) - 48
+            at_run_start = True
+        elif at_run_start:
+            matches += number
+            number = 0
+            at_run_start = False
+            in_deletion = c == "^"
+        elif in_deletion:
+            deleted_bases += 1
+
+    return matches + number, deleted_bases
+
 def splitMD(MD):
         """ Takes MD tag and splits into two lists:
             one with capital letters (match operators), and one with
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import json
+
+# not on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+# includes worker processes once they're done, like the pools of --threads
+def cpu_seconds():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+def num_alignments(alignment_store):
+    # the streaming store keeps no alignments
+    return alignment_store.num_alignments() if hasattr(alignment_store, 'num_alignments') else None
+
+class Stage:
+    def __init__(self, run_report, name, alignment_store):
+        self.__run_report = run_report
+        self.__alignment_store = alignment_store
+        # rows_in and rows_out can also be set in the stage, for stages that don't go from store to store
+        self.record = {"stage": name, "rows_in": None, "rows_out": None}
+
+    def __enter__(self):
+        if self.__alignment_store is not None:
+            self.record["rows_in"] = num_alignments(self.__alignment_store)
+        self.__start_wall = time.perf_counter()
+        self.__start_cpu = cpu_seconds()
+        return self.record
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.record["wall_seconds"] = time.perf_counter() - self.__start_wall
+        self.record["cpu_seconds"] = cpu_seconds() - self.__start_cpu
+        if self.__alignment_store is not None and exc_type is None:
+            self.record["rows_out"] = num_alignments(self.__alignment_store)
+        # of the whole run up to the end of the stage, as the process only keeps its high water mark
+        self.record["peak_rss_mb"] = peak_rss_mb()
+        self.__run_report.stages.append(self.record)
+        return False
+
+class RunReport:
+    """
+    Wall time, CPU time, alignments before and after, and peak memory of each stage of a run
+    """
+    def __init__(self):
+        self.stages = []
+        self.__start_wall = time.perf_counter()
+        self.__start_cpu = cpu_seconds()
+
+    def stage(self, name, alignment_store = None):
+        """
+        :param alignment_store: count alignments in this store before and after the stage
+        :returns: a context manager, that gives the stage's record
+        """
+        return Stage(self, name, alignment_store)
+
+    def totals(self):
+        return {
+          "wall_seconds": time.perf_counter() - self.__start_wall,
+          "cpu_seconds": cpu_seconds() - self.__start_cpu,
+          "peak_rss_mb": peak_rss_mb(),
+        }
+
+    def summary(self, totals):
+        peak_rss = ", peak RSS {:.0f} MB".format(totals["peak_rss_mb"]) if totals["peak_rss_mb"] is not None else ""
+        stages = ", ".join("{} {:.2f}s".format(record["stage"], record["wall_seconds"]) for record in self.stages)
+        return "Run report: {:.2f}s wall, {:.2f}s CPU{} - {}".format(totals["wall_seconds"], totals["cpu_seconds"], peak_rss, stages)
+
+    def write(self, path):
+        totals = self.totals()
+        with open(path, 'w') as f:
+            json.dump(dict(totals, stages = self.stages), f, indent = 2)
+        sys.stderr.write(self.summary(totals) + "\n")
+
+class NoStage:
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+# without --run-report, stages are not timed or counted
+class NoRunReport:
+    def stage(self, name, alignment_store = None):
+        return NoStage()
+
+    def write(self, path):
+        pass
@@ -0,0 +1,139 @@
+import json
+import time
+import sqlite3
+
+# the progress callback runs every this many sqlite virtual machine instructions
+progress_interval = 1000
+
+def plan_lines(plan_rows):
+    """
+    :param plan_rows: rows of explain query plan - id, parent id, unused, detail
+    :returns: details, indented by their depth in the plan
+    """
+    depths = {0: -1}
+    lines = []
+    for node_id, parent_id, unused, detail in plan_rows:
+        depths[node_id] = depths.get(parent_id, -1) + 1
+        lines.append("  " * depths[node_id] + detail)
+    return lines
+
+def is_full_scan(detail):
+    return detail.startswith("SCAN ") and detail != "SCAN CONSTANT ROW"
+
+def nested_full_scans(plan_rows):
+    """
+    Full scans that run once per row of something else: the inner loop of a join, or within a correlated subquery
+    These make a statement quadratic in the number of rows
+    """
+    details = {}
+    previous_sibling = {}
+    correlated = set()
+    result = []
+    for node_id, parent_id, unused, detail in plan_rows:
+        details[node_id] = detail
+        if detail.startswith("CORRELATED ") or parent_id in correlated:
+            correlated.add(node_id)
+        sibling = previous_sibling.get(parent_id)
+        previous_sibling[parent_id] = node_id
+        is_inner_loop = sibling is not None and (is_full_scan(details[sibling]) or details[sibling].startswith("SEARCH "))
+        if is_full_scan(detail) and (is_inner_loop or parent_id in correlated):
+            result.append(detail)
+    return result
+
+class SqlTrace:
+    """
+    How long each SQL statement of a SqliteStore ran, how many times, and its query plan
+
+    The trace callback marks the start of each statement, and the progress callback, which sqlite calls
+    while a statement runs, marks that it's still running - so a statement whose rows are read later,
+    like an output, is timed until its last rows are read
+    Statements are grouped by their text before parameters are bound
+    """
+    def __init__(self):
+        self.__statements = {}
+        # the statement SqliteStore is running, and the one sqlite is running
+        self.__pending = None
+        self.__current = None
+        self.__current_start = None
+        self.__last_activity = None
+        self.__explaining = False
+
+    def attach(self, conn):
+        conn.set_trace_callback(self.__on_statement)
+        conn.set_progress_handler(self.__on_progress, progress_interval)
+
+    def __record(self, sql):
+        sql = " ".join(sql.split())
+        record = self.__statements.get(sql)
+        if record is None:
+            record = {"sql": sql, "calls": 0, "seconds": 0.0, "vm_instructions": 0, "plan": None, "full_scans": [], "temp_btrees": [], "nested_full_scans": []}
+            self.__statements[sql] = record
+        return record
+
+    def __explain(self, conn, record, sql, params):
+        # the plan is taken when a statement first runs, as the temporary tables it reads may not last
+        self.__explaining = True
+        try:
+            plan_rows = conn.execute("explain query plan " + sql, *params).fetchall()
+        except sqlite3.Error:
+            return
+        finally:
+            self.__explaining = False
+        record["plan"] = plan_lines(plan_rows)
+        record["full_scans"] = [detail for node_id, parent_id, unused, detail in plan_rows if is_full_scan(detail)]
+        record["temp_btrees"] = [detail for node_id, parent_id, unused, detail in plan_rows if "TEMP B-TREE" in detail]
+        record["nested_full_scans"] = nested_full_scans(plan_rows)
+
+    def before(self, conn, sql, params):
+        """
+        Called by SqliteStore before it runs a statement
+
+        :param params: a list with the statement's parameters, or an empty list
+        """
+        record = self.__record(sql)
+        if record["plan"] is None:
+            self.__explain(conn, record, sql, params)
+        self.__pending = record
+
+    def after(self):
+        self.__last_activity = time.perf_counter()
+        self.__pending = None
+
+    def __close_current(self):
+        if self.__current is not None:
+            self.__current["seconds"] += self.__last_activity - self.__current_start
+            self.__current = None
+
+    # statements not run through SqliteStore.query, do or do_many, like commits, are recorded by their text
+    def __on_statement(self, sql):
+        if self.__explaining:
+            return
+        self.__close_current()
+        self.__current = self.__pending or self.__record(sql)
+        self.__current["calls"] += 1
+        self.__current_start = time.perf_counter()
+        self.__last_activity = self.__current_start
+
+    def __on_progress(self):
+        if not self.__explaining and self.__current is not None:
+            self.__current["vm_instructions"] += progress_interval
+            self.__last_activity = time.perf_counter()
+        return 0
+
+    def statements(self):
+        """
+        :returns: a list of statement records, the longest running first
+        """
+        self.__close_current()
+        return sorted(self.__statements.values(), key = lambda record: -record["seconds"])
+
+    def write(self, path):
+        statements = self.statements()
+        with open(path, 'w') as f:
+            json.dump({
+              "progress_interval": progress_interval,
+              "statements_with_full_scans": [record["sql"] for record in statements if record["full_scans"]],
+              "statements_with_temp_btrees": [record["sql"] for record in statements if record["temp_btrees"]],
+              "statements_with_nested_full_scans": [record["sql"] for record in statements if record["nested_full_scans"]],
+              "statements": statements,
+            }, f, indent = 2)
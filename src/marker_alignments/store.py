@@ -1,32 +1,146 @@
+import os
+import re
 import sqlite3
-
-from marker_alignments.mcl import clusters
+from array import array
+
+from marker_alignments.cooccurrence import count_cooccurrences, symmetric_triples, compare_top_identities
+
+# pragmas set when connecting, and pragmas set only for the duration of a bulk write
+# "default" leaves sqlite's defaults - durable, but every commit of a bulk write is synced to disk
+# "wal" keeps the database consistent after a crash, but doesn't sync during bulk writes
+# "unsafe" has no journal: a crash or an error mid-write can leave a corrupt database file
+sqlite_profiles = {
+  "default": {
+    "connect": [],
+    "bulk_write": [],
+  },
+  "wal": {
+    "connect": [("journal_mode", "WAL"), ("synchronous", "NORMAL"), ("cache_size", -262144), ("temp_store", "MEMORY"), ("mmap_size", 1073741824)],
+    "bulk_write": [("synchronous", "OFF")],
+  },
+  "unsafe": {
+    "connect": [("journal_mode", "OFF"), ("synchronous", "OFF"), ("cache_size", -262144), ("temp_store", "MEMORY"), ("mmap_size", 1073741824)],
+    "bulk_write": [],
+  },
+}
+sqlite_profile_options = [k for k in sqlite_profiles]
+
+def copy_database(conn, from_schema, to_schema):
+    """
+    Replace the tables, views and indexes of one attached database with those of another, and copy user_version
+
+    Indexes are created after the rows are copied, like after a bulk write
+    """
+    def objects(schema):
+        return conn.execute("select type, name, sql from {}.sqlite_master where sql is not null and name not like 'sqlite_%' order by rowid".format(schema)).fetchall()
+
+    def qualified(sql):
+        return re.sub("^CREATE (TABLE|VIEW|INDEX|UNIQUE INDEX) ", lambda match: match.group(0) + to_schema + ".", sql, count = 1)
+
+    from_objects = objects(from_schema)
+    conn.execute("begin transaction")
+    try:
+        for object_type in ["view", "table"]:
+            for existing_type, name, sql in objects(to_schema):
+                if existing_type == object_type:
+                    conn.execute("drop {} {}.{}".format(object_type, to_schema, name))
+        for object_type, name, sql in from_objects:
+            if object_type == "table":
+                conn.execute(qualified(sql))
+                conn.execute("insert into {}.{} select * from {}.{}".format(to_schema, name, from_schema, name))
+        for object_type in ["view", "index"]:
+            for other_type, name, sql in from_objects:
+                if other_type == object_type:
+                    conn.execute(qualified(sql))
+        conn.execute("pragma {}.user_version = {:d}".format(to_schema, conn.execute("pragma {}.user_version".format(from_schema)).fetchone()[0]))
+    except:
+        conn.execute("rollback transaction")
+        raise
+    conn.execute("commit transaction")
 
 class SqliteStore:
-    def __init__(self, db_path = None):
+    # sql_trace is a SqlTrace, to record each statement with its duration and query plan
+    def __init__(self, db_path = None, sqlite_profile = "default", sql_trace = None):
+        if sqlite_profile not in sqlite_profiles:
+            raise ValueError("Unknown sqlite profile: " + sqlite_profile + ". Please choose one of the following: " + ", ".join(sqlite_profile_options))
         self.__db_path = db_path
+        self.__profile = sqlite_profiles[sqlite_profile]
         self.__conn = None
         self.__is_within_transaction = False
         self.__stateful_ops_in_bulk_write = None
+        self.__pragmas_before_bulk_write = None
+        self.__sql_trace = sql_trace
 
     def connect(self):
         if self.__conn:
             return
         self.__conn = sqlite3.connect(self.__db_path or ":memory:", isolation_level=None)
+        if self.__sql_trace:
+            self.__sql_trace.attach(self.__conn)
+        self.__set_pragmas(self.__profile["connect"])
+
+    def __execute(self, sql, params = ()):
+        if not self.__sql_trace:
+            return self.__conn.execute(sql, *params)
+        self.__sql_trace.before(self.__conn, sql, params)
+        try:
+            return self.__conn.execute(sql, *params)
+        finally:
+            self.__sql_trace.after()
+
+    def __set_pragmas(self, pragmas):
+        for pragma, value in pragmas:
+            self.__conn.execute("pragma {} = {}".format(pragma, value))
+
+    def pragma(self, pragma):
+        return self.__conn.execute("pragma " + pragma).fetchone()[0]
 
     def do(self, *args):
-        self.__conn.execute(*args)
+        self.__execute(args[0], args[1:])
         if self.__is_within_transaction:
             self.__stateful_ops_in_bulk_write +=1
             if self.__stateful_ops_in_bulk_write % 100000 == 0:
                 self.__conn.execute("commit transaction")
                 self.__conn.execute("begin transaction")
 
+    def do_many(self, sql, rows):
+        if self.__sql_trace:
+            self.__sql_trace.before(self.__conn, sql, rows[:1])
+        try:
+            self.__conn.executemany(sql, rows)
+        finally:
+            if self.__sql_trace:
+                self.__sql_trace.after()
+        if self.__is_within_transaction:
+            previous = self.__stateful_ops_in_bulk_write
+            self.__stateful_ops_in_bulk_write += len(rows)
+            if previous // 100000 != self.__stateful_ops_in_bulk_write // 100000:
+                self.__conn.execute("commit transaction")
+                self.__conn.execute("begin transaction")
+
     def query(self, *args):
-        return self.__conn.execute(*args)
+        return self.__execute(args[0], args[1:])
+
+    # copies of the whole database, through an attached database
+    # rather than Connection.backup, which needs python 3.7
+    def save_to(self, path):
+        self.__conn.execute("attach database ? as target", [path])
+        try:
+            copy_database(self.__conn, "main", "target")
+        finally:
+            self.__conn.execute("detach database target")
+
+    def load_from(self, path):
+        self.__conn.execute("attach database ? as source", [path])
+        try:
+            copy_database(self.__conn, "source", "main")
+        finally:
+            self.__conn.execute("detach database source")
 
 
     def start_bulk_write(self):
+        self.__pragmas_before_bulk_write = [(pragma, self.pragma(pragma)) for pragma, value in self.__profile["bulk_write"]]
+        self.__set_pragmas(self.__profile["bulk_write"])
         self.__is_within_transaction = True
         self.__stateful_ops_in_bulk_write = 0
         self.__conn.execute("begin transaction")
@@ -35,10 +149,24 @@ class SqliteStore:
         self.__conn.execute("commit transaction")
         self.__is_within_transaction = False
         self.__stateful_ops_in_bulk_write = None
+        self.__set_pragmas(self.__pragmas_before_bulk_write)
+        self.__pragmas_before_bulk_write = None
+
+
+# per query aggregates, used by filters and outputs
+# the store fills the query_stats table again after alignments change
+query_stats_query = '''
+  select query,
+    max(identity) as top_identity,
+    count(distinct taxon) as num_taxa,
+    sum(identity * identity) as total_weight_for_query
+  from alignment_ids
+  group by query
+'''
 
-
+# filters select the taxa to keep, and the other taxa's alignments are deleted
 filter_taxa_on_multiple_matches_query = '''
-  select a.* from alignment a,
+  select t.taxon from
   (
     select taxon,
        count(*) as num_matches,
@@ -49,35 +177,27 @@ filter_taxa_on_multiple_matches_query = '''
       s.num_taxa == 1 as is_unique,
       s.num_taxa > 1 and s.top_identity - max(a.identity) < 1e-6 as is_best,
       s.num_taxa > 1 and s.top_identity - max(a.identity) > 1e-6 as is_inferior
-      from   alignment a,
-           (select query,
-               Max(identity) as top_identity,
-               count(distinct taxon) as num_taxa
-          from   alignment
-          group  by query) s
+      from   alignment_ids a,
+           query_stats s
       where  a.query = s.query
       group by a.query, a.taxon
       )
     group  by taxon
   ) t
-  where a.taxon = t.taxon and (t.num_unique_matches + t.num_best_matches ) >= (?) * t.num_matches
+  where (t.num_unique_matches + t.num_best_matches ) >= (?) * t.num_matches
 '''
 
 # markers with only inferior alignments don't count
 filter_taxa_on_num_markers_reads_and_alinments_query = '''
-  select a.* from alignment a,
+  select t.taxon from
   (
     select taxon,
     count(distinct marker) as num_markers,
     count(distinct query) as num_reads
     from   (
       select a.taxon, a.marker, a.query
-      from   alignment a,
-           (select query,
-               Max(identity) as top_identity,
-               count(distinct taxon) as num_taxa
-          from   alignment
-          group  by query) s
+      from   alignment_ids a,
+           query_stats s
       where  a.query = s.query
       group by a.query, a.taxon, a.marker
       having s.top_identity - max(a.identity) < 1e-6
@@ -87,29 +207,29 @@ filter_taxa_on_num_markers_reads_and_alinments_query = '''
   (
     select taxon,
     count(*) as num_alignments
-    from alignment
+    from alignment_ids
     group by taxon
   ) t2
-  where a.taxon = t.taxon and a.taxon = t2.taxon and t.num_markers >= (?) and t.num_reads >= (?) and t2.num_alignments >= (?)
+  where t.taxon = t2.taxon and t.num_markers >= (?) and t.num_reads >= (?) and t2.num_alignments >= (?)
 '''
 
 filter_taxa_on_avg_identity_query = '''
-  select a.* from alignment a,
+  select t.taxon from
   (
     select taxon,
       avg(top_identity) as avg_identity
     from   (select a.taxon,
             max(a.identity) as top_identity
-            from alignment a
+            from alignment_ids a
             group by a.query, a.taxon
             )
     group  by taxon
   ) t
-  where a.taxon = t.taxon and t.avg_identity >= (?)
+  where t.avg_identity >= (?)
 '''
 
 filter_taxa_on_cluster_averages_query = '''
-  select a.* from alignment a,
+  select t.taxon from
   (
     select taxon,
       sum(higher_identity) as num_markers_at_least_cluster_average,
@@ -122,12 +242,12 @@ filter_taxa_on_cluster_averages_query = '''
         t2.avg_cluster_identity - avg_identity >= 1e-6 as lower_identity
         from (
           select id, mc.taxon, mc.marker, count(distinct query) as num_matches, avg(identity) as avg_identity
-            from marker_cluster mc, alignment a
+            from marker_cluster mc, alignment_ids a
             where mc.taxon = a.taxon and mc.marker = a.marker
             group by id, mc.taxon, mc.marker
         ) t1, (
         select id, avg(identity) as avg_cluster_identity, count(distinct mc.taxon) as num_taxa
-            from marker_cluster mc, alignment a
+            from marker_cluster mc, alignment_ids a
             where mc.taxon = a.taxon and mc.marker = a.marker
             group by id
         ) t2
@@ -135,51 +255,20 @@ filter_taxa_on_cluster_averages_query = '''
        )
     group by taxon
   ) t
-  where a.taxon = t.taxon and num_markers_at_least_cluster_average >= (?) * num_markers_below_cluster_average
-'''
-
-counts_of_common_matches_in_markers_query = '''
-select 
-       a.taxon at,
-       a.marker am,
-       b.taxon bt,
-       b.marker bm,
-       count(distinct a.query)
-from   alignment a,
-       alignment b
-where  a.query = b.query
-group by at, bt, am, bm;
-'''
-
-counts_of_common_matches_in_taxa_query = '''
-select aa.at, aa.bt, cast (sum_shared  as real) / aaa.num_queries from
-(
-    select at, bt, count(*) as sum_shared
-    from (
-      select
-           a.taxon at,
-           b.taxon bt,
-           a.query
-      from   alignment a,
-           alignment b
-      where  a.query = b.query
-      group by at, bt, a.query
-    ) group by at, bt
-) aa,
-(
-  select taxon, count(distinct query) as num_queries from alignment
-  group by taxon
-) aaa
-where aa.at = aaa.taxon
+  where num_markers_at_least_cluster_average >= (?) * num_markers_below_cluster_average
 '''
 
-
-transform_taxa_on_thresholds_and_clusters_query = '''
-select t.mapped_taxon as taxon, a.marker, a.query, a.identity, a.coverage from alignment a,
-(
-    select tc.taxon as original_taxon, tc.taxon as mapped_taxon
-    from taxon_cluster tc, alignment al
-    where tc.taxon = al.taxon 
+# pairs of taxa and markers that match the same queries are counted in one pass over alignments sorted by query
+# instead of a self join on query, see cooccurrence.py
+queries_with_markers_query = 'select query, taxon, marker from alignment_ids group by query, taxon, marker order by query'
+queries_with_taxa_query = 'select query, taxon from alignment_ids group by query, taxon order by query'
+queries_with_taxa_and_top_identities_query = 'select query, taxon, max(identity) from alignment_ids group by query, taxon order by query'
+
+# mapped taxa are new names, so this query returns names to be looked up in the taxa table
+taxon_mapping_on_thresholds_and_clusters_query = '''
+    select tc.taxon as original_taxon, tx.taxon as mapped_taxon
+    from taxon_cluster tc, alignment_ids al, taxa tx
+    where tc.taxon = al.taxon and tx.id = tc.taxon
     group by tc.id, tc.taxon
     having avg(al.identity) >= (?)
 
@@ -193,74 +282,291 @@ select t.mapped_taxon as taxon, a.marker, a.query, a.identity, a.coverage from a
       select id, '?' || group_concat(taxon) as mapped_taxon
       from (
         select tc.id,
-          tc.taxon,
+          tx.taxon,
           count(distinct al.marker) as num_markers,
           count(distinct al.query) as num_reads,
           avg(al.identity) >= (?) as is_above_threshold
-        from taxon_cluster tc, alignment al
-        where tc.taxon = al.taxon 
-        group by tc.id, tc.taxon
+        from taxon_cluster tc, alignment_ids al, taxa tx
+        where tc.taxon = al.taxon and tx.id = tc.taxon
+        group by tc.id, tx.taxon
       ) group by id
       having
       (?) > 0 and count(distinct taxon) >= (?) and sum(num_markers) >= (?) and sum(num_reads) >= (?) and sum(is_above_threshold) == 0
     ) m
     where tc.id = m.id
-) t
-where a.taxon = t.original_taxon
 '''
+
+taxon_id_mapping_query = '''
+select t.original_taxon, tx.id from taxon_mapping t, taxa tx
+where tx.taxon = t.mapped_taxon
+'''
+
+# taxa without a mapping are deleted first
+transform_taxa_on_thresholds_and_clusters_query = '''
+update alignment_ids set taxon = (
+  select m.mapped_taxon from taxon_id_mapping m
+  where m.original_taxon = alignment_ids.taxon
+)
+'''
+
+# taxa, markers, and queries are stored once in lookup tables, and alignment_ids refers to them by integer ids
+# the alignment view has the names, for reading the store from outside
+alignment_view_query = '''
+  create view alignment as
+  select t.taxon, m.marker, q.query, a.identity, a.coverage
+  from alignment_ids a, taxa t, markers m, queries q
+  where t.id = a.taxon and m.id = a.marker and q.id = a.query
+'''
+
+# stored as the database's user_version, and checked when a saved store is loaded
+schema_version = 1
+schema_tables = ["taxa", "markers", "queries", "alignment_ids", "new_alignment", "query_stats", "marker_cluster", "taxon_cluster", "applied_filters"]
+
 class AlignmentStore(SqliteStore):
 
-    def __init__(self, **kwargs):
+    def __init__(self, batch_size = 10000, keep_filter_snapshots = False, **kwargs):
         super().__init__(**kwargs)
+        self.__batch_size = batch_size
+        self.__keep_filter_snapshots = keep_filter_snapshots
+        self.__clear_buffer()
+        self.__taxon_ids = {}
+        self.__marker_ids = {}
         self.connect()
-        self.do('''create table alignment (
-              taxon text not null,
-              marker text not null,
+        self.do('pragma user_version = {}'.format(schema_version))
+        self.do('''create table taxa (
+              id integer primary key,
+              taxon text not null unique
+            );''')
+        self.do('''create table markers (
+              id integer primary key,
+              marker text not null unique
+            );''')
+        self.do('''create table queries (
+              id integer primary key,
+              query text not null unique
+            );''')
+        self.do('''create table alignment_ids (
+              taxon integer not null,
+              marker integer not null,
+              query integer not null,
+              identity real not null,
+              coverage real not null
+            );''')
+        self.do('''create table new_alignment (
+              taxon integer not null,
+              marker integer not null,
               query text not null,
               identity real not null,
               coverage real not null
             );''')
+        self.__has_new_alignments = False
+        self.do(alignment_view_query)
+        self.do('''create table query_stats (
+              query integer primary key,
+              top_identity real not null,
+              num_taxa integer not null,
+              total_weight_for_query real not null
+            );''')
+        self.__query_stats_are_current = True
         self.do('''
             create table marker_cluster (
               id number not null,
-              taxon text not null,
-              marker text not null
+              taxon integer not null,
+              marker integer not null
             );''')
         self.do('''
             create table taxon_cluster (
               id number not null,
-              taxon text not null
+              taxon integer not null
+            );''')
+        # filters and transforms that modified the alignments, in order
+        self.do('''
+            create table applied_filters (
+              op text not null
             );''')
-        
+
+    # there are few taxa and markers, so their ids are kept in memory
+    # queries are too many for that: new alignments wait with query names in new_alignment
+    # and get query ids in one pass before the store is next read
+    def __taxon_id(self, taxon):
+        taxon_id = self.__taxon_ids.get(taxon)
+        if taxon_id is None:
+            taxon_id = len(self.__taxon_ids) + 1
+            self.__taxon_ids[taxon] = taxon_id
+            self.do('insert into taxa (id, taxon) values (?,?)', [taxon_id, taxon])
+        return taxon_id
+
+    def __marker_id(self, marker):
+        marker_id = self.__marker_ids.get(marker)
+        if marker_id is None:
+            marker_id = len(self.__marker_ids) + 1
+            self.__marker_ids[marker] = marker_id
+            self.do('insert into markers (id, marker) values (?,?)', [marker_id, marker])
+        return marker_id
+
     def add_alignment(self, taxon, marker, query, identity, coverage):
-        self.do('insert into alignment (taxon, marker, query, identity, coverage) values (?,?,?,?,?)', [ taxon, marker, query, identity, coverage])
+        # after buffered rows, to keep the order alignments came in
+        self.flush_alignments()
+        self.do('insert into new_alignment (taxon, marker, query, identity, coverage) values (?,?,?,?,?)', [ self.__taxon_id(taxon), self.__marker_id(marker), query, identity, coverage])
+        self.__has_new_alignments = True
+
+    # rows wait in a buffer and go in with one executemany per batch, or before the store is next read
+    # identity and coverage are kept in typed arrays rather than as Python floats in tuples
+    def add_alignments(self, batch):
+        for taxon, marker, query, identity, coverage in batch:
+            self.__taxa.append(self.__taxon_id(taxon))
+            self.__markers.append(self.__marker_id(marker))
+            self.__queries.append(query)
+            self.__identities.append(identity)
+            self.__coverages.append(coverage)
+            if len(self.__queries) >= self.__batch_size:
+                self.flush_alignments()
+
+    def flush_alignments(self):
+        if not self.__queries:
+            return
+        rows = list(zip(self.__taxa, self.__markers, self.__queries, self.__identities, self.__coverages))
+        self.do_many('insert into new_alignment (taxon, marker, query, identity, coverage) values (?,?,?,?,?)', rows)
+        self.__has_new_alignments = True
+        self.__clear_buffer()
+
+    def __clear_buffer(self):
+        self.__taxa = array('l')
+        self.__markers = array('l')
+        self.__queries = []
+        self.__identities = array('d')
+        self.__coverages = array('d')
 
+    def end_bulk_write(self):
+        self.flush_alignments()
+        super().end_bulk_write()
 
-    def _modify_table(self, op, select_query, *args):
+    def query(self, *args):
+        self.__add_new_alignments()
+        return super().query(*args)
+
+    # query ids follow the order of query names, like the text column used to
+    # so grouping by query adds up floating point values in the same order
+    def __add_new_alignments(self):
+        self.flush_alignments()
+        if not self.__has_new_alignments:
+            return
+        self.__has_new_alignments = False
+        self.query('insert or ignore into queries (query) select distinct query from new_alignment order by query')
+        self.query('''insert into alignment_ids (taxon, marker, query, identity, coverage)
+          select n.taxon, n.marker, q.id, n.identity, n.coverage
+          from new_alignment n, queries q
+          where q.query = n.query
+          order by n.rowid''')
+        self.query('delete from new_alignment')
+        self.__query_stats_are_current = False
+
+    def __update_query_stats(self):
+        self.__add_new_alignments()
+        if self.__query_stats_are_current:
+            return
+        self.__query_stats_are_current = True
+        self.query('delete from query_stats')
+        self.query('insert into query_stats (query, top_identity, num_taxa, total_weight_for_query) ' + query_stats_query)
+
+    def save_alignments(self, path):
+        self.__add_new_alignments()
+        self.save_to(path)
+
+    def load_alignments(self, path):
+        if not os.path.isfile(path):
+            raise ValueError("No such sqlite database: " + path)
+        self.load_from(path)
+        version = self.pragma("user_version")
+        tables = set(name for name, in self.query("select name from sqlite_master where type in ('table', 'view')"))
+        missing_tables = [table for table in schema_tables + ["alignment"] if table not in tables]
+        if version != schema_version or missing_tables:
+            raise ValueError("Not an alignment store of this version of marker_alignments: " + path + (", missing " + ", ".join(missing_tables) if missing_tables else ""))
+        self.__taxon_ids = dict((taxon, taxon_id) for taxon_id, taxon in self.query("select id, taxon from taxa"))
+        self.__marker_ids = dict((marker, marker_id) for marker_id, marker in self.query("select id, marker from markers"))
+        self.__query_stats_are_current = False
+
+    def applied_filters(self):
+        return [op for op, in self.query("select op from applied_filters order by rowid")]
+
+    def num_alignments(self):
+        return self.query("select count(*) from alignment_ids").fetchone()[0]
+
+    def has_marker_clusters(self):
+        return self.query("select exists (select 1 from marker_cluster)").fetchone()[0] == 1
+
+    # created after a bulk load rather than during, so that inserts stay fast
+    def create_indexes(self):
+        self.query('create index if not exists alignment_ids_by_query on alignment_ids (query, taxon, marker, identity)')
+        self.query('create index if not exists alignment_ids_by_taxon on alignment_ids (taxon, marker, query, identity)')
+
+    # the alignment table is modified in place, and a copy from before each step
+    # is only kept with keep_filter_snapshots, for debugging
+    def __snapshot(self, op):
+        if self.__keep_filter_snapshots:
+            self.query("create table alignment_pre_filter_on_" + op + " as select * from alignment_ids")
+        self.query("insert into applied_filters (op) values (?)", [op])
+
+    def _filter_taxa(self, op, select_query, *args):
+        self.__update_query_stats()
         self.query("begin transaction")
-        self.query("create table new as " + select_query, *args)
-        self.query("alter table alignment rename to alignment_pre_filter_on_" + op)
-        self.query("alter table new rename to alignment")
+        self.__snapshot(op)
+        self.query("create temp table kept_taxa as " + select_query, *args)
+        self.query("delete from alignment_ids where taxon not in (select taxon from kept_taxa)")
+        self.query("drop table kept_taxa")
         self.query("commit transaction")
+        self.__query_stats_are_current = False
 
     def modify_table_filter_taxa_on_multiple_matches(self, min_fraction_primary_matches):
-        self._modify_table('multiple_matches', filter_taxa_on_multiple_matches_query, [min_fraction_primary_matches])
+        self._filter_taxa('multiple_matches', filter_taxa_on_multiple_matches_query, [min_fraction_primary_matches])
 
     def modify_table_filter_taxa_on_num_markers_reads_and_alignments(self, min_num_markers, min_num_reads, min_num_alignments):
-        self._modify_table('num_markers', filter_taxa_on_num_markers_reads_and_alinments_query, [min_num_markers, min_num_reads, min_num_alignments])
+        self._filter_taxa('num_markers', filter_taxa_on_num_markers_reads_and_alinments_query, [min_num_markers, min_num_reads, min_num_alignments])
 
     def modify_table_filter_taxa_on_avg_identity(self, min_avg_identity):
-        self._modify_table('avg_identity', filter_taxa_on_avg_identity_query, [min_avg_identity])
+        self._filter_taxa('avg_identity', filter_taxa_on_avg_identity_query, [min_avg_identity])
 
     def modify_table_filter_taxa_on_cluster_averages(self, min_better_cluster_averages_ratio):
-        self._modify_table('cluster_averages', filter_taxa_on_cluster_averages_query, [min_better_cluster_averages_ratio])
+        self._filter_taxa('cluster_averages', filter_taxa_on_cluster_averages_query, [min_better_cluster_averages_ratio])
 
     def modify_table_transform_taxa_on_thresholds_and_clusters(self, threshold_identity, min_num_taxa_below_identity, min_num_markers_below_identity, min_num_reads_below_identity):
         try_return_unknown_taxa = 1 if min_num_taxa_below_identity or min_num_markers_below_identity or min_num_reads_below_identity else 0
-        self._modify_table('thresholds_and_clusters', transform_taxa_on_thresholds_and_clusters_query,
+        self.query("begin transaction")
+        self.__snapshot('thresholds_and_clusters')
+        self.query("create temp table taxon_mapping as " + taxon_mapping_on_thresholds_and_clusters_query,
 	  [threshold_identity, threshold_identity, try_return_unknown_taxa, min_num_taxa_below_identity, min_num_markers_below_identity, min_num_reads_below_identity])
+        self.query("insert or ignore into taxa (taxon) select mapped_taxon from taxon_mapping")
+        self.query("create temp table taxon_id_mapping (original_taxon integer primary key, mapped_taxon integer not null)")
+        self.query("insert into taxon_id_mapping " + taxon_id_mapping_query)
+        self.query("delete from alignment_ids where taxon not in (select original_taxon from taxon_id_mapping)")
+        self.query(transform_taxa_on_thresholds_and_clusters_query)
+        self.query("drop table taxon_id_mapping")
+        self.query("drop table taxon_mapping")
+        self.query("commit transaction")
+        self.__query_stats_are_current = False
+        self.__taxon_ids = dict((taxon, taxon_id) for taxon_id, taxon in self.query("select id, taxon from taxa"))
+
+    def __names(self, ids):
+        return dict((name_id, name) for name, name_id in ids.items())
+
+    def report_pairs_of_taxa_shared_queries(self):
+        taxon_names = self.__names(self.__taxon_ids)
+        counts = compare_top_identities(self.query(queries_with_taxa_and_top_identities_query))
+        lines = sorted((taxon_names[at], taxon_names[bt], *c) for (at, bt), c in counts.items())
+        header = ("taxon", "related_taxon", "num_queries_where_taxon_higher_identity", "num_queries_where_taxon_at_least_equal_identity", "num_queries_shared")
+        return (header, lines)
+
+    # a temporary table of an output, for other outputs to read from
+    def create_report_table(self, name, *args):
+        self.__update_query_stats()
+        self.query("drop table if exists " + name)
+        self.query("create temp table " + name + " as " + args[0], *args[1:])
+
+    def drop_report_table(self, name):
+        self.query("drop table if exists " + name)
 
     def report(self, *args):
+        self.__update_query_stats()
         cursor = self.query(*args)
         # https://stackoverflow.com/a/7831685
         description = next(zip(*cursor.description))
@@ -291,10 +597,15 @@ class AlignmentStore(SqliteStore):
     def as_taxon_all(self,total_reads):
         return self.query(taxon_all_query, [total_reads, total_reads])
 
-    def cluster_markers_by_matches(self):
-        triples = [(at + "\t" + am, bt + "\t" + bm, v)  for at, am, bt, bm, v in self.query(counts_of_common_matches_in_markers_query)]
+    def cluster_markers_by_matches(self, processes = 1):
+        taxon_names = self.__names(self.__taxon_ids)
+        marker_names = self.__names(self.__marker_ids)
+        counts = count_cooccurrences(((query, (taxon, marker)) for query, taxon, marker in self.query(queries_with_markers_query)))
+        triples = [(taxon_names[at] + "\t" + marker_names[am], taxon_names[bt] + "\t" + marker_names[bm], v) for (at, am), (bt, bm), v in symmetric_triples(counts)]
 
-        self._store_marker_clusters(clusters(triples))
+        # imported here, so runs that don't cluster start without scipy
+        from marker_alignments.mcl import clusters
+        self._store_marker_clusters(clusters(triples, processes = processes))
 
     def _store_marker_clusters(self, clusters):
 
@@ -304,20 +615,26 @@ class AlignmentStore(SqliteStore):
             cluster_id = ix + 1
             for x in cluster:
                 taxon, marker = x.split("\t")
-                self.do('insert into marker_cluster (id, taxon, marker) values (?,?,?)', [ cluster_id, taxon, marker])
+                self.do('insert into marker_cluster (id, taxon, marker) values (?,?,?)', [ cluster_id, self.__taxon_ids[taxon], self.__marker_ids[marker]])
         self.end_bulk_write()
 
-    def cluster_taxa_by_matches(self):
-        triples = [(at, bt, v)  for at, bt, v in self.query(counts_of_common_matches_in_taxa_query)]
+    def cluster_taxa_by_matches(self, processes = 1):
+        taxon_names = self.__names(self.__taxon_ids)
+        counts = count_cooccurrences(self.query(queries_with_taxa_query))
+        # shared queries as a fraction of the first taxon's queries
+        triples = [(taxon_names[at], taxon_names[bt], float(v) / counts[(at, at)]) for at, bt, v in symmetric_triples(counts)]
 
-        self._store_taxon_clusters(clusters(triples))
+        from marker_alignments.mcl import clusters
+        self._store_taxon_clusters(clusters(triples, processes = processes))
 
     def _store_taxon_clusters(self, clusters):
 
         self.start_bulk_write()
+        # a store loaded from a file can have clusters from an earlier run
+        self.do('delete from taxon_cluster')
         for ix in range(0, len(clusters)):
             cluster = clusters[ix]
             cluster_id = ix + 1
             for taxon in cluster:
-                self.do('insert into taxon_cluster (id, taxon) values (?,?)', [ cluster_id, taxon])
+                self.do('insert into taxon_cluster (id, taxon) values (?,?)', [ cluster_id, self.__taxon_ids[taxon]])
         self.end_bulk_write()
@@ -0,0 +1,104 @@
+from marker_alignments.numpy_store import marker_output_columns, taxon_output_columns
+
+# outputs with a line per marker or per taxon only need a few sums for each marker
+# when the alignments of each query come together - as an aligner writes them, or after samtools sort -n -
+# each query is added to the sums as soon as it's complete, and alignments are not kept
+# so memory depends on the number of markers rather than the number of alignments
+# sums are the same as in write.sqls: query stats are split proportionally to the second power of match identity
+streaming_output_type_options = [*marker_output_columns, *taxon_output_columns]
+
+# queries come in the order of the input rather than in the store's order of query names
+# so per marker sums are float sums in a different order, and differ by a relative error of about
+# the number of queries of the marker times 1e-16 - far below the printed digits, which only rarely round differently
+
+class StreamingMarkerStore:
+
+    def __init__(self):
+        # (taxon, marker) -> [coverage, read count, alignment count, sum of top identity in each query, number of queries]
+        self.__marker_sums = {}
+        self.__query = None
+        self.__query_alignments = []
+
+    def start_bulk_write(self):
+        pass
+
+    def end_bulk_write(self):
+        self.__add_query()
+
+    def create_indexes(self):
+        pass
+
+    def add_alignments(self, batch):
+        for alignment in batch:
+            if alignment[2] != self.__query:
+                self.__add_query()
+                self.__query = alignment[2]
+            self.__query_alignments.append(alignment)
+
+    def add_alignment(self, taxon, marker, query, identity, coverage):
+        self.add_alignments([(taxon, marker, query, identity, coverage)])
+
+    def __add_query(self):
+        if not self.__query_alignments:
+            return
+        total_weight_for_query = sum(identity * identity for taxon, marker, query, identity, coverage in self.__query_alignments)
+        # weighted coverage, weight, alignment count, top identity
+        query_sums = {}
+        for taxon, marker, query, identity, coverage in self.__query_alignments:
+            sums = query_sums.get((taxon, marker))
+            if sums is None:
+                sums = [0.0, 0.0, 0, identity]
+                query_sums[(taxon, marker)] = sums
+            sums[0] += coverage * identity * identity
+            sums[1] += identity * identity
+            sums[2] += 1
+            sums[3] = max(sums[3], identity)
+        for key, (weighted_coverage, weight, alignment_count, top_identity) in query_sums.items():
+            marker_sums = self.__marker_sums.get(key)
+            if marker_sums is None:
+                marker_sums = [0.0, 0.0, 0, 0.0, 0]
+                self.__marker_sums[key] = marker_sums
+            marker_sums[0] += weighted_coverage / total_weight_for_query
+            marker_sums[1] += weight / total_weight_for_query
+            marker_sums[2] += alignment_count
+            marker_sums[3] += top_identity
+            marker_sums[4] += 1
+        self.__query = None
+        self.__query_alignments = []
+
+    def __marker_stats(self, num_reads):
+        self.__add_query()
+        for (taxon, marker), (coverage, read_count, alignment_count, top_identity_sum, num_queries) in sorted(self.__marker_sums.items()):
+            yield (taxon, marker), {
+              "marker_coverage": coverage,
+              "marker_cpm": coverage / num_reads * 1000000 if num_reads else None,
+              "marker_alignment_count": alignment_count,
+              "marker_read_count": read_count,
+              "marker_avg_identity": top_identity_sum / num_queries,
+            }
+
+    def __taxon_stats(self, num_reads):
+        taxon_stats = {}
+        for (taxon, marker), stats in self.__marker_stats(num_reads):
+            taxon_stats.setdefault(taxon, []).append(stats)
+        for taxon, marker_stats in taxon_stats.items():
+            coverage = sum(stats["marker_coverage"] for stats in marker_stats) / len(marker_stats)
+            yield taxon, {
+              "coverage": coverage,
+              "cpm": coverage / num_reads * 1000000 if num_reads else None,
+              "taxon_num_reads": sum(stats["marker_read_count"] for stats in marker_stats),
+              "taxon_num_alignments": sum(stats["marker_alignment_count"] for stats in marker_stats),
+              "taxon_num_markers": len(marker_stats),
+              "taxon_max_reads_in_marker": max(stats["marker_read_count"] for stats in marker_stats),
+            }
+
+    def report_output(self, output_type, num_reads):
+        if output_type in marker_output_columns:
+            columns = marker_output_columns[output_type]
+            lines = [(taxon, marker, *[stats[column] for column in columns]) for (taxon, marker), stats in self.__marker_stats(num_reads)]
+            return (("taxon", "marker", *columns), lines)
+        if output_type in taxon_output_columns:
+            columns = taxon_output_columns[output_type]
+            lines = [(taxon, *[stats[column] for column in columns]) for taxon, stats in self.__taxon_stats(num_reads)]
+            return (("taxon", *columns), lines)
+        raise ValueError("Output type not available with --streaming: " + output_type + ". Please choose one of the following: " + ", ".join(streaming_output_type_options))
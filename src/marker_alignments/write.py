@@ -1,3 +1,7 @@
+import sys
+import gzip
+import numbers
+import itertools
 
 
 # populated when the module loads
@@ -6,8 +10,10 @@ sqls = {}
 
 # when splitting read stats by query, do it proportionally to the second power of match identity
 # if there are multiple matches in a query + taxon + marker, return identity as max and coverage as weighted average
+# the alignments refer to taxa and markers by ids, so the names are joined in last
+# total_weight_for_query comes from the store's query_stats table
 marker_query_template='''
-  select taxon, marker, {} from (
+  select tx.taxon, mk.marker, {} from (
     select
       a.query,
       a.taxon,
@@ -15,13 +21,12 @@ marker_query_template='''
       max(a.identity) as identity,
       {}
     from
-      alignment a join (
-      select query, sum(identity * identity) as total_weight_for_query
-        from alignment group by query
-      ) as m
+      alignment_ids a, query_stats m
     where a.query = m.query
     group by a.taxon, a.marker, a.query
-  ) group by taxon, marker
+  ) s, taxa tx, markers mk
+  where tx.id = s.taxon and mk.id = s.marker
+  group by tx.taxon, mk.marker
 '''
 s_cov="sum(coverage) as marker_coverage"
 p_cov="sum(a.coverage * a.identity * a.identity) / (m.total_weight_for_query) as coverage"
@@ -54,10 +59,26 @@ num_reads_arg_count_in_sql['taxon_cpm'] = 1
 sqls['taxon_all'] = taxon_query_template.format(", ".join([a_cov, a_cpm, a_tnm]), sqls['marker_all'])
 num_reads_arg_count_in_sql['taxon_all'] = 2
 
+# when a run writes several marker and taxon outputs, marker_all is computed once into a marker_stats table
+# and each of these outputs reads from it
+marker_stats_sqls = {}
+num_reads_arg_count_in_marker_stats_sql = {}
+marker_stats_sqls['marker_coverage'] = "select taxon, marker, marker_coverage from marker_stats"
+marker_stats_sqls['marker_read_count'] = "select taxon, marker, marker_alignment_count, marker_read_count, marker_avg_identity from marker_stats"
+marker_stats_sqls['marker_cpm'] = "select taxon, marker, marker_cpm from marker_stats"
+marker_stats_sqls['marker_all'] = "select * from marker_stats"
+marker_stats_sqls['taxon_coverage'] = taxon_query_template.format(a_cov, marker_stats_sqls['marker_all'])
+marker_stats_sqls['taxon_read_and_marker_count'] = taxon_query_template.format(a_tnm, marker_stats_sqls['marker_all'])
+marker_stats_sqls['taxon_cpm'] = taxon_query_template.format(a_cpm, marker_stats_sqls['marker_all'])
+num_reads_arg_count_in_marker_stats_sql['taxon_cpm'] = 1
+marker_stats_sqls['taxon_all'] = taxon_query_template.format(", ".join([a_cov, a_cpm, a_tnm]), marker_stats_sqls['marker_all'])
+num_reads_arg_count_in_marker_stats_sql['taxon_all'] = 1
 
+
+# reference definition - get_output counts the pairs in one pass over queries instead of this self join
 sqls['pairs_of_taxa_shared_queries'] = '''
-select at as taxon,
-       bt as related_taxon,
+select tx.taxon as taxon,
+       rtx.taxon as related_taxon,
        sum(at_higher_identity_than_bt) as num_queries_where_taxon_higher_identity,
        sum(at_equal_or_higher_identity_than_bt) as num_queries_where_taxon_at_least_equal_identity,
        count(at_higher_identity_than_bt) as num_queries_shared
@@ -65,18 +86,21 @@ from   (select a.taxon at,
                b.taxon bt,
                max(a.identity) - max(b.identity) > 1e-6 as at_higher_identity_than_bt,
                max(a.identity) - max(b.identity) > -1e-6 as at_equal_or_higher_identity_than_bt
-        from   alignment a,
-               alignment b
+        from   alignment_ids a,
+               alignment_ids b
         where  a.query = b.query
         and a.taxon != b.taxon
         group by a.query, at, bt
-               )
-group  by at,
-          bt
-order  by at
+               ),
+       taxa tx,
+       taxa rtx
+where  tx.id = at and rtx.id = bt
+group  by tx.taxon,
+          rtx.taxon
+order  by tx.taxon
 '''
 
-sqls['taxa_in_marker_clusters']= '''select taxon,
+sqls['taxa_in_marker_clusters']= '''select tx.taxon as taxon,
   count(*) as taxon_num_marker_clusters,
   sum(higher_identity) as taxon_num_marker_clusters_at_least_cluster_average,
   sum(top_identity) as taxon_num_marker_clusters_best_in_cluster,
@@ -89,35 +113,44 @@ from (
     t3.max_cluster_identity - avg_identity < 1e-6 as top_identity
     from (
       select id, mc.taxon, mc.marker, count(distinct query) as num_matches, avg(identity) as avg_identity
-        from marker_cluster mc, alignment a
+        from marker_cluster mc, alignment_ids a
         where mc.taxon = a.taxon and mc.marker = a.marker
         group by id, mc.taxon, mc.marker
     ) t1, (
     select id, avg(a.identity) as avg_cluster_identity, count(distinct mc.taxon) as num_taxa
-        from marker_cluster mc, alignment a
+        from marker_cluster mc, alignment_ids a
         where mc.taxon = a.taxon and mc.marker = a.marker
         group by id
     ) t2, (
     select id, max(avg_identity) as max_cluster_identity
     from (
           select id, mc.taxon, mc.marker, avg(identity) as avg_identity
-            from marker_cluster mc, alignment a
+            from marker_cluster mc, alignment_ids a
             where mc.taxon = a.taxon and mc.marker = a.marker
             group by id, mc.taxon, mc.marker
         )
         group by id
     ) t3
     where t1.id = t2.id and t1.id = t3.id
-   )
-group by taxon
+   ) s, taxa tx
+where tx.id = s.taxon
+group by tx.taxon
 order by -taxon_num_marker_clusters, -taxon_num_marker_clusters_unique_in_cluster, -taxon_num_marker_clusters_best_in_cluster
 '''
 output_type_options = [k for k in sqls]
 
-def get_output(alignment_store, output_type, num_reads):
-    args = [sqls[output_type]]
-    if output_type in num_reads_arg_count_in_sql:
-        args.append([num_reads] * num_reads_arg_count_in_sql[output_type])
+def get_output(alignment_store, output_type, num_reads, use_marker_stats = False):
+    # stores other than sqlite compute each output themselves
+    if hasattr(alignment_store, 'report_output'):
+        return alignment_store.report_output(output_type, num_reads)
+    if output_type == 'pairs_of_taxa_shared_queries':
+        return alignment_store.report_pairs_of_taxa_shared_queries()
+    if use_marker_stats and output_type in marker_stats_sqls:
+        args = [marker_stats_sqls[output_type], [num_reads] * num_reads_arg_count_in_marker_stats_sql.get(output_type, 0)]
+    else:
+        args = [sqls[output_type]]
+        if output_type in num_reads_arg_count_in_sql:
+            args.append([num_reads] * num_reads_arg_count_in_sql[output_type])
     return alignment_store.report(*args)
 
 field_formats = {
@@ -143,10 +176,89 @@ field_formats = {
   "taxon_num_marker_clusters_best_in_cluster": ":d",
   "taxon_num_marker_clusters_unique_in_cluster": ":d",
 }
-def write(alignment_store, output_type, output_path, num_reads):
-    header, lines = get_output(alignment_store, output_type, num_reads)
-    formatter="\t".join(['{' + field_formats[field] +'}' for field in header]) + "\n"
+# rows are fetched, formatted, and written in batches rather than one at a time
+def batches_of_lines(lines, batch_size):
+    if hasattr(lines, 'fetchmany'):
+        while True:
+            batch = lines.fetchmany(batch_size)
+            if not batch:
+                return
+            yield batch
+    else:
+        lines = iter(lines)
+        while True:
+            batch = list(itertools.islice(lines, batch_size))
+            if not batch:
+                return
+            yield batch
+
+# .gz or .zst at the end of the path compresses the output
+def open_output(output_path):
+    if output_path.endswith(".gz"):
+        return gzip.open(output_path, 'wt', compresslevel = 6)
+    if output_path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Writing " + output_path + " needs the zstandard package: pip install zstandard")
+        return zstandard.open(output_path, 'wt')
+    return open(output_path, 'w', buffering = output_buffer_size)
+
+output_buffer_size = 1024 * 1024
+
+# same formats as field_formats, in printf style - a whole batch is formatted with one % operation
+def printf_format(field_format):
+    return "%" + (field_format[1:] if field_format else "s")
+
+# %d truncates a float, where {:d} refused it, so integer columns are checked
+# a store gives each column the same type on every line, so the first batch is enough
+def check_integer_fields(header, batch):
+    for ix, field in enumerate(header):
+        if field_formats[field] == ":d":
+            for line in batch:
+                if line[ix] is not None and not isinstance(line[ix], numbers.Integral):
+                    raise ValueError("Expected an integer for " + field + ", got: " + repr(line[ix]))
+
+def write_lines(f, header, lines, batch_size):
+    formatter="\t".join([printf_format(field_formats[field]) for field in header]) + "\n"
+    f.write("\t".join(header) + "\n")
+    num_lines = 0
+    for batch in batches_of_lines(lines, batch_size):
+        if not num_lines:
+            check_integer_fields(header, batch)
+        f.write((formatter * len(batch)) % tuple(itertools.chain.from_iterable(batch)))
+        num_lines += len(batch)
+    return num_lines
+
+# output path "-" writes to standard output
+# returns the number of lines written, not counting the header
+def write(alignment_store, output_type, output_path, num_reads, batch_size = 10000, use_marker_stats = False):
+    header, lines = get_output(alignment_store, output_type, num_reads, use_marker_stats = use_marker_stats)
+    if output_path == "-":
+        num_lines = write_lines(sys.stdout, header, lines, batch_size)
+        sys.stdout.flush()
+        return num_lines
+    with open_output(output_path) as f:
+        return write_lines(f, header, lines, batch_size)
+
+# outputs is a list of (output type, output path)
+# returns the number of lines written in all outputs
+def write_outputs(alignment_store, outputs, num_reads):
+    use_marker_stats = not hasattr(alignment_store, 'report_output') and len([output_type for output_type, output_path in outputs if output_type in marker_stats_sqls]) > 1
+    if use_marker_stats:
+        alignment_store.create_report_table('marker_stats', sqls['marker_all'], [num_reads])
+    num_lines = 0
+    for output_type, output_path in outputs:
+        num_lines += write(alignment_store, output_type, output_path, num_reads, use_marker_stats = use_marker_stats)
+    if use_marker_stats:
+        alignment_store.drop_report_table('marker_stats')
+    return num_lines
+
+def write_read_counts(read_counts, output_path):
+    stages = [stage for stage in read_counts if stage != "kept"]
+    num_alignments = sum(read_counts.values())
     with open(output_path, 'w') as f:
-        f.write("\t".join(header) + "\n")
-        for line in lines:
-            f.write(formatter.format(*line))
+        f.write("\t".join(["read_filter", "num_alignments_before", "num_alignments_dropped", "num_alignments_after"]) + "\n")
+        for stage in stages:
+            f.write("{}\t{:d}\t{:d}\t{:d}\n".format(stage, num_alignments, read_counts[stage], num_alignments - read_counts[stage]))
+            num_alignments -= read_counts[stage]
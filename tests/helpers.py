@@ -0,0 +1,20 @@
+import random
+
+# identities are a few fixed values, to have ties, and thresholds are between the possible averages
+def random_alignments(seed, num_alignments = 300):
+    rng = random.Random(seed)
+    return [("taxon_" + str(rng.randrange(8)), "marker_" + str(rng.randrange(6)), "query_" + str(rng.randrange(80)), rng.choice([0.9, 0.95, 0.97, 1.0]), round(rng.random(), 6)) for ix in range(0, num_alignments)]
+
+# stores can add up floats in a different order, so floats are compared to a few places
+class SameLinesMixin:
+
+    def assertSameLines(self, lines, expected_lines):
+        lines = list(lines)
+        expected_lines = list(expected_lines)
+        self.assertEqual(len(lines), len(expected_lines))
+        for line, expected_line in zip(lines, expected_lines):
+            for value, expected_value in zip(line, expected_line):
+                if type(value) == float:
+                    self.assertAlmostEqual(value, expected_value)
+                else:
+                    self.assertEqual(value, expected_value)
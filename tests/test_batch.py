@@ -0,0 +1,177 @@
+import unittest
+import os
+import sys
+import tempfile
+import contextlib
+import numpy
+import scipy.sparse
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+input_path = dir_path + "/data/example.sam"
+
+from marker_alignments.main import main
+from marker_alignments.matrix import new_matrix_writer
+
+def write_manifest(path, lines):
+    with open(path, 'w') as f:
+        for line in lines:
+            f.write("\t".join(line) + "\n")
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+class Batch(unittest.TestCase):
+
+    def test_batch(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected_path = os.path.join(tmp_dir, "expected.tsv")
+            main(["--input", input_path, "--output", expected_path, "--output-type", "taxon_all", "--num-reads", "42", "--min-taxon-num-markers", "1"])
+            for processes in [1, 2]:
+                with self.subTest(processes = processes):
+                    manifest_path = os.path.join(tmp_dir, "manifest.tsv")
+                    report_path = os.path.join(tmp_dir, "report.tsv")
+                    write_manifest(manifest_path, [
+                      ["sample", "input", "num_reads", "outputs"],
+                      ["a", input_path, "42", "taxon_all:" + os.path.join(tmp_dir, "a.tsv")],
+                      ["missing", os.path.join(tmp_dir, "no_such.sam"), "42", "taxon_all:" + os.path.join(tmp_dir, "missing.tsv")],
+                      ["b", input_path, "42", "taxon_all:" + os.path.join(tmp_dir, "b.tsv") + " marker_coverage:" + os.path.join(tmp_dir, "b.markers.tsv")],
+                    ])
+                    with contextlib.redirect_stderr(open(os.devnull, 'w')):
+                        result = main(["batch", "--manifest", manifest_path, "--report", report_path, "--processes", str(processes), "--min-taxon-num-markers", "1"])
+                    self.assertEqual(result, 1)
+                    self.assertEqual(read(os.path.join(tmp_dir, "a.tsv")), read(expected_path))
+                    self.assertEqual(read(os.path.join(tmp_dir, "b.tsv")), read(expected_path))
+                    self.assertTrue(os.path.isfile(os.path.join(tmp_dir, "b.markers.tsv")))
+
+                    report = [line.split("\t") for line in read(report_path).splitlines()]
+                    self.assertEqual(report[0], ["sample", "status", "seconds", "error"])
+                    self.assertEqual([(line[0], line[1]) for line in report[1:]], [("a", "ok"), ("missing", "failed"), ("b", "ok")])
+
+    def test_matrix(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected_path = os.path.join(tmp_dir, "expected.tsv")
+            db_path = os.path.join(tmp_dir, "alignments.db")
+            main(["--input", input_path, "--output", expected_path, "--output-type", "taxon_cpm", "--num-reads", "42", "--sqlite-db-path", db_path])
+            expected = dict((line.split("\t")[0], float(line.split("\t")[1])) for line in read(expected_path).splitlines()[1:])
+            self.assertTrue(expected)
+
+            manifest_path = os.path.join(tmp_dir, "manifest.tsv")
+            write_manifest(manifest_path, [
+              ["sample", "input", "from_sqlite_db", "num_reads"],
+              ["a", input_path, "", "42"],
+              ["missing", os.path.join(tmp_dir, "no_such.sam"), "", "42"],
+              ["b", "", db_path, "42"],
+            ])
+            matrices = {}
+            for matrix_format in ["tsv", "triplets", "npz"]:
+                matrix_path = os.path.join(tmp_dir, "matrix." + matrix_format)
+                with contextlib.redirect_stderr(open(os.devnull, 'w')):
+                    main(["batch", "--manifest", manifest_path, "--report", os.path.join(tmp_dir, "report.tsv"), "--matrix", matrix_path, "--matrix-format", matrix_format])
+                matrices[matrix_format] = matrix_path
+
+            lines = [line.split("\t") for line in read(matrices["tsv"]).splitlines()]
+            self.assertEqual(lines[0], ["sample", *sorted(expected)])
+            self.assertEqual([line[0] for line in lines[1:]], ["a", "b"])
+            for line in lines[1:]:
+                for taxon, value in zip(lines[0][1:], line[1:]):
+                    self.assertAlmostEqual(float(value), expected[taxon], places = 5)
+
+            lines = [line.split("\t") for line in read(matrices["triplets"]).splitlines()]
+            self.assertEqual(lines[0], ["sample", "taxon", "cpm"])
+            self.assertEqual(sorted((line[0], line[1]) for line in lines[1:]), sorted((sample, taxon) for sample in ["a", "b"] for taxon in expected if expected[taxon]))
+
+            npz = numpy.load(matrices["npz"])
+            matrix = scipy.sparse.load_npz(matrices["npz"]).toarray()
+            self.assertEqual(list(npz["samples"]), ["a", "b"])
+            self.assertEqual(list(npz["features"]), sorted(expected))
+            for row in matrix:
+                for taxon, value in zip(npz["features"], row):
+                    self.assertAlmostEqual(value, expected[taxon], places = 5)
+
+    def test_save_and_rerun_from_sqlite_db(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected_path = os.path.join(tmp_dir, "expected.tsv")
+            main(["--input", input_path, "--output", expected_path, "--output-type", "taxon_all", "--num-reads", "42", "--min-taxon-num-markers", "2"])
+            manifest_path = os.path.join(tmp_dir, "manifest.tsv")
+            db_paths = dict((sample, os.path.join(tmp_dir, sample + ".db")) for sample in ["a", "b"])
+            write_manifest(manifest_path, [["sample", "input", "sqlite_db_path"], *[[sample, input_path, db_path] for sample, db_path in db_paths.items()]])
+            with contextlib.redirect_stderr(open(os.devnull, 'w')):
+                result = main(["batch", "--manifest", manifest_path, "--report", os.path.join(tmp_dir, "report.tsv")])
+            self.assertEqual(result, 0)
+
+            write_manifest(manifest_path, [["sample", "from_sqlite_db", "num_reads", "outputs"], *[[sample, db_path, "42", "taxon_all:" + os.path.join(tmp_dir, sample + ".tsv")] for sample, db_path in db_paths.items()]])
+            with contextlib.redirect_stderr(open(os.devnull, 'w')):
+                result = main(["batch", "--manifest", manifest_path, "--report", os.path.join(tmp_dir, "report.tsv"), "--min-taxon-num-markers", "2"])
+            self.assertEqual(result, 0)
+            for sample in db_paths:
+                self.assertEqual(read(os.path.join(tmp_dir, sample + ".tsv")), read(expected_path))
+
+    def test_triplets_leave_out_zeros(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "matrix.tsv")
+            matrix_writer, value_column = new_matrix_writer("triplets", path, "marker_read_count", "marker_read_count")
+            matrix_writer.add_sample("a", [(("taxon_1", "marker_1"), 2.0), (("taxon_1", "marker_2"), 0.0)])
+            matrix_writer.close()
+            self.assertEqual(read(path).splitlines(), ["sample\ttaxon\tmarker\tmarker_read_count", "a\ttaxon_1\tmarker_1\t2.00"])
+
+    def test_npz_feature_taxa_and_markers(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "matrix.npz")
+            matrix_writer, value_column = new_matrix_writer("npz", path, "marker_read_count", "marker_read_count")
+            matrix_writer.add_sample("a", [(("taxon_1", "marker|1"), 2.0), (("taxon_2", "marker_2"), 1.0)])
+            matrix_writer.close()
+            npz = numpy.load(path)
+            self.assertEqual(list(npz["features"]), ["taxon_1|marker|1", "taxon_2|marker_2"])
+            self.assertEqual(list(npz["feature_taxa"]), ["taxon_1", "taxon_2"])
+            self.assertEqual(list(npz["feature_markers"]), ["marker|1", "marker_2"])
+
+    def test_taxa_with_feature_separator(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            values = [(("taxon|1", "marker"), 1.0), (("taxon", "1|marker"), 2.0)]
+            path = os.path.join(tmp_dir, "matrix.tsv")
+            matrix_writer, value_column = new_matrix_writer("tsv", path, "marker_read_count", "marker_read_count")
+            matrix_writer.add_sample("a", values)
+            matrix_writer.close()
+            self.assertEqual(read(path).splitlines(), ["taxon\ttaxon\ttaxon|1", "marker\t1|marker\tmarker", "a\t2.00\t1.00"])
+
+            path = os.path.join(tmp_dir, "matrix.npz")
+            matrix_writer, value_column = new_matrix_writer("npz", path, "marker_read_count", "marker_read_count")
+            matrix_writer.add_sample("a", values)
+            matrix_writer.close()
+            npz = numpy.load(path)
+            self.assertEqual(list(zip(npz["feature_taxa"], npz["feature_markers"])), [("taxon", "1|marker"), ("taxon|1", "marker")])
+            self.assertEqual(scipy.sparse.load_npz(path).toarray().tolist(), [[2.0, 1.0]])
+
+    def test_marker_matrix_with_marker_to_taxon(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            marker_to_taxon_path = os.path.join(tmp_dir, "marker_to_taxon.tsv")
+            write_manifest(marker_to_taxon_path, [["taxon_1:marker_1", "T1"]])
+            manifest_path = os.path.join(tmp_dir, "manifest.tsv")
+            write_manifest(manifest_path, [["sample", "input"], ["a", input_path]])
+            matrix_path = os.path.join(tmp_dir, "matrix.tsv")
+            with contextlib.redirect_stderr(open(os.devnull, 'w')):
+                result = main(["batch", "--manifest", manifest_path, "--report", os.path.join(tmp_dir, "report.tsv"), "--matrix", matrix_path, "--matrix-output-type", "marker_coverage", "--refdb-marker-to-taxon-path", marker_to_taxon_path])
+            self.assertEqual(result, 0)
+            lines = [line.split("\t") for line in read(matrix_path).splitlines()]
+            self.assertEqual([line[0] for line in lines], ["taxon", "marker", "a"])
+            self.assertIn(("T1|taxon_1", "marker_1"), list(zip(lines[0][1:], lines[1][1:])))
+
+    def test_bad_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest_path = os.path.join(tmp_dir, "manifest.tsv")
+            write_manifest(manifest_path, [["sample", "input", "outputs"], ["a", input_path, "taxon_all:" + os.path.join(tmp_dir, "a.tsv")]])
+            with self.assertRaises(ValueError):
+                main(["batch", "--manifest", manifest_path])
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(open(os.devnull, 'w')):
+                main(["batch", "--manifest", manifest_path, "--output", os.path.join(tmp_dir, "out.tsv")])
+            write_manifest(manifest_path, [["sample", "input", "output"], ["a", input_path, os.path.join(tmp_dir, "a.tsv")]])
+            with self.assertRaises(ValueError):
+                main(["batch", "--manifest", manifest_path])
+            write_manifest(manifest_path, [["sample", "input", "outputs"], ["a", input_path, "marker_coverage:" + os.path.join(tmp_dir, "a.tsv")], ["a", input_path, "marker_coverage:" + os.path.join(tmp_dir, "b.tsv")]])
+            with self.assertRaises(ValueError):
+                main(["batch", "--manifest", manifest_path])
+            self.assertFalse(os.path.exists(os.path.join(tmp_dir, "a.tsv")))
+
+if __name__ == '__main__':
+    unittest.main()
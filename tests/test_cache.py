@@ -0,0 +1,56 @@
+import unittest
+import os
+import time
+import tempfile
+from unittest import mock
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+input_path = dir_path + "/data/example.sam"
+
+from marker_alignments import cache
+import marker_alignments.main
+from marker_alignments.main import main
+
+def run_and_read_outputs(tmp_dir, optional_args = []):
+    output_path = os.path.join(tmp_dir, "out.tsv")
+    stats_path = os.path.join(tmp_dir, "stats.tsv")
+    main(["--input", input_path, "--output", output_path, "--output-type", "marker_all", "--num-reads", "1000", "--stats-output", stats_path, *optional_args])
+    with open(output_path) as f, open(stats_path) as g:
+        return f.read(), g.read()
+
+class Cache(unittest.TestCase):
+
+    def test_hit_gives_the_same_outputs(self):
+        for backend in ["sqlite", "numpy"]:
+            with self.subTest(backend), tempfile.TemporaryDirectory() as tmp_dir:
+                args = ["--backend", backend, "--cache-dir", os.path.join(tmp_dir, "cache")]
+                expected = run_and_read_outputs(tmp_dir, ["--backend", backend])
+                self.assertEqual(run_and_read_outputs(tmp_dir, args), expected)
+                with mock.patch.object(marker_alignments.main, "read_alignments", side_effect = AssertionError("read alignments on a cache hit")):
+                    self.assertEqual(run_and_read_outputs(tmp_dir, args), expected)
+
+    def test_read_filters_are_part_of_the_key(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = os.path.join(tmp_dir, "cache")
+            run_and_read_outputs(tmp_dir, ["--cache-dir", cache_dir])
+            expected = run_and_read_outputs(tmp_dir, ["--min-read-mapq", "20"])
+            self.assertEqual(run_and_read_outputs(tmp_dir, ["--cache-dir", cache_dir, "--min-read-mapq", "20"]), expected)
+            self.assertEqual(len([f for f in os.listdir(cache_dir) if f.endswith(".json")]), 2)
+
+    def test_evict_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for ix, name in enumerate(["old", "used", "new"]):
+                for extension in [".sqlite", ".json"]:
+                    path = os.path.join(cache_dir, name + extension)
+                    with open(path, 'w') as f:
+                        f.write("x" * 50)
+                    os.utime(path, (time.time() - 100 + ix, time.time() - 100 + ix))
+            os.utime(os.path.join(cache_dir, "used.json"))
+
+            cache.evict(cache_dir, 250, keep = "old")
+            self.assertEqual(sorted(os.listdir(cache_dir)), ["old.json", "old.sqlite", "used.json", "used.sqlite"])
+            cache.evict(cache_dir, 0)
+            self.assertEqual(os.listdir(cache_dir), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+import random
+
+from marker_alignments.cooccurrence import count_cooccurrences, symmetric_triples, compare_top_identities
+from marker_alignments.store import AlignmentStore
+from marker_alignments.write import get_output, sqls
+
+class Cooccurrence(unittest.TestCase):
+
+    def test_count_cooccurrences(self):
+        rows = [("q1", "a"), ("q1", "b"), ("q1", "b"), ("q2", "a"), ("q3", "b"), ("q3", "a")]
+        counts = count_cooccurrences(rows)
+        self.assertEqual(counts, {("a", "a"): 3, ("a", "b"): 2, ("b", "b"): 2})
+        self.assertEqual(sorted(symmetric_triples(counts)), [("a", "a", 3), ("a", "b", 2), ("b", "a", 2), ("b", "b", 2)])
+
+    def test_compare_top_identities(self):
+        rows = [("q1", "a", 0.9), ("q1", "a", 1.0), ("q1", "b", 1.0), ("q2", "a", 0.5), ("q2", "b", 0.8), ("q3", "a", 1.0)]
+        self.assertEqual(compare_top_identities(rows), {("a", "b"): [0, 1, 2], ("b", "a"): [1, 2, 2]})
+
+    def test_pairs_of_taxa_same_as_sql(self):
+        rng = random.Random(0)
+        alignment_store = AlignmentStore()
+        for ix in range(0, 500):
+            alignment_store.add_alignment("taxon_" + str(rng.randrange(10)), "marker_" + str(rng.randrange(5)), "query_" + str(rng.randrange(100)), rng.choice([0.9, 0.95, 1.0]), 0.1)
+
+        header, lines = get_output(alignment_store, "pairs_of_taxa_shared_queries", None)
+        expected_header, expected_lines = alignment_store.report(sqls["pairs_of_taxa_shared_queries"])
+        self.assertEqual(header, expected_header)
+        self.assertEqual(list(lines), list(expected_lines))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+import subprocess
+import sys
+
+# import marker_alignments.main took about 0.25 seconds when this was recorded, and about 2 seconds with scipy and sklearn
+import_time_budget_seconds = 1.0
+
+def import_seconds(importtime_lines):
+    """
+    :param importtime_lines: standard error of python -X importtime - self and cumulative microseconds, and the module, indented under the module that imported it
+    :returns: the sum of cumulative times of top level imports
+    """
+    total = 0
+    for line in importtime_lines:
+        fields = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        if not fields[2][1:].startswith(" "):
+            total += int(fields[1])
+    return total / 1000000
+
+class Import(unittest.TestCase):
+
+    # scipy is only needed for clustering, so it's imported when a run clusters
+    def test_main_starts_without_clustering_modules(self):
+        result = subprocess.run([sys.executable, "-c", "import sys, marker_alignments.main; print(' '.join(sorted(sys.modules)))"], stdout = subprocess.PIPE, check = True, universal_newlines = True)
+        modules = result.stdout.split()
+        self.assertIn("marker_alignments.main", modules)
+        for module in ["sklearn", "scipy", "marker_alignments.mcl"]:
+            self.assertNotIn(module, modules)
+
+    def test_import_time(self):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import marker_alignments.main"], stderr = subprocess.PIPE, check = True, universal_newlines = True)
+        seconds = import_seconds(result.stderr.splitlines())
+        self.assertGreater(seconds, 0)
+        self.assertLess(seconds, import_time_budget_seconds)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
 import unittest
 import pysam
+import numpy as np
+from scipy.sparse import csc_matrix
 
-from marker_alignments.mcl import clusters
+from marker_alignments.mcl import clusters, run_mcl, get_clusters, component_clusters, normalize
 
 
 class Mcl(unittest.TestCase):
@@ -32,5 +34,47 @@ class Mcl(unittest.TestCase):
         ])
         self.assertEqual(result,[['t1', 't2', 't5'], ['t3', 't4']])
 
+    def test_sparse_same_as_dense(self):
+        rng = np.random.default_rng(42)
+        matrix = rng.integers(0, 10, size = (30, 30)) * (rng.random((30, 30)) < 0.15)
+        matrix = (matrix + matrix.T).astype(float)
+        self.assertEqual(get_clusters(run_mcl(csc_matrix(matrix))), get_clusters(run_mcl(matrix)))
+
+    def test_many_nodes(self):
+        # would be a 9000 x 9000 matrix if dense
+        triples = []
+        for ix in range(0, 3000):
+            for x in ["a", "b", "c"]:
+                for y in ["a", "b", "c"]:
+                    triples.append([x + str(ix), y + str(ix), 10])
+        result = clusters(triples)
+        self.assertEqual(len(result), 3000)
+        self.assertEqual(result[0], ['a0', 'b0', 'c0'])
+
+    def test_components_same_as_whole_graph(self):
+        # a singleton, two pairs, a triangle, and a path of four
+        matrix = np.zeros([12, 12])
+        for i, j, value in [(1, 2, 1), (3, 4, 5), (5, 6, 2), (6, 7, 3), (5, 7, 1), (8, 9, 1), (9, 10, 4), (10, 11, 1)]:
+            matrix[i, j] = value
+            matrix[j, i] = value
+        expected = get_clusters(run_mcl(csc_matrix(matrix)))
+        for batch_size in [1, 3, 1000]:
+            with self.subTest(batch_size):
+                self.assertEqual(component_clusters(csc_matrix(matrix), batch_size = batch_size), expected)
+        self.assertEqual(component_clusters(csc_matrix(matrix), processes = 2, batch_size = 1), expected)
+
+    def test_normalize(self):
+        matrix = np.array([[1.0, 0, 0.1], [3.0, 0, 0.2], [0, 0, 0.3]])
+        total = 0.1 + 0.2 + 0.3
+        expected = np.array([[0.25, 0, 0.1 / total], [0.75, 0, 0.2 / total], [0, 0, 0.3 / total]])
+        np.testing.assert_array_equal(normalize(matrix), expected)
+        # entries of each column are added in order, like in sklearn, rather than pairwise
+        np.testing.assert_array_equal(normalize(csc_matrix(matrix)).toarray(), expected)
+        self.assertEqual(normalize(csc_matrix(matrix)).format, "csc")
+
+        rng = np.random.default_rng(0)
+        matrix = rng.random((50, 50)) * (rng.random((50, 50)) < 0.5)
+        np.testing.assert_array_equal(normalize(csc_matrix(matrix)).toarray(), normalize(matrix))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import pysam
+
+import os
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+import re
+from marker_alignments.main import read_alignments
+from marker_alignments.store import AlignmentStore
+from marker_alignments.numpy_store import NumpyAlignmentStore
+from marker_alignments.write import get_output, output_type_options
+from tests.helpers import random_alignments, SameLinesMixin
+
+pattern_taxon = re.compile("^([^:]+):[^:]+$")
+pattern_marker = re.compile("^[^:]+:([^:]+)$")
+
+def both_backends(alignments):
+    stores = [AlignmentStore(), NumpyAlignmentStore()]
+    for alignment_store in stores:
+        alignment_store.start_bulk_write()
+        alignment_store.add_alignments(alignments)
+        alignment_store.end_bulk_write()
+    return stores
+
+class NumpyStore(unittest.TestCase, SameLinesMixin):
+
+    def assertSameContent(self, sqlite_store, numpy_store):
+        self.assertEqual(sorted(sqlite_store.query('select * from alignment')), sorted(numpy_store.alignments()))
+
+    def assertSameOutputs(self, sqlite_store, numpy_store):
+        for output_type in output_type_options:
+            with self.subTest(output_type):
+                header, lines = get_output(sqlite_store, output_type, 1000)
+                numpy_header, numpy_lines = get_output(numpy_store, output_type, 1000)
+                self.assertEqual(tuple(header), tuple(numpy_header))
+                self.assertSameLines(numpy_lines, lines)
+
+    def test_read_alignments(self):
+        stores = [read_alignments(pysam.AlignmentFile(dir_path + "/data/example.sam"), None, pattern_taxon, pattern_marker, {}, 0, 0, 0, backend = backend) for backend in ["sqlite", "numpy"]]
+        self.assertSameContent(*stores)
+        self.assertSameOutputs(*stores)
+
+    def test_outputs(self):
+        for seed in range(0, 3):
+            stores = both_backends(random_alignments(seed))
+            for alignment_store in stores:
+                alignment_store.cluster_markers_by_matches()
+            self.assertSameContent(*stores)
+            self.assertSameOutputs(*stores)
+
+    def test_filters(self):
+        filters = [
+          lambda s: s.modify_table_filter_taxa_on_multiple_matches(min_fraction_primary_matches = 0.5),
+          lambda s: s.modify_table_filter_taxa_on_num_markers_reads_and_alignments(min_num_markers = 3, min_num_reads = 15, min_num_alignments = 30),
+          lambda s: s.modify_table_filter_taxa_on_avg_identity(min_avg_identity = 0.9612345),
+          lambda s: s.modify_table_filter_taxa_on_cluster_averages(min_better_cluster_averages_ratio = 1.0),
+        ]
+        for seed in range(0, 3):
+            for ix in range(0, len(filters)):
+                with self.subTest(seed = seed, filter = ix):
+                    stores = both_backends(random_alignments(seed))
+                    for alignment_store in stores:
+                        alignment_store.cluster_markers_by_matches()
+                        filters[ix](alignment_store)
+                    self.assertSameContent(*stores)
+
+    def test_transform_taxa(self):
+        for seed in range(0, 3):
+            for min_num_taxa_below_identity in [0, 1, 2]:
+                with self.subTest(seed = seed, min_num_taxa_below_identity = min_num_taxa_below_identity):
+                    stores = both_backends(random_alignments(seed, num_alignments = 100))
+                    for alignment_store in stores:
+                        alignment_store.cluster_taxa_by_matches()
+                        alignment_store.modify_table_transform_taxa_on_thresholds_and_clusters(
+                          threshold_identity = 0.9612345,
+                          min_num_taxa_below_identity = min_num_taxa_below_identity,
+                          min_num_markers_below_identity = 0,
+                          min_num_reads_below_identity = 0)
+                    self.assertSameContent(*stores)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ input_path = dir_path + "/data/example.sam"
 
 import re
 import tempfile
+import sqlite3
 
 from marker_alignments.write import output_type_options
 from marker_alignments.main import main
@@ -46,14 +47,69 @@ class ParseArgs(unittest.TestCase):
         fail(self, ValueError, ["--input", input_path, "--output", output_path, "--refdb-format", "x"])
         fail(self, ValueError, ["--input", input_path, "--output", output_path, "--output-type", "x"])
         fail(self, ValueError, ["--input", input_path, "--output", output_path, "--output-type", "marker_all"])
+        fail(self, ValueError, ["--input", input_path, "--output", output_path, "--backend", "x"])
+        fail(self, SystemExit, ["--input", input_path, "--output-type", "marker_coverage:" + output_path, "taxon_coverage"])
+        fail(self, ValueError, ["--input", input_path, "--output-type", "marker_coverage:" + output_path, "taxon_coverage:" + output_path])
+        fail(self, ValueError, ["--input", input_path, "--output", output_path, "--backend", "numpy", "--sqlite-db-path", output_path + ".db"])
+        fail(self, ValueError, ["--input", input_path, "--output", output_path, "--backend", "numpy", "--keep-filter-snapshots"])
 
     def test_no_optional_args(self):
         run(self, [])
 
+    def test_stats_output(self):
+        stats_path = tempfile.mktemp()
+        run(self, ["--stats-output", stats_path, "--min-read-mapq", "10"])
+        lines = read_lines_and_remove(stats_path)
+        self.assertEqual(lines[0], "read_filter\tnum_alignments_before\tnum_alignments_dropped\tnum_alignments_after\n")
+        self.assertEqual(lines[2], "mapq\t6\t2\t4\n")
+
+    def test_sqlite_profile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run(self, ["--sqlite-db-path", os.path.join(tmp_dir, "alignments.db"), "--sqlite-profile", "wal"])
+
+    def test_multiple_outputs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = dict((output_type, os.path.join(tmp_dir, output_type + ".tsv")) for output_type in output_type_options)
+            main(["--input", input_path, "--num-reads", "42", "--output", paths["marker_coverage"], "--output-type", "marker_coverage", *[output_type + ":" + paths[output_type] for output_type in output_type_options if output_type != "marker_coverage"]])
+            for output_type in output_type_options:
+                with self.subTest(output_type):
+                    expected_path = os.path.join(tmp_dir, "expected.tsv")
+                    main(["--input", input_path, "--num-reads", "42", "--output-type", output_type, "--output", expected_path])
+                    self.assertEqual(read_lines_and_remove(paths[output_type]), read_lines_and_remove(expected_path))
+
+    def test_from_sqlite_db(self):
+        filters = ["--min-taxon-num-markers", "1", "--min-taxon-fraction-primary-matches", "0.5", "--threshold-avg-match-identity-to-call-known-taxon", "0.97"]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "alignments.db")
+            main(["--input", input_path, "--output", os.path.join(tmp_dir, "unfiltered.tsv"), "--sqlite-db-path", db_path])
+            for output_type in output_type_options:
+                with self.subTest(output_type):
+                    expected_path = os.path.join(tmp_dir, "expected.tsv")
+                    output_path = os.path.join(tmp_dir, "out.tsv")
+                    main(["--input", input_path, "--num-reads", "42", "--output-type", output_type, "--output", expected_path, *filters])
+                    main(["--from-sqlite-db", db_path, "--num-reads", "42", "--output-type", output_type, "--output", output_path, *filters])
+                    self.assertEqual(read_lines_and_remove(output_path), read_lines_and_remove(expected_path))
+
+            filtered_db_path = os.path.join(tmp_dir, "filtered.db")
+            main(["--from-sqlite-db", db_path, "--output", os.path.join(tmp_dir, "out.tsv"), "--sqlite-db-path", filtered_db_path, *filters])
+            fail(self, ValueError, ["--from-sqlite-db", filtered_db_path, "--output", os.path.join(tmp_dir, "out.tsv")])
+
+            not_a_store_path = os.path.join(tmp_dir, "not_a_store.db")
+            sqlite3.connect(not_a_store_path).execute("create table x (y integer)")
+            fail(self, ValueError, ["--from-sqlite-db", not_a_store_path, "--output", os.path.join(tmp_dir, "out.tsv")])
+            fail(self, ValueError, ["--from-sqlite-db", os.path.join(tmp_dir, "no_such.db"), "--output", os.path.join(tmp_dir, "out.tsv")])
+            fail(self, ValueError, ["--from-sqlite-db", db_path, "--output", os.path.join(tmp_dir, "out.tsv"), "--sqlite-db-path", db_path])
+            fail(self, SystemExit, ["--from-sqlite-db", db_path, "--input", input_path, "--output", os.path.join(tmp_dir, "out.tsv")])
+
     def test_output_types(self):
         for output_type in output_type_options:
             with self.subTest(output_type):
                 run(self, ["--output-type", output_type, "--num-reads", "42"])
 
+    def test_numpy_backend(self):
+        for output_type in output_type_options:
+            with self.subTest(output_type):
+                run(self, ["--backend", "numpy", "--output-type", output_type, "--num-reads", "42"])
+
 if __name__ == '__main__':
     unittest.main()
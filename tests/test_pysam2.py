@@ -0,0 +1,58 @@
+import unittest
+import pysam
+import random
+
+import os 
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+from marker_alignments.pysam2 import compute_contribution_to_marker_coverage, MarkerCoverageCalculator, count_matches_and_deleted_bases, splitMD
+
+def random_md(rng):
+    # digits, then mismatches or deletions followed by digits, like the SAM spec says
+    parts = [str(rng.randint(0, 200))]
+    for ix in range(0, rng.randint(0, 10)):
+        if rng.random() < 0.3:
+            parts.append("^" + "".join(rng.choice("ACGTN") for b in range(0, rng.randint(1, 5))))
+        else:
+            parts.append(rng.choice("ACGTN"))
+        parts.append(str(rng.randint(0, 200)))
+    return "".join(parts)
+
+def random_string(rng):
+    return "".join(rng.choice("0123456789ACGTN^") for ix in range(0, rng.randint(0, 30)))
+
+def counts_from_split_md(MD):
+    matches = 0
+    deleted_bases = 0
+    ops, counts = splitMD(MD)
+    for op,ct in zip(ops, counts):
+        if op == "M":
+            matches += ct
+        if op == "D":
+            deleted_bases += ct
+    return matches, deleted_bases
+
+class Pysam2(unittest.TestCase):
+
+    def test_count_matches_and_deleted_bases(self):
+        self.assertEqual(count_matches_and_deleted_bases("21T9C6G34A3"), (73, 0))
+        self.assertEqual(count_matches_and_deleted_bases("37^G2G5G2G2G22"), (70, 1))
+        self.assertEqual(count_matches_and_deleted_bases("10A5^AC0T20"), (35, 2))
+
+    def test_count_matches_and_deleted_bases_same_as_split_md(self):
+        rng = random.Random(42)
+        for ix in range(0, 2000):
+            for md in [random_md(rng), random_string(rng)]:
+                self.assertEqual(count_matches_and_deleted_bases(md), counts_from_split_md(md), md)
+
+    def test_coverage_calculator(self):
+        sam = pysam.AlignmentFile(dir_path + "/data/example.sam")
+        coverage_calculator = MarkerCoverageCalculator(sam)
+        for read in sam.fetch():
+            self.assertEqual(
+              coverage_calculator.contribution_to_marker_coverage(read.reference_id, read.infer_query_length()),
+              compute_contribution_to_marker_coverage(sam, read)
+            )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,10 @@ import os
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
 import re
-from marker_alignments.main import read_alignments
+import tempfile
+from unittest import mock
+import marker_alignments.main
+from marker_alignments.main import read_alignments, region_batches
 
 r1=('id_1|taxon_1', 'marker_1', 'query_id', 0.948052, 0.141026)
 r2=('taxon_2', 'marker_2', 'second_query_id', 0.933333, 0.02327)
@@ -34,6 +37,12 @@ class ReadAlignments(unittest.TestCase):
         alignment_store = read_alignments(sam, None, pattern_taxon, pattern_marker, marker_to_taxon_id, min_mapq = 10, min_query_length = 0, min_match_identity = 0)
         self.assertStoreContent(alignment_store, [r1,r2,r3,r4])
 
+    def test_read_counts(self):
+        sam = pysam.AlignmentFile(dir_path + "/data/example.sam")
+        read_counts = {}
+        read_alignments(sam, None, pattern_taxon, pattern_marker, marker_to_taxon_id, min_mapq = 10, min_query_length = 0, min_match_identity = 0.94, read_counts = read_counts)
+        self.assertEqual(read_counts, {"unmapped": 0, "mapq": 2, "query_length": 0, "match_identity": 3, "kept": 1})
+
     def test_filter_query_length(self):
         sam = pysam.AlignmentFile(dir_path + "/data/example.sam")
         alignment_store = read_alignments(sam, None, pattern_taxon, pattern_marker, marker_to_taxon_id, min_mapq = 0, min_query_length = 25, min_match_identity = 0)
@@ -44,7 +53,51 @@ class ReadAlignments(unittest.TestCase):
         alignment_store = read_alignments(sam, None, pattern_taxon, pattern_marker, marker_to_taxon_id,  min_mapq = 0, min_query_length = 0, min_match_identity = 0.94 )
         self.assertStoreContent(alignment_store, [r1,r5,r6])
 
+    def test_unparsable_reference_name_fails_before_reading(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sam_path = tmp_dir + "/example.sam"
+            with open(dir_path + "/data/example.sam") as f:
+                lines = f.readlines()
+            # no reads align to this reference
+            lines.insert(1, "@SQ\tSN:no_separator\tLN:100\n")
+            with open(sam_path, 'w') as f:
+                f.writelines(lines)
+            with self.assertRaises(ValueError):
+                read_alignments(pysam.AlignmentFile(sam_path), None, pattern_taxon, pattern_marker, marker_to_taxon_id, 0, 0, 0)
+
+    def test_threads_same_as_serial(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bam_path = tmp_dir + "/example.bam"
+            pysam.sort("-o", bam_path, dir_path + "/data/example.sam")
+            pysam.index(bam_path)
+            serial = read_alignments(pysam.AlignmentFile(bam_path), None, pattern_taxon, pattern_marker, marker_to_taxon_id, 0, 0, 0)
+            expected = [t for t in serial.query('select * from alignment')]
+            for threads in [2, 3]:
+                with self.subTest(threads):
+                    alignment_store = read_alignments(pysam.AlignmentFile(bam_path), None, pattern_taxon, pattern_marker, marker_to_taxon_id, 0, 0, 0, threads = threads)
+                    self.assertStoreContent(alignment_store, expected)
 
+    def test_threads_with_references_split_into_regions(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bam_path = tmp_dir + "/example.bam"
+            pysam.sort("-o", bam_path, dir_path + "/data/example.sam")
+            pysam.index(bam_path)
+            serial_read_counts = {}
+            serial = read_alignments(pysam.AlignmentFile(bam_path), None, pattern_taxon, pattern_marker, marker_to_taxon_id, 0, 0, 0, read_counts = serial_read_counts)
+            expected = [t for t in serial.query('select * from alignment')]
+            for max_reads_per_batch in [1, 2]:
+                with self.subTest(max_reads_per_batch), mock.patch.object(marker_alignments.main, "max_reads_per_batch", max_reads_per_batch):
+                    batches = region_batches(pysam.AlignmentFile(bam_path), 1)
+                    self.assertGreater(len(batches), 1)
+                    read_counts = {}
+                    alignment_store = read_alignments(pysam.AlignmentFile(bam_path), None, pattern_taxon, pattern_marker, marker_to_taxon_id, 0, 0, 0, threads = 2, read_counts = read_counts)
+                    self.assertStoreContent(alignment_store, expected)
+                    self.assertEqual(read_counts, serial_read_counts)
+
+    def test_threads_unindexed_input(self):
+        sam = pysam.AlignmentFile(dir_path + "/data/example.sam")
+        alignment_store = read_alignments(sam, None, pattern_taxon, pattern_marker, marker_to_taxon_id, 0, 0, 0, threads = 2)
+        self.assertStoreContent(alignment_store, [r1,r2,r3,r4,r5,r6])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,52 @@
+import unittest
+import os
+import json
+import tempfile
+import contextlib
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+input_path = dir_path + "/data/example.sam"
+
+from marker_alignments.main import main
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+class RunReport(unittest.TestCase):
+
+    def test_run_report(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for backend in ["sqlite", "numpy"]:
+                with self.subTest(backend = backend):
+                    args = ["--input", input_path, "--output-type", "taxon_all", "--num-reads", "42", "--min-taxon-num-markers", "2", "--threshold-avg-match-identity-to-call-known-taxon", "0.97", "--backend", backend]
+                    expected_path = os.path.join(tmp_dir, "expected.tsv")
+                    main(args + ["--output", expected_path])
+                    output_path = os.path.join(tmp_dir, "out.tsv")
+                    report_path = os.path.join(tmp_dir, "report.json")
+                    with contextlib.redirect_stderr(open(os.devnull, 'w')):
+                        main(args + ["--output", output_path, "--run-report", report_path])
+                    self.assertEqual(read(output_path), read(expected_path))
+
+                    report = json.loads(read(report_path))
+                    stages = dict((stage["stage"], stage) for stage in report["stages"])
+                    self.assertEqual(list(stages), ["read_alignments", "cluster_markers_by_matches", "filter_taxa_on_num_markers_reads_and_alignments", "cluster_taxa_by_matches", "transform_taxa_on_thresholds_and_clusters", "write_outputs"])
+                    for stage in report["stages"]:
+                        self.assertGreaterEqual(stage["wall_seconds"], 0)
+                        self.assertGreaterEqual(stage["cpu_seconds"], 0)
+                    self.assertGreater(stages["read_alignments"]["rows_out"], 0)
+                    self.assertEqual(stages["cluster_markers_by_matches"]["rows_in"], stages["read_alignments"]["rows_out"])
+                    self.assertLess(stages["filter_taxa_on_num_markers_reads_and_alignments"]["rows_out"], stages["filter_taxa_on_num_markers_reads_and_alignments"]["rows_in"])
+                    self.assertEqual(stages["write_outputs"]["rows_out"], len(read(output_path).splitlines()) - 1)
+                    self.assertGreaterEqual(report["wall_seconds"], sum(stage["wall_seconds"] for stage in report["stages"]))
+
+    def test_streaming(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            report_path = os.path.join(tmp_dir, "report.json")
+            with contextlib.redirect_stderr(open(os.devnull, 'w')):
+                main(["--input", input_path, "--output", os.path.join(tmp_dir, "out.tsv"), "--streaming", "--run-report", report_path])
+            report = json.loads(read(report_path))
+            self.assertEqual([stage["stage"] for stage in report["stages"]], ["read_alignments", "write_outputs"])
+
+if __name__ == '__main__':
+    unittest.main()
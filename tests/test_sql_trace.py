@@ -0,0 +1,78 @@
+import unittest
+import os
+import json
+import sqlite3
+import tempfile
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+input_path = dir_path + "/data/example.sam"
+
+from marker_alignments.main import main
+from marker_alignments.store import AlignmentStore
+from marker_alignments.sql_trace import SqlTrace, plan_lines, nested_full_scans
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+def plan(sql):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("create table a (x, y)")
+    conn.execute("create table b (x, y)")
+    conn.execute("create index b_by_x on b (x)")
+    return conn.execute("explain query plan " + sql).fetchall()
+
+class SqlTraceTest(unittest.TestCase):
+
+    def test_nested_full_scans(self):
+        self.assertEqual(nested_full_scans(plan("select * from a, b where a.y > b.y")), ["SCAN b"])
+        self.assertEqual(nested_full_scans(plan("select a.x, (select count(*) from b where b.y > a.y) from a")), ["SCAN b"])
+        self.assertEqual(nested_full_scans(plan("select * from a, b where a.x = b.x")), [])
+        self.assertEqual(nested_full_scans(plan("select * from a where x in (select y from b)")), [])
+        self.assertEqual(plan_lines(plan("select a.x, (select count(*) from b where b.y > a.y) from a")), ["SCAN a", "CORRELATED SCALAR SUBQUERY 1", "  SCAN b"])
+
+    def test_store(self):
+        sql_trace = SqlTrace()
+        alignment_store = AlignmentStore(sql_trace = sql_trace)
+        alignment_store.start_bulk_write()
+        alignment_store.add_alignments([("taxon_" + str(ix % 3), "marker_" + str(ix % 5), "query_" + str(ix), 0.95, 0.1) for ix in range(0, 30)])
+        alignment_store.end_bulk_write()
+        alignment_store.modify_table_filter_taxa_on_num_markers_reads_and_alignments(min_num_markers = 2, min_num_reads = 0, min_num_alignments = 0)
+        statements = dict((record["sql"], record) for record in sql_trace.statements())
+
+        insert = statements["insert into new_alignment (taxon, marker, query, identity, coverage) values (?,?,?,?,?)"]
+        self.assertEqual(insert["calls"], 30)
+        self.assertEqual(insert["plan"], [])
+        self.assertIn("commit transaction", statements)
+        delete = statements["delete from alignment_ids where taxon not in (select taxon from kept_taxa)"]
+        self.assertEqual(delete["calls"], 1)
+        self.assertTrue(delete["full_scans"])
+        # read from a temporary table that's dropped after the filter
+        kept_taxa = [record for sql, record in statements.items() if sql.startswith("create temp table kept_taxa")]
+        self.assertEqual(len(kept_taxa), 1)
+        self.assertTrue(kept_taxa[0]["plan"])
+        self.assertTrue(kept_taxa[0]["temp_btrees"])
+        for record in statements.values():
+            self.assertGreaterEqual(record["seconds"], 0)
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            args = ["--input", input_path, "--output-type", "taxon_all", "--num-reads", "42", "--min-taxon-num-markers", "2"]
+            expected_path = os.path.join(tmp_dir, "expected.tsv")
+            main(args + ["--output", expected_path])
+            output_path = os.path.join(tmp_dir, "out.tsv")
+            trace_path = os.path.join(tmp_dir, "trace.json")
+            main(args + ["--output", output_path, "--sqlite-trace", trace_path])
+            self.assertEqual(read(output_path), read(expected_path))
+
+            trace = json.loads(read(trace_path))
+            self.assertTrue(trace["statements"])
+            self.assertTrue(trace["statements_with_full_scans"])
+            self.assertTrue(trace["statements_with_temp_btrees"])
+            self.assertEqual([record["seconds"] for record in trace["statements"]], sorted([record["seconds"] for record in trace["statements"]], reverse = True))
+
+            with self.assertRaises(ValueError):
+                main(args + ["--output", output_path, "--sqlite-trace", trace_path, "--backend", "numpy"])
+
+if __name__ == '__main__':
+    unittest.main()
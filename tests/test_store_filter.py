@@ -1,7 +1,11 @@
 import unittest
 import pysam
+import os
+import tempfile
 
-from marker_alignments.store import AlignmentStore
+from marker_alignments.store import AlignmentStore, sqlite_profile_options
+from marker_alignments.numpy_store import NumpyAlignmentStore
+from marker_alignments.write import get_output
 
 class StoreFilter(unittest.TestCase):
 
@@ -9,6 +13,75 @@ class StoreFilter(unittest.TestCase):
         content = [t for t in alignment_store.query('select * from alignment')]
         self.assertEqual(content, expected)
 
+    def test_add_alignments_in_batches(self):
+        rows = [('taxon_' + str(ix % 3), 'marker_' + str(ix % 5), 'query_' + str(ix), 1.0, 0.5) for ix in range(0, 25)]
+
+        alignment_store = AlignmentStore(batch_size = 7)
+        alignment_store.start_bulk_write()
+        alignment_store.add_alignments(rows)
+        alignment_store.end_bulk_write()
+        self.assertStoreContent(alignment_store, rows)
+
+    def test_add_alignments_outside_bulk_write(self):
+        for alignment_store_class in [AlignmentStore, NumpyAlignmentStore]:
+            with self.subTest(alignment_store_class.__name__):
+                alignment_store = alignment_store_class()
+                alignment_store.add_alignments([('taxon_1', 'marker_1', 'query_1', 1.0, 0.5)])
+                self.assertEqual(alignment_store.num_alignments(), 1)
+                alignment_store.add_alignment('taxon_1', 'marker_2', 'query_2', 0.9, 0.5)
+                alignment_store.add_alignments([('taxon_2', 'marker_1', 'query_3', 1.0, 0.5)])
+                self.assertEqual(alignment_store.num_alignments(), 3)
+
+        alignment_store = AlignmentStore()
+        alignment_store.add_alignments([('taxon_1', 'marker_1', 'query_2', 1.0, 0.5)])
+        alignment_store.add_alignment('taxon_1', 'marker_1', 'query_1', 0.9, 0.5)
+        self.assertStoreContent(alignment_store, [('taxon_1', 'marker_1', 'query_2', 1.0, 0.5), ('taxon_1', 'marker_1', 'query_1', 0.9, 0.5)])
+
+    def test_sqlite_profiles_on_disk(self):
+        rows = [('taxon_' + str(ix % 3), 'marker_' + str(ix % 5), 'query_' + str(ix), 1.0, 0.5) for ix in range(0, 25)]
+        for sqlite_profile in sqlite_profile_options:
+            with self.subTest(sqlite_profile), tempfile.TemporaryDirectory() as tmp_dir:
+                alignment_store = AlignmentStore(db_path = os.path.join(tmp_dir, "alignments.db"), sqlite_profile = sqlite_profile)
+                synchronous = alignment_store.pragma("synchronous")
+                alignment_store.start_bulk_write()
+                alignment_store.add_alignments(rows)
+                alignment_store.end_bulk_write()
+                self.assertEqual(alignment_store.pragma("synchronous"), synchronous)
+                self.assertStoreContent(alignment_store, rows)
+
+    def test_save_and_load_alignments(self):
+        rows = [('taxon_' + str(ix % 3), 'marker_' + str(ix % 5), 'query_' + str(ix % 7), 1.0, 0.5) for ix in range(0, 25)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            alignment_store = AlignmentStore(db_path = os.path.join(tmp_dir, "alignments.db"))
+            alignment_store.start_bulk_write()
+            alignment_store.add_alignments(rows)
+            alignment_store.end_bulk_write()
+            alignment_store.create_indexes()
+            alignment_store.cluster_markers_by_matches()
+            alignment_store.modify_table_filter_taxa_on_num_markers_reads_and_alignments(min_num_markers = 0, min_num_reads = 0, min_num_alignments = 0)
+            saved_path = os.path.join(tmp_dir, "saved.db")
+            alignment_store.save_alignments(saved_path)
+            # saving again replaces the earlier copy
+            alignment_store.save_alignments(saved_path)
+
+            loaded_store = AlignmentStore()
+            loaded_store.load_alignments(saved_path)
+            self.assertStoreContent(loaded_store, list(alignment_store.query('select * from alignment')))
+            self.assertEqual(loaded_store.applied_filters(), ["num_markers"])
+            self.assertTrue(loaded_store.has_marker_clusters())
+            schema = "select type, name, sql from sqlite_master order by name"
+            self.assertEqual(list(loaded_store.query(schema)), list(alignment_store.query(schema)))
+            self.assertEqual(loaded_store.pragma("user_version"), alignment_store.pragma("user_version"))
+
+            not_a_store_path = os.path.join(tmp_dir, "other.db")
+            AlignmentStore(db_path = not_a_store_path).query("pragma user_version = 0")
+            with self.assertRaises(ValueError):
+                AlignmentStore().load_alignments(not_a_store_path)
+
+    def test_unknown_sqlite_profile(self):
+        with self.assertRaises(ValueError):
+            AlignmentStore(sqlite_profile = "fastest")
+
     def test_filter_reads(self):
         r111 = ('taxon_1', 'marker_1','query_1', 1.0, 1.0)
         r112 = ('taxon_1', 'marker_1','query_2', 1.0, 1.0)
@@ -24,6 +97,36 @@ class StoreFilter(unittest.TestCase):
         alignment_store.modify_table_filter_taxa_on_num_markers_reads_and_alignments(min_num_markers = 1, min_num_reads = 2, min_num_alignments = 1)
         self.assertStoreContent(alignment_store, [r111, r112])
 
+    def test_filter_snapshots(self):
+        r111 = ('taxon_1', 'marker_1','query_1', 1.0, 1.0)
+        r112 = ('taxon_1', 'marker_1','query_2', 1.0, 1.0)
+        r223 = ('taxon_2', 'marker_2','query_3', 1.0, 1.0)
+        for keep_filter_snapshots in [False, True]:
+            with self.subTest(keep_filter_snapshots):
+                alignment_store = AlignmentStore(keep_filter_snapshots = keep_filter_snapshots)
+                for r in [r111, r112, r223]:
+                  alignment_store.add_alignment(*r)
+                alignment_store.modify_table_filter_taxa_on_num_markers_reads_and_alignments(min_num_markers = 1, min_num_reads = 2, min_num_alignments = 1)
+                self.assertStoreContent(alignment_store, [r111, r112])
+                tables = [t for t, in alignment_store.query("select name from sqlite_master where name like 'alignment_pre_filter_on_%'")]
+                self.assertEqual(tables, ['alignment_pre_filter_on_num_markers'] if keep_filter_snapshots else [])
+
+    def test_query_stats_after_filter(self):
+        r111 = ('taxon_1', 'marker_1','query_1', 1.0, 1.0)
+        r112 = ('taxon_1', 'marker_1','query_2', 1.0, 1.0)
+        r222 = ('taxon_2', 'marker_2','query_2', 1.0, 1.0)
+
+        alignment_store = AlignmentStore()
+        for r in [r111, r112, r222]:
+          alignment_store.add_alignment(*r)
+        header, lines = get_output(alignment_store, 'marker_read_count', None)
+        self.assertEqual([l[:4] for l in lines], [('taxon_1', 'marker_1', 2, 1.5), ('taxon_2', 'marker_2', 1, 0.5)])
+
+        # query_2 now only has one alignment, so it counts fully
+        alignment_store.modify_table_filter_taxa_on_num_markers_reads_and_alignments(min_num_markers = 1, min_num_reads = 2, min_num_alignments = 1)
+        header, lines = get_output(alignment_store, 'marker_read_count', None)
+        self.assertEqual([l[:4] for l in lines], [('taxon_1', 'marker_1', 2, 2.0)])
+
     def test_filter_alignments(self):
         r111 = ('taxon_1', 'marker_1','query_1', 1.0, 1.0)
         r112 = ('taxon_1', 'marker_1','query_2', 1.0, 1.0)
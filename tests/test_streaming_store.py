@@ -0,0 +1,79 @@
+import unittest
+import pysam
+import random
+import itertools
+import os
+import tempfile
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+input_path = dir_path + "/data/example.sam"
+
+from marker_alignments.main import main
+from marker_alignments.store import AlignmentStore
+from marker_alignments.streaming_store import StreamingMarkerStore, streaming_output_type_options
+from marker_alignments.write import get_output
+from tests.helpers import random_alignments, SameLinesMixin
+
+# the streaming store needs the alignments of each query together
+def alignments_by_query(seed):
+    return sorted(random_alignments(seed), key = lambda alignment: alignment[2])
+
+def outputs(alignment_store_class, alignments):
+    alignment_store = alignment_store_class()
+    alignment_store.start_bulk_write()
+    alignment_store.add_alignments(alignments)
+    alignment_store.end_bulk_write()
+    result = {}
+    for output_type in streaming_output_type_options:
+        header, lines = get_output(alignment_store, output_type, 1000)
+        result[output_type] = (tuple(header), list(lines))
+    return result
+
+class StreamingStore(unittest.TestCase, SameLinesMixin):
+
+    def test_same_as_store(self):
+        for seed in range(0, 3):
+            alignments = alignments_by_query(seed)
+            expected = outputs(AlignmentStore, alignments)
+            result = outputs(StreamingMarkerStore, alignments)
+            for output_type in streaming_output_type_options:
+                with self.subTest(seed = seed, output_type = output_type):
+                    header, lines = result[output_type]
+                    expected_header, expected_lines = expected[output_type]
+                    self.assertEqual(header, expected_header)
+                    self.assertSameLines(lines, expected_lines)
+
+    def test_order_of_queries(self):
+        alignments = alignments_by_query(0)
+        queries = [list(group) for query, group in itertools.groupby(alignments, key = lambda alignment: alignment[2])]
+        random.Random(1).shuffle(queries)
+        expected = outputs(StreamingMarkerStore, alignments)
+        result = outputs(StreamingMarkerStore, list(itertools.chain.from_iterable(queries)))
+        for output_type in streaming_output_type_options:
+            with self.subTest(output_type = output_type):
+                header, lines = result[output_type]
+                expected_header, expected_lines = expected[output_type]
+                self.assertEqual(header, expected_header)
+                self.assertSameLines(lines, expected_lines)
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # the example has alignments of a query apart
+            sorted_input_path = os.path.join(tmp_dir, "example.sorted.sam")
+            pysam.sort("-n", "-O", "sam", "-o", sorted_input_path, input_path)
+            for output_type in streaming_output_type_options:
+                with self.subTest(output_type):
+                    expected_path = os.path.join(tmp_dir, "expected.tsv")
+                    output_path = os.path.join(tmp_dir, "out.tsv")
+                    main(["--input", input_path, "--output", expected_path, "--output-type", output_type, "--num-reads", "42"])
+                    main(["--input", sorted_input_path, "--output", output_path, "--output-type", output_type, "--num-reads", "42", "--streaming"])
+                    with open(output_path) as f, open(expected_path) as g:
+                        self.assertEqual(f.read(), g.read())
+
+            output_path = os.path.join(tmp_dir, "out.tsv")
+            for args in [["--output-type", "pairs_of_taxa_shared_queries"], ["--min-taxon-num-markers", "2"], ["--sqlite-db-path", os.path.join(tmp_dir, "alignments.db")]]:
+                with self.subTest(args = args), self.assertRaises(ValueError):
+                    main(["--input", input_path, "--output", output_path, "--streaming", *args])
+
+if __name__ == '__main__':
+    unittest.main()
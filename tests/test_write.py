@@ -0,0 +1,96 @@
+import unittest
+import gzip
+import io
+import os
+import tempfile
+import contextlib
+
+from marker_alignments.store import AlignmentStore
+from marker_alignments.numpy_store import NumpyAlignmentStore
+from marker_alignments.write import write, write_lines, write_outputs, marker_stats_sqls, output_type_options, get_output, field_formats
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+alignments = [('taxon_' + str(ix % 3), 'marker_' + str(ix % 5), 'query_' + str(ix % 7), 0.9 + 0.01 * (ix % 4), 0.5) for ix in range(0, 25)]
+
+def store_with_alignments(store_class):
+    alignment_store = store_class()
+    alignment_store.start_bulk_write()
+    alignment_store.add_alignments(alignments)
+    alignment_store.end_bulk_write()
+    return alignment_store
+
+class Write(unittest.TestCase):
+
+    def written_text(self, output_path, store_class = AlignmentStore, **kwargs):
+        write(store_with_alignments(store_class), "marker_all", output_path, 1000, **kwargs)
+        if output_path.endswith(".gz"):
+            with gzip.open(output_path, 'rt') as f:
+                return f.read()
+        if output_path.endswith(".zst"):
+            with zstandard.open(output_path, 'rt') as f:
+                return f.read()
+        with open(output_path) as f:
+            return f.read()
+
+    def test_batches(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected = self.written_text(os.path.join(tmp_dir, "out.tsv"))
+            self.assertEqual(len(expected.splitlines()), 16)
+            for store_class in [AlignmentStore, NumpyAlignmentStore]:
+                for batch_size in [1, 2, 13, 100]:
+                    with self.subTest(store_class = store_class.__name__, batch_size = batch_size):
+                        self.assertEqual(self.written_text(os.path.join(tmp_dir, "out.tsv"), store_class, batch_size = batch_size), expected)
+
+    def test_gzip(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected = self.written_text(os.path.join(tmp_dir, "out.tsv"))
+            self.assertEqual(self.written_text(os.path.join(tmp_dir, "out.tsv.gz")), expected)
+
+    @unittest.skipUnless(zstandard, "zstandard is not installed")
+    def test_zstandard(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected = self.written_text(os.path.join(tmp_dir, "out.tsv"))
+            self.assertEqual(self.written_text(os.path.join(tmp_dir, "out.tsv.zst")), expected)
+
+    def test_stdout(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected = self.written_text(os.path.join(tmp_dir, "out.tsv"))
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            write(store_with_alignments(AlignmentStore), "marker_all", "-", 1000)
+        self.assertEqual(stdout.getvalue(), expected)
+
+    def test_integer_columns(self):
+        for store_class in [AlignmentStore, NumpyAlignmentStore]:
+            alignment_store = store_with_alignments(store_class)
+            alignment_store.cluster_markers_by_matches()
+            alignment_store.cluster_taxa_by_matches()
+            for output_type in output_type_options:
+                with self.subTest(store_class = store_class.__name__, output_type = output_type):
+                    header, lines = get_output(alignment_store, output_type, 1000)
+                    lines = list(lines)
+                    self.assertTrue(lines)
+                    for ix, field in enumerate(header):
+                        if field_formats[field] == ":d":
+                            self.assertEqual(set(type(line[ix]) for line in lines), {int})
+
+        with self.assertRaises(ValueError):
+            write_lines(io.StringIO(), ["taxon", "marker", "marker_alignment_count"], [("taxon_1", "marker_1", 2.5)], 10)
+
+    def test_write_outputs_from_marker_stats(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            outputs = [(output_type, os.path.join(tmp_dir, output_type + ".tsv")) for output_type in marker_stats_sqls]
+            write_outputs(store_with_alignments(AlignmentStore), outputs, 1000)
+            for output_type, output_path in outputs:
+                with self.subTest(output_type):
+                    expected_path = os.path.join(tmp_dir, "expected.tsv")
+                    write(store_with_alignments(AlignmentStore), output_type, expected_path, 1000)
+                    with open(output_path) as f, open(expected_path) as g:
+                        self.assertEqual(f.read(), g.read())
+
+if __name__ == '__main__':
+    unittest.main()